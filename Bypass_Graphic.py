@@ -1,6 +1,8 @@
+import argparse
 import os
 import matplotlib.pyplot as plt
 from PIL import Image
+from figure_build import FigureBuild
 
 ''' DECLARACIONES '''
 base_path = "../../TFG"
@@ -10,7 +12,14 @@ output_base = os.path.join(base_path, "graphics")
 output_path = os.path.join(output_base, "bypass")
 os.makedirs(output_path, exist_ok=True)
 
+# Configurar argumentos
+parser = argparse.ArgumentParser()
+parser.add_argument('--force', action='store_true', help='Regenerar todas las figuras aunque sus imágenes no hayan cambiado')
+
 ''' ACCIONES '''
+args = parser.parse_args()
+build = FigureBuild(output_path, force=args.force, dependencies=[__file__])
+
 # Cargar imágenes originales
 original_images = sorted([
     os.path.join(original_path, f)
@@ -35,33 +44,46 @@ for case in bypass_cases:
     ])
     bypass_images_dict[case] = imgs
 
-# Crear figura general (todos los bypass juntos)
-fig, axes = plt.subplots(
-    nrows=len(original_images), ncols=len(bypass_cases) + 1,
-    figsize=(3.5 * (len(bypass_cases) + 1), 3.2 * len(original_images)),
-    constrained_layout=True
+# Crear figura general (todos los bypass juntos), solo si alguna imagen ha cambiado
+output_general = os.path.join(output_path, "tabla_bypass_completa.png")
+column_titles = ["Original"] + [case.replace("_", " ") for case in bypass_cases]
+digest = build.needs_build(
+    output_general,
+    original_images + [path for case in bypass_cases for path in bypass_images_dict[case]],
+    {"columnas": column_titles, "filas": len(original_images), "dpi": 300}
 )
+if digest is not None:
+    fig, axes = plt.subplots(
+        nrows=len(original_images), ncols=len(bypass_cases) + 1,
+        figsize=(3.5 * (len(bypass_cases) + 1), 3.2 * len(original_images)),
+        constrained_layout=True
+    )
 
-column_titles = ["Original"] + [case.replace("_", " ") for case in bypass_cases]
-for ax, title in zip(axes[0], column_titles):
-    ax.set_title(title, fontsize=15, fontweight='bold', pad=12)
-
-for i, orig_path in enumerate(original_images):
-    axes[i, 0].imshow(Image.open(orig_path))
-    axes[i, 0].axis("off")
-    for j, case in enumerate(bypass_cases):
-        if i < len(bypass_images_dict[case]):
-            axes[i, j + 1].imshow(Image.open(bypass_images_dict[case][i]))
-        axes[i, j + 1].axis("off")
-
-#  Guardar figura general
-output_general = os.path.join(output_path, "tabla_bypass_completa.png")
-plt.savefig(output_general, dpi=300, bbox_inches="tight", facecolor="white")
-plt.close()
-print(f"Tabla general guardada en: {output_general}\n")
+    for ax, title in zip(axes[0], column_titles):
+        ax.set_title(title, fontsize=15, fontweight='bold', pad=12)
+
+    for i, orig_path in enumerate(original_images):
+        axes[i, 0].imshow(Image.open(orig_path))
+        axes[i, 0].axis("off")
+        for j, case in enumerate(bypass_cases):
+            if i < len(bypass_images_dict[case]):
+                axes[i, j + 1].imshow(Image.open(bypass_images_dict[case][i]))
+            axes[i, j + 1].axis("off")
+
+    #  Guardar figura general
+    plt.savefig(output_general, dpi=300, bbox_inches="tight", facecolor="white")
+    plt.close()
+    build.done(output_general, digest)
+    print(f"Tabla general guardada en: {output_general}\n")
 
 # Generar una imagen horizontal por cada nodo bypass
 for case in bypass_cases:
+    filename = f"comparativa_{case}_horizontal.png"
+    output_case = os.path.join(output_path, filename)
+    digest = build.needs_build(output_case, original_images + bypass_images_dict[case], {"caso": case, "dpi": 300})
+    if digest is None:
+        continue
+
     fig, axes = plt.subplots(
         nrows=2, ncols=len(original_images),
         figsize=(3.2 * len(original_images), 6),
@@ -79,8 +101,9 @@ for case in bypass_cases:
     for ax in axes[1]:
         ax.set_title(case.replace("_", " "), fontsize=13, fontweight="bold", pad=8)
 
-    filename = f"comparativa_{case}_horizontal.png"
-    output_case = os.path.join(output_path, filename)
     plt.savefig(output_case, dpi=300, bbox_inches="tight", facecolor="white")
     plt.close()
+    build.done(output_case, digest)
     print(f"Comparativa horizontal individual guardada: {output_case}")
+
+build.report()
@@ -1,6 +1,8 @@
+import argparse
 import os
 import matplotlib.pyplot as plt
 from PIL import Image
+from figure_build import FigureBuild
 
 ''' DECLARACIONES '''
 base_path = "../../TFG"
@@ -9,7 +11,14 @@ generated_path = os.path.join(base_path, "data", "original")
 output_path = os.path.join(base_path, "graphics/original")
 os.makedirs(output_path, exist_ok=True)
 
+# Configurar argumentos
+parser = argparse.ArgumentParser()
+parser.add_argument('--force', action='store_true', help='Regenerar la figura aunque sus imágenes no hayan cambiado')
+
 ''' ACCIONES '''
+args = parser.parse_args()
+build = FigureBuild(output_path, force=args.force, dependencies=[__file__])
+
 # Cargar imágenes
 reference_images = sorted([
     os.path.join(reference_path, f)
@@ -27,6 +36,13 @@ num_images = min(len(reference_images), len(generated_images))
 if num_images == 0:
     raise ValueError("No hay imágenes válidas.")
 
+# Omitir la figura si sus imágenes no han cambiado desde la última ejecución
+output_file = os.path.join(output_path, "comparativa_referencia_vs_generada.png")
+digest = build.needs_build(output_file, reference_images[:num_images] + generated_images[:num_images], {"dpi": 300})
+if digest is None:
+    print(f" Imagen al día, no se regenera: {output_file}")
+    raise SystemExit
+
 # Crear figura
 fig, axes = plt.subplots(
     nrows=2, ncols=num_images,
@@ -54,8 +70,8 @@ axes[1, 0].text(
 )
 
 # Guardar imagen final sin mostrarla
-output_file = os.path.join(output_path, "comparativa_referencia_vs_generada.png")
 plt.savefig(output_file, dpi=300, bbox_inches="tight", facecolor="white")
 plt.close()  # Cerramos explícitamente la figura
+build.done(output_file, digest)
 
 print(f" Imagen final guardada sin mostrar en: {output_file}")
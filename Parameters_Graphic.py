@@ -1,8 +1,10 @@
+import argparse
 import os
-import matplotlib.pyplot as plt
-from PIL import Image
 import re
 from pathlib import Path
+import contact_sheet
+from contact_sheet import THUMBNAIL_CACHE, render_sheets
+from figure_build import FigureBuild
 
 ''' DECLARACIONES '''
 base_path = Path("../../TFG")
@@ -13,6 +15,15 @@ output_path.mkdir(parents=True, exist_ok=True)
 # Nodos con tratamiento especial
 nodos_combinados = {"cliptextencode", "photomakerencode"}
 
+# Configurar argumentos
+parser = argparse.ArgumentParser()
+parser.add_argument('--workers', type=int, default=None, help='Número de procesos que dibujan las figuras en paralelo (por defecto, todos los núcleos)')
+parser.add_argument('--cell_size', type=int, default=None, help='Lado en píxeles de cada imagen de la tabla (por defecto 960, es decir, celdas de 3.2 pulgadas a 300 dpi como en la memoria; 480 con --draft)')
+parser.add_argument('--dpi', type=int, default=None, help='Resolución de las figuras (por defecto 300; 150 con --draft)')
+parser.add_argument('--draft', action='store_true', help='Figuras de borrador más rápidas: miniaturas de 480 píxeles a 150 dpi (mismo tamaño en pulgadas, la mitad de resolución)')
+parser.add_argument('--thumbnail_cache', type=str, default=THUMBNAIL_CACHE, help='Carpeta de la caché de miniaturas ("" para desactivarla)')
+parser.add_argument('--force', action='store_true', help='Regenerar todas las figuras aunque sus imágenes no hayan cambiado')
+
 # Funciones auxiliares
 def extraer_retrato(nombre_archivo):
     '''
@@ -96,120 +107,129 @@ def clave_orden(valor):
     return (2, str(valor))
 
 
-''' ACCIONES '''
-# Iterar sobre cada directorio
-for nodo in sorted(os.listdir(parameters_path)):
-    nodo_path = parameters_path / nodo
-    # Saltar si no es un directorio
-    if not nodo_path.is_dir():
-        continue
-
-    # Nodos especiales
-    if nodo.lower() in nodos_combinados:
-        # Diccionario para almacenar las imágenes por valor de parámetro
-        columnas = {}
-        # Iterar sobre los subdirectorios dentro del nodo combinado
-        for subdir in sorted(os.listdir(nodo_path)):
-            sub_path = nodo_path / subdir
-            if not sub_path.is_dir():
-                continue
-            # Buscar imágenes dentro de cada subdirectorio
-            for fname in sorted(os.listdir(sub_path)):
-                if fname.lower().endswith((".png", ".jpg", ".jpeg")):
-                    # Extraer el tipo de retrato y almacenar la ruta de la imagen
-                    retrato = extraer_retrato(fname)
-                    columnas.setdefault(subdir, {})[retrato] = sub_path / fname
-
-        # Ordenar las columnas usando la clave de ordenamiento
-        sorted_columnas = sorted(columnas.items(), key=lambda x: clave_orden(x[0]))
-        # Obtener todos los nombres de retratos únicos dentro de la imagen
-        retratos = sorted({r for col in columnas.values() for r in col})
-
-        # Configurar plot
-        fig, axes = plt.subplots(
-            nrows=len(retratos), ncols=len(sorted_columnas),
-            figsize=(3.2 * len(sorted_columnas), 3.2 * len(retratos)),
-            constrained_layout=True
-        )
-
-        if len(retratos) == 1:
-            axes = [axes]
-        if len(sorted_columnas) == 1:
-            axes = [[row] for row in axes]
-
-        # Iterar sobre las columnas y filas para colocar cada imagen en su posición
-        for col_idx, (valor, retrato_dict) in enumerate(sorted_columnas):
-            for row_idx, retrato in enumerate(retratos):
-                ax = axes[row_idx][col_idx]
-                img_path = retrato_dict.get(retrato)
-                if img_path:
-                    ax.imshow(Image.open(img_path))
-                ax.axis("off")
-
-        # Establecer los títulos de las columnas
-        for col_idx, (valor, _) in enumerate(sorted_columnas):
-            axes[0][col_idx].set_title(str(valor), fontsize=11, fontweight="bold", pad=10)
-
-        # Guardar la imagen generada
-        output_file = output_path / f"{nodo}_completo.png"
-        plt.savefig(str(output_file), dpi=300, bbox_inches="tight", facecolor="white")
-        plt.close()
-        print(f" Tabla combinada para {nodo} guardada: {output_file}")
-
-    else: # Nodos con parámetros individuales
-        # Iterar sobre cada subdirectorio
-        for parametro in sorted(os.listdir(nodo_path)):
-            param_path = nodo_path / parametro
-            if not param_path.is_dir():
-                continue
-            # Diccionario para almacenar las imágenes por valor de parámetro y retrato
+def tabla(columnas, titulo, output_file, fontsize, mensaje, args):
+    '''
+    Crea la especificación de una tabla: una columna por valor del parámetro y una fila por retrato.
+
+    :param columnas: lista ordenada de tuplas (valor, {retrato: ruta de la imagen})
+    :param titulo: función que convierte un valor en el título de su columna
+    :param output_file: ruta de la figura
+    :param fontsize: tamaño de los títulos
+    :param mensaje: texto que se muestra al guardar la figura
+    :param args: argumentos del script
+    :return: diccionario para contact_sheet.render_sheet
+    '''
+    # Obtener todos los nombres de retratos únicos presentes
+    retratos = sorted({r for _, col in columnas for r in col})
+    return {
+        "output": output_file,
+        "grid": [[retrato_dict.get(retrato) for _, retrato_dict in columnas] for retrato in retratos],
+        "column_titles": [titulo(valor) for valor, _ in columnas],
+        "fontsize": fontsize,
+        "cell_size": args.cell_size,
+        "dpi": args.dpi,
+        "cache_dir": args.thumbnail_cache,
+        "message": mensaje,
+    }
+
+
+def tablas_parametros(args):
+    '''
+    Recorre la carpeta de parámetros y crea la especificación de cada tabla.
+
+    :param args: argumentos del script
+    :return: lista de especificaciones
+    '''
+    especificaciones = []
+    # Iterar sobre cada directorio
+    for nodo in sorted(os.listdir(parameters_path)):
+        nodo_path = parameters_path / nodo
+        # Saltar si no es un directorio
+        if not nodo_path.is_dir():
+            continue
+
+        # Nodos especiales
+        if nodo.lower() in nodos_combinados:
+            # Diccionario para almacenar las imágenes por valor de parámetro
             columnas = {}
-            # Iterar sobre los archivos de imagen dentro del directorio del parámetro
-            for fname in sorted(os.listdir(param_path)):
-                if fname.lower().endswith((".png", ".jpg", ".jpeg")):
-                    retrato = extraer_retrato(fname)
-                    valor = extraer_valor_parametro(fname, parametro)
-                    # Almacenar la ruta de la imagen, indexada por el valor del parámetro y el nombre del retrato
-                    columnas.setdefault(valor, {})[retrato] = param_path / fname
-
-            # Intentar ordenar las columnas
-            try:
-                sorted_columnas = sorted(columnas.items(), key=lambda x: clave_orden(x[0]))
-            except Exception as e:
-                print(f" Error al ordenar columnas en {nodo}/{parametro}: {e}")
+            # Iterar sobre los subdirectorios dentro del nodo combinado
+            for subdir in sorted(os.listdir(nodo_path)):
+                sub_path = nodo_path / subdir
+                if not sub_path.is_dir():
+                    continue
+                # Buscar imágenes dentro de cada subdirectorio
+                for fname in sorted(os.listdir(sub_path)):
+                    if fname.lower().endswith((".png", ".jpg", ".jpeg")):
+                        # Extraer el tipo de retrato y almacenar la ruta de la imagen
+                        retrato = extraer_retrato(fname)
+                        columnas.setdefault(subdir, {})[retrato] = sub_path / fname
+
+            if not columnas:
                 continue
+            # Ordenar las columnas usando la clave de ordenamiento
+            sorted_columnas = sorted(columnas.items(), key=lambda x: clave_orden(x[0]))
+            output_file = output_path / f"{nodo}_completo.png"
+            especificaciones.append(tabla(
+                sorted_columnas, str, output_file, 11, f" Tabla combinada para {nodo} guardada: {output_file}", args
+            ))
+
+        else: # Nodos con parámetros individuales
+            # Iterar sobre cada subdirectorio
+            for parametro in sorted(os.listdir(nodo_path)):
+                param_path = nodo_path / parametro
+                if not param_path.is_dir():
+                    continue
+                # Diccionario para almacenar las imágenes por valor de parámetro y retrato
+                columnas = {}
+                # Iterar sobre los archivos de imagen dentro del directorio del parámetro
+                for fname in sorted(os.listdir(param_path)):
+                    if fname.lower().endswith((".png", ".jpg", ".jpeg")):
+                        retrato = extraer_retrato(fname)
+                        valor = extraer_valor_parametro(fname, parametro)
+                        # Almacenar la ruta de la imagen, indexada por el valor del parámetro y el nombre del retrato
+                        columnas.setdefault(valor, {})[retrato] = param_path / fname
+
+                if not columnas:
+                    continue
+                # Intentar ordenar las columnas
+                try:
+                    sorted_columnas = sorted(columnas.items(), key=lambda x: clave_orden(x[0]))
+                except Exception as e:
+                    print(f" Error al ordenar columnas en {nodo}/{parametro}: {e}")
+                    continue
+
+                filename_safe = f"{nodo}_{parametro}".replace(":", "_")
+                output_file = output_path / f"{filename_safe}.png"
+                especificaciones.append(tabla(
+                    sorted_columnas, lambda valor: f"{valor:.2f}" if isinstance(valor, float) else str(valor),
+                    output_file, 12, f" Tabla para {nodo}/{parametro} guardada en: {output_file}", args
+                ))
+    return especificaciones
 
-            # Obtener todos los nombres de todos los retratos únicos presentes
-            retratos = sorted({r for col in columnas.values() for r in col})
-
-            # Configurar plot
-            fig, axes = plt.subplots(
-                nrows=len(retratos), ncols=len(sorted_columnas),
-                figsize=(3.2 * len(sorted_columnas), 3.2 * len(retratos)),
-                constrained_layout=True
-            )
-
-            if len(retratos) == 1:
-                axes = [axes]
-            if len(sorted_columnas) == 1:
-                axes = [[row] for row in axes]
-
-            # Iterar sobre las columnas y las filas para colocar cada imagen
-            for col_idx, (valor, retrato_dict) in enumerate(sorted_columnas):
-                for row_idx, retrato in enumerate(retratos):
-                    ax = axes[row_idx][col_idx]
-                    img_path = retrato_dict.get(retrato)
-                    if img_path:
-                        ax.imshow(Image.open(img_path))
-                    ax.axis("off")
-            # Establecer los títulos de las columnas
-            for col_idx, (valor, _) in enumerate(sorted_columnas):
-                titulo = f"{valor:.2f}" if isinstance(valor, float) else str(valor)
-                axes[0][col_idx].set_title(titulo, fontsize=12, fontweight="bold", pad=10)
-
-            # Guardar la figura
-            filename_safe = f"{nodo}_{parametro}".replace(":", "_")
-            output_file = output_path / f"{filename_safe}.png"
-            plt.savefig(str(output_file), dpi=300, bbox_inches="tight", facecolor="white")
-            plt.close()
-            print(f" Tabla para {nodo}/{parametro} guardada en: {output_file}")
+
+''' ACCIONES '''
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # Resolución de la memoria por defecto; --draft reduce a la mitad los píxeles de cada celda
+    if args.cell_size is None:
+        args.cell_size = 480 if args.draft else 960
+    if args.dpi is None:
+        args.dpi = 150 if args.draft else 300
+
+    # Recorrer las carpetas una vez y quedarse con las tablas cuyas imágenes o composición han cambiado
+    build = FigureBuild(output_path, force=args.force, dependencies=[__file__, contact_sheet.__file__])
+    pendientes = {}
+    for spec in tablas_parametros(args):
+        entradas = [path for fila in spec["grid"] for path in fila]
+        composicion = {key: spec[key] for key in ("column_titles", "fontsize", "cell_size", "dpi")}
+        composicion["filas"] = len(spec["grid"])
+        huella = build.needs_build(spec["output"], entradas, composicion)
+        if huella is not None:
+            pendientes[spec["output"]] = (spec, huella)
+
+    # Dibujar en paralelo las tablas desactualizadas
+    for output_file in render_sheets([spec for spec, _ in pendientes.values()], args.workers):
+        spec, huella = pendientes[output_file]
+        build.done(output_file, huella)
+        print(spec["message"])
+    build.report()
@@ -0,0 +1,338 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import cv2 as cv
+import numpy as np
+import face_comparison as fc
+from results_store import RESULT_COLUMNS, write_results
+
+''' DECLARACIONES'''
+# Etapas medidas por imagen generada (y la escritura final de resultados). Cada una es una función de
+# face_comparison.py o un método del detector o del reconocedor; "hash" es el resto de compute_face_data
+STAGES = ["read", "hash", "decode", "detect", "align", "feature", "match", "write_csv", "write_parquet"]
+
+# Archivo que marca una carpeta de trabajo creada por este script (solo esas se pueden borrar)
+WORK_DIR_MARKER = ".benchmark_face_comparison"
+
+# Tamaño al que face_comparison.py escala las imágenes antes de la detección
+TARGET_SIZE = 512
+
+# Configurar argumentos
+parser = argparse.ArgumentParser(description='Benchmark de face_comparison.py sobre un árbol sintético con la estructura de outputs_refacer')
+parser.add_argument('--real_dir', type=str, default='inputs_refacer_real', help='Carpeta con las imágenes reales de las que se generan las sintéticas')
+parser.add_argument('--work_dir', type=str, default='', help='Carpeta de trabajo donde se crea el árbol sintético (por defecto, una carpeta temporal). Debe no existir o haber sido creada por este script')
+parser.add_argument('--output', type=str, default='benchmark_face_comparison.json', help='Archivo .json con los resultados')
+parser.add_argument('--baseline', type=str, default='', help='Archivo .json de una ejecución anterior con el que comparar')
+parser.add_argument('--bypass_nodes', type=int, default=4, help='Número de carpetas bypass/<nodo>')
+parser.add_argument('--parameter_nodes', type=int, default=3, help='Número de nodos en parameters/')
+parser.add_argument('--values', type=int, default=3, help='Valores simples por parámetro (parameters/<nodo>/<parámetro>/<valor>)')
+parser.add_argument('--combinations', type=int, default=2, help='Carpetas combination_ por nodo')
+parser.add_argument('--people', type=int, default=0, help='Número de personas por prueba (0 para todas las imágenes reales)')
+parser.add_argument('--image_size', type=int, default=1024, help='Lado en píxeles de las imágenes sintéticas (las salidas de SDXL miden 1024 o más)')
+parser.add_argument('--format', type=str, default='png', choices=['png', 'jpg', 'webp'], help='Formato de las imágenes sintéticas')
+parser.add_argument('--seed', type=int, default=0, help='Semilla de las variaciones de las imágenes sintéticas')
+parser.add_argument('--scale', '-sc', type=float, default=fc.DECODE_SCALE, help='Factor de escala de la decodificación (ver face_comparison.py)')
+parser.add_argument('--end_to_end', action='store_true', help='Ejecutar además face_comparison.py completo sobre el árbol y medir su tiempo y memoria')
+parser.add_argument('--workers', type=int, default=1, help='Procesos de face_comparison.py en la ejecución completa')
+parser.add_argument('--keep', action='store_true', help='Conservar el árbol sintético al terminar')
+parser.add_argument('--face_detection_model', '-fd', type=str, default='./models/face_detection_yunet_2023mar.onnx', help='Path to the face detection model.')
+parser.add_argument('--face_recognition_model', '-fr', type=str, default='./models/face_recognition_sface_2021dec.onnx', help='Path to the face recognition model. Download the model at https://github.com/opencv/opencv_zoo/tree/master/models/face_recognition_sface')
+parser.add_argument('--score_threshold', type=float, default=0.9, help='Filtering out faces of score < score_threshold.')
+parser.add_argument('--nms_threshold', type=float, default=0.3, help='Suppress bounding boxes of iou >= nms_threshold.')
+parser.add_argument('--top_k', type=int, default=5000, help='Keep top_k bounding boxes before NMS.')
+
+
+def test_folders(args):
+    '''
+    Crea la lista de carpetas de prueba con la estructura de outputs_refacer: bypass simples, parámetros
+    simples y combinaciones.
+
+    :param args: argumentos del script
+    :return: lista de rutas relativas
+    '''
+    folders = [os.path.join("bypass", f"BypassNode{i}") for i in range(args.bypass_nodes)]
+    for n in range(args.parameter_nodes):
+        node = f"ParameterNode{n}"
+        for v in range(args.values):
+            folders.append(os.path.join("parameters", node, "cfg", f"{v + 1}_0"))
+        for c in range(args.combinations):
+            folders.append(os.path.join("parameters", node, f"combination_start_at={c}_0__end_at={c + 1}_0"))
+    return folders
+
+
+def synthetic_variants(path, args, rng, count=3):
+    '''
+    Codifica varias versiones de una imagen real (escala, brillo y desplazamiento distintos) al tamaño y formato
+    del benchmark.
+
+    :param path: ruta de la imagen real
+    :param args: argumentos del script
+    :param rng: generador aleatorio
+    :param count: número de versiones
+    :return: lista de bytes codificados
+    '''
+    img = cv.imread(path)
+    if img is None:
+        return []
+    variants = []
+    for _ in range(count):
+        variant = cv.resize(img, (args.image_size, args.image_size), interpolation=cv.INTER_AREA)
+        variant = cv.convertScaleAbs(variant, alpha=rng.uniform(0.85, 1.15), beta=rng.uniform(-15, 15))
+        variant = np.roll(variant, int(rng.integers(-args.image_size // 20, args.image_size // 20)), axis=1)
+        variants.append(cv.imencode(f".{args.format}", variant)[1].tobytes())
+    return variants
+
+
+def make_tree(real_images, args):
+    '''
+    Genera el árbol sintético de imágenes en work_dir.
+
+    :param real_images: diccionario {persona: ruta de la imagen real}
+    :param args: argumentos del script
+    :return: lista de tuplas (ruta generada, persona)
+    '''
+    rng = np.random.default_rng(args.seed)
+    people = sorted(real_images)[:args.people or None]
+    variants = {person: synthetic_variants(real_images[person], args, rng) for person in people}
+
+    generated = []
+    for folder in test_folders(args):
+        folder_path = os.path.join(args.work_dir, "outputs_refacer", folder)
+        os.makedirs(folder_path, exist_ok=True)
+        for person in people:
+            if not variants[person]:
+                continue
+            path = os.path.join(folder_path, f"{person}_retrato_00001_.{args.format}")
+            with open(path, "wb") as f:
+                f.write(variants[person][int(rng.integers(len(variants[person])))])
+            generated.append((path, person))
+    return generated
+
+
+class TimedModel:
+    '''
+    Envoltorio de un modelo de OpenCV (detector o reconocedor) que acumula el tiempo de los métodos indicados.
+    '''
+
+    def __init__(self, model, stages, timings):
+        '''
+        :param model: modelo envuelto
+        :param stages: diccionario {método: etapa}
+        :param timings: diccionario {etapa: segundos} que se actualiza
+        '''
+        self.model = model
+        self.stages = stages
+        self.timings = timings
+
+    def __getattr__(self, name):
+        method = getattr(self.model, name)
+        if name not in self.stages:
+            return method
+        return timed(method, self.stages[name], self.timings)
+
+
+def timed(function, stage, timings):
+    '''
+    :param function: función a medir
+    :param stage: etapa a la que se suma su tiempo
+    :param timings: diccionario {etapa: segundos}
+    :return: función equivalente que acumula su tiempo en timings[stage]
+    '''
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+    return wrapper
+
+
+def profile_stages(generated, real_images, real_features, detector, recognizer, args):
+    '''
+    Recorre las imágenes generadas con las funciones de face_comparison.py (compute_face_data sin almacén de
+    características y score_features), midiendo por separado el tiempo de cada etapa: las funciones internas
+    se sustituyen durante la medición por versiones que acumulan su tiempo.
+
+    :param generated: lista de tuplas (ruta generada, persona)
+    :param real_images: diccionario {persona: ruta de la imagen real}
+    :param real_features: diccionario {persona: vector de características de la imagen real}
+    :param detector: detector cv.FaceDetectorYN
+    :param recognizer: reconocedor cv.FaceRecognizerSF
+    :param args: argumentos del script
+    :return: tupla (tiempos por etapa en segundos, imágenes con rostro, filas de resultados)
+    '''
+    timings = dict.fromkeys(STAGES, 0.0)
+    detector = TimedModel(detector, {"detect": "detect"}, timings)
+    recognizer = TimedModel(recognizer, {"alignCrop": "align", "feature": "feature"}, timings)
+    originals = {name: getattr(fc, name) for name in ("read_file", "reduction_factor", "decode_image")}
+    fc.read_file = timed(originals["read_file"], "read", timings)
+    fc.reduction_factor = timed(originals["reduction_factor"], "read", timings)
+    fc.decode_image = timed(originals["decode_image"], "decode", timings)
+    score_features = timed(fc.score_features, "match", timings)
+
+    detected = 0
+    rows = []
+    compute = 0.0
+    try:
+        for path, person in generated:
+            start = time.perf_counter()
+            _, (_, feature, _) = fc.compute_face_data(path, None, detector, recognizer, TARGET_SIZE, args.scale)
+            compute += time.perf_counter() - start
+            if feature is None or real_features.get(person) is None:
+                continue
+            detected += 1
+
+            cosine, l2 = score_features(feature, real_features[person])
+            meta = list(fc.parse_test_path(os.path.dirname(path)))
+            cosine, l2 = float(cosine[0, 0]), float(l2[0, 0])
+            rows.append(meta + [person, path, real_images[person], round(cosine, 4), round(l2, 4),
+                                cosine >= fc.COSINE_SIMILARITY_THRESHOLD and l2 <= fc.L2_SIMILARITY_THRESHOLD])
+    finally:
+        for name, function in originals.items():
+            setattr(fc, name, function)
+
+    # Lo que no se atribuye a ninguna función medida es el hash del contenido (y la lógica de compute_face_data)
+    timings["hash"] = compute - sum(timings[stage] for stage in ("read", "decode", "detect", "align", "feature"))
+
+    # Escritura de resultados en los dos formatos de results_store
+    start = time.perf_counter()
+    write_results(os.path.join(args.work_dir, "benchmark_results.csv"), RESULT_COLUMNS, rows)
+    timings["write_csv"] = time.perf_counter() - start
+    try:
+        start = time.perf_counter()
+        write_results(os.path.join(args.work_dir, "benchmark_results.parquet"), RESULT_COLUMNS, rows)
+        timings["write_parquet"] = time.perf_counter() - start
+    except ImportError as e:
+        print(f"[WARN] No se mide la escritura Parquet: {e}")
+        del timings["write_parquet"]
+    return timings, detected, rows
+
+
+def run_end_to_end(args):
+    '''
+    Ejecuta face_comparison.py completo sobre el árbol sintético en un subproceso.
+
+    :param args: argumentos del script
+    :return: diccionario con el tiempo total y la memoria máxima del subproceso
+    '''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_comparison.py")
+    command = [
+        sys.executable, script,
+        "--generated_dir", os.path.abspath(os.path.join(args.work_dir, "outputs_refacer")),
+        "--real_dir", os.path.abspath(args.real_dir),
+        "--output", os.path.abspath(os.path.join(args.work_dir, "end_to_end.csv")),
+        "--feature_cache", "",
+        "--workers", str(args.workers),
+        "--scale", str(args.scale),
+        "-fd", os.path.abspath(args.face_detection_model),
+        "-fr", os.path.abspath(args.face_recognition_model),
+    ]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=args.work_dir, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss está en KB en Linux
+    return {"seconds": round(elapsed, 4), "workers": args.workers, "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
+
+
+def compare(result, baseline_path):
+    '''
+    Muestra la aceleración de cada etapa respecto a una ejecución anterior.
+
+    :param result: resultados de esta ejecución
+    :param baseline_path: archivo .json de la ejecución anterior
+    '''
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nComparación con {baseline_path}:")
+    for stage, stats in result["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if previous and stats["mean_ms"]:
+            print(f"  {stage:<14} {previous['mean_ms']:>9.3f} ms -> {stats['mean_ms']:>9.3f} ms  (x{previous['mean_ms'] / stats['mean_ms']:.2f})")
+    if baseline.get("images_per_second"):
+        print(f"  {'imágenes/s':<14} {baseline['images_per_second']:>9.2f} -> {result['images_per_second']:>9.2f}  (x{result['images_per_second'] / baseline['images_per_second']:.2f})")
+
+
+''' ACCIONES '''
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if not os.path.exists(args.face_recognition_model):
+        parser.error(f"No se encontró el modelo de reconocimiento {args.face_recognition_model} (ver --face_recognition_model)")
+
+    # Carpeta de trabajo: temporal, o una carpeta nueva (o de una ejecución anterior) marcada por el script
+    if not args.work_dir:
+        args.work_dir = tempfile.mkdtemp(prefix="benchmark_face_comparison_")
+    elif os.path.exists(args.work_dir):
+        if not os.path.exists(os.path.join(args.work_dir, WORK_DIR_MARKER)):
+            parser.error(f"{args.work_dir} ya existe y no la creó este script: no se borra (indique otra carpeta)")
+        shutil.rmtree(args.work_dir)
+    os.makedirs(args.work_dir, exist_ok=True)
+    open(os.path.join(args.work_dir, WORK_DIR_MARKER), "w").close()
+
+    # Árbol sintético
+    real_images = fc.load_real_images(args.real_dir)
+    start = time.perf_counter()
+    generated = make_tree(real_images, args)
+    print(f"Árbol sintético: {len(generated)} imágenes {args.image_size}px .{args.format} en {time.perf_counter() - start:.1f}s")
+
+    # Tiempos por etapa
+    detector, recognizer = fc.create_models(args.face_detection_model, args.face_recognition_model, args.score_threshold, args.nms_threshold, args.top_k, TARGET_SIZE)
+    real_features = {person: fc.get_face_data(path, {}, detector, recognizer, TARGET_SIZE, args.scale)[1] for person, path in real_images.items()}
+    start = time.perf_counter()
+    timings, detected, _ = profile_stages(generated, real_images, real_features, detector, recognizer, args)
+    total = time.perf_counter() - start
+
+    # Número de veces que se ejecuta cada etapa: las de rostro solo con las imágenes detectadas y la escritura una vez
+    counts = {stage: len(generated) for stage in timings}
+    counts.update({"align": detected, "feature": detected, "match": detected, "write_csv": 1, "write_parquet": 1})
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "images": len(generated),
+        "faces_detected": detected,
+        "seconds": round(total, 4),
+        "images_per_second": round(len(generated) / total, 2) if total else 0.0,
+        "stages": {
+            stage: {
+                "total_s": round(seconds, 4),
+                "mean_ms": round(1000 * seconds / counts[stage], 4) if counts[stage] else 0.0,
+                "share": round(seconds / total, 4) if total else 0.0,
+            }
+            for stage, seconds in timings.items()
+        },
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if args.end_to_end:
+        result["end_to_end"] = run_end_to_end(args)
+        result["end_to_end"]["images_per_second"] = round(len(generated) / result["end_to_end"]["seconds"], 2)
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{len(generated)} imágenes ({detected} con rostro) en {total:.2f}s: {result['images_per_second']} imágenes/s, memoria máxima {result['peak_rss_mb']} MB")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<14} {stats['total_s']:>9.3f} s  {stats['mean_ms']:>9.3f} ms  {100 * stats['share']:5.1f}%")
+    if args.end_to_end:
+        print(f"face_comparison.py completo: {result['end_to_end']}")
+    print(f"Resultados guardados en {args.output}")
+
+    if args.baseline:
+        compare(result, args.baseline)
+    if args.keep:
+        print(f"Árbol sintético conservado en {args.work_dir}")
+    else:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
@@ -0,0 +1,607 @@
+import http.client
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+''' DECLARACIONES'''
+# Códigos HTTP que se consideran fallos transitorios y se reintentan
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+class ComfyUIError(RuntimeError):
+    '''
+    Error devuelto por el servidor de ComfyUI que no se debe reintentar (p. ej. un pipeline inválido).
+    '''
+
+    def __init__(self, status, body):
+        super().__init__(f"ComfyUI respondió {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+def parse_server(server):
+    '''
+    Obtiene host, puerto y esquema a partir de la dirección del servidor ("IP:puerto" o "http://IP:puerto").
+
+    :param server: dirección del servidor
+    :return: tupla (esquema, host, puerto)
+    '''
+    if "://" not in server:
+        server = "http://" + server
+    parts = urlsplit(server)
+    default_port = 443 if parts.scheme == "https" else 80
+    return parts.scheme, parts.hostname, parts.port or default_port
+
+
+class ComfyUIClient:
+    '''
+    Cliente HTTP de la API de ComfyUI. Cada hilo reutiliza su propia conexión keep-alive, los envíos
+    concurrentes se limitan a max_in_flight y los fallos transitorios se reintentan con espera exponencial.
+    '''
+
+    def __init__(self, server, max_in_flight=4, retries=5, backoff=1.0, timeout=60, output_dir=None, inputs=None):
+        '''
+        :param server: dirección del servidor ("IP:puerto" o "http://IP:puerto")
+        :param max_in_flight: número máximo de peticiones /prompt simultáneas
+        :param retries: número de reintentos ante fallos transitorios
+        :param backoff: espera base en segundos entre reintentos (se duplica en cada intento)
+        :param timeout: tiempo máximo de espera de cada petición en segundos
+        :param output_dir: carpeta "output" del servidor si es accesible localmente (las imágenes se mueven desde
+                           ella); None para descargarlas con /view
+        :param inputs: registro de imágenes de entrada (InputRegistry) que se suben con /upload/image antes del
+                       primer prompt que las usa; None si el servidor lee las rutas locales
+        '''
+        self.server = server
+        self.output_dir = output_dir
+        self.inputs = inputs
+        self.queue_depth = 0
+        self.scheme, self.host, self.port = parse_server(server)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="comfyui-submit")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        '''
+        Espera a los envíos pendientes y cierra el pool de hilos.
+        '''
+        self._executor.shutdown(wait=True)
+
+    def _connection(self):
+        '''
+        Devuelve la conexión keep-alive del hilo actual, creándola si no existe.
+        '''
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = conn_class(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset_connection(self):
+        '''
+        Descarta la conexión del hilo actual (tras un error se abre una nueva en el siguiente intento).
+        '''
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def _wait_retry(self, method, path, error, attempt, retries):
+        '''
+        Espera antes de reintentar una petición (espera exponencial con una pequeña componente aleatoria).
+        '''
+        delay = self.backoff * (2 ** attempt) * (1 + random.random() * 0.1)
+        print(f"[WARN] Fallo transitorio en {method} {path} ({error}), reintento {attempt + 1}/{retries} en {delay:.1f}s")
+        time.sleep(delay)
+
+    def request(self, method, path, body=None, headers=None, retries=None):
+        '''
+        Realiza una petición HTTP reintentando los fallos transitorios.
+
+        :param method: método HTTP
+        :param path: ruta de la petición (p. ej. "/prompt")
+        :param body: cuerpo de la petición en bytes
+        :param headers: cabeceras adicionales
+        :param retries: número de reintentos (None para usar los del cliente)
+        :return: cuerpo de la respuesta en bytes
+        '''
+        headers = dict(headers or {})
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                conn = self._connection()
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self._reset_connection()
+                if response.status < 400:
+                    return data
+                if response.status not in TRANSIENT_STATUS:
+                    raise ComfyUIError(response.status, data.decode(errors="replace"))
+                error = ComfyUIError(response.status, data.decode(errors="replace"))
+            except (OSError, http.client.HTTPException) as e:
+                self._reset_connection()
+                error = e
+
+            if attempt == retries:
+                raise error
+            self._wait_retry(method, path, error, attempt, retries)
+
+    def get_json(self, path):
+        '''
+        Realiza una petición GET y decodifica la respuesta JSON.
+
+        :param path: ruta de la petición
+        :return: objeto JSON decodificado
+        '''
+        return json.loads(self.request("GET", path))
+
+    def post_json(self, path, obj, retries=None):
+        '''
+        Realiza una petición POST con un cuerpo JSON y decodifica la respuesta JSON.
+
+        :param path: ruta de la petición
+        :param obj: objeto a enviar
+        :param retries: número de reintentos (None para usar los del cliente)
+        :return: objeto JSON decodificado
+        '''
+        payload = json.dumps(obj).encode('utf-8')
+        return json.loads(self.request("POST", path, body=payload, headers={"Content-Type": "application/json"}, retries=retries))
+
+    def upload_image(self, path, name):
+        '''
+        Sube una imagen a la carpeta "input" del servidor (POST /upload/image), sobrescribiendo la que tenga el
+        mismo nombre.
+
+        :param path: ruta local de la imagen
+        :param name: nombre de la imagen en el servidor
+        :return: respuesta del servidor ({"name", "subfolder", "type"})
+        '''
+        with open(path, "rb") as f:
+            data = f.read()
+        boundary = uuid.uuid4().hex
+        parts = []
+        for field, value in (("type", "input"), ("overwrite", "true")):
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{name}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode("utf-8"))
+        parts.append(data)
+        parts.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+        body = b"".join(parts)
+        return json.loads(self.request("POST", "/upload/image", body=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}))
+
+    def queue_prompt(self, pipeline):
+        '''
+        Envía un pipeline a la cola del servidor y espera la respuesta. El prompt_id lo genera el cliente
+        (ComfyUI lo respeta en /prompt): si la petición falla después de enviarse, antes de reintentarla se
+        comprueba con /history y /queue si el servidor ya lo recibió, para no encolar el trabajo dos veces.
+
+        :param pipeline: diccionario del pipeline en formato API
+        :return: respuesta del servidor (incluye "prompt_id")
+        '''
+        if self.inputs is not None:
+            # Subir antes las imágenes de entrada que el servidor aún no tiene
+            self.inputs.ensure(self, pipeline)
+        prompt_id = str(uuid.uuid4())
+        for attempt in range(self.retries + 1):
+            try:
+                return self.post_json("/prompt", {"prompt": pipeline, "prompt_id": prompt_id}, retries=0)
+            except ComfyUIError as e:
+                if e.status not in TRANSIENT_STATUS:
+                    raise
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+
+            if attempt == self.retries:
+                raise error
+            self._wait_retry("POST", "/prompt", error, attempt, self.retries)
+            # La respuesta pudo perderse con el prompt ya en la cola
+            state, _ = self.find_prompt(prompt_id)
+            if state is not None:
+                print(f"El prompt {prompt_id} ya estaba en {self.server}: no se vuelve a enviar")
+                return {"prompt_id": prompt_id, "number": None, "node_errors": {}}
+
+    def submit_prompt(self, pipeline):
+        '''
+        Envía un pipeline de forma asíncrona, respetando el límite de envíos simultáneos.
+
+        :param pipeline: diccionario del pipeline en formato API
+        :return: Future con la respuesta del servidor
+        '''
+        return self._executor.submit(self.queue_prompt, pipeline)
+
+    def get_queue(self):
+        '''
+        Devuelve los prompt_id en ejecución y pendientes en la cola del servidor.
+
+        :return: conjunto de prompt_id activos
+        '''
+        queue = self.get_json("/queue")
+        # Cada elemento de la cola es [número, prompt_id, prompt, extra_data, outputs_to_execute]
+        active = {item[1] for item in queue.get("queue_running", []) + queue.get("queue_pending", [])}
+        self.queue_depth = len(active)
+        return active
+
+    def cancel_prompts(self, prompt_ids):
+        '''
+        Cancela prompts: elimina de la cola los pendientes (POST /queue {"delete": [...]}) e interrumpe el que
+        está en ejecución si es uno de ellos (POST /interrupt).
+
+        :param prompt_ids: prompt_id a cancelar
+        '''
+        prompt_ids = set(prompt_ids)
+        if not prompt_ids:
+            return
+        queue = self.get_json("/queue")
+        pending = [item[1] for item in queue.get("queue_pending", []) if item[1] in prompt_ids]
+        running = [item[1] for item in queue.get("queue_running", []) if item[1] in prompt_ids]
+        headers = {"Content-Type": "application/json"}
+        # /queue y /interrupt responden sin cuerpo JSON
+        if pending:
+            self.request("POST", "/queue", body=json.dumps({"delete": pending}).encode('utf-8'), headers=headers)
+        for prompt_id in running:
+            # Las versiones recientes solo interrumpen si prompt_id sigue en ejecución
+            self.request("POST", "/interrupt", body=json.dumps({"prompt_id": prompt_id}).encode('utf-8'), headers=headers)
+
+    def fetch_output(self, prompt_id, image, destination):
+        '''
+        Lleva una imagen generada a su destino: si el servidor es local, la renombra desde output_dir (nada que
+        hacer si SaveImage ya la guardó en el destino); si no, la descarga con /view.
+
+        :param prompt_id: prompt que generó la imagen
+        :param image: diccionario {"filename", "subfolder", "type"} del historial
+        :param destination: ruta de destino
+        '''
+        if self.output_dir is not None:
+            source = os.path.join(self.output_dir, image.get("subfolder", ""), image["filename"])
+            if os.path.exists(destination) and os.path.samefile(source, destination):
+                return
+            # Renombrado en el mismo sistema de archivos (copia solo si la carpeta está en otro dispositivo)
+            shutil.move(source, destination)
+            return
+        query = urlencode({"filename": image["filename"], "subfolder": image.get("subfolder", ""), "type": image.get("type", "output")})
+        data = self.request("GET", f"/view?{query}")
+        # Escritura atómica: una imagen a medio descargar nunca queda en la carpeta de la prueba
+        tmp_path = f"{destination}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, destination)
+
+    def release(self, prompt_id):
+        '''
+        Libera el estado asociado a un prompt cuyas imágenes ya se han recogido (un servidor no guarda ninguno).
+
+        :param prompt_id: identificador devuelto por /prompt
+        '''
+
+    def get_history(self, prompt_id):
+        '''
+        Devuelve la entrada del historial de un prompt.
+
+        :param prompt_id: identificador devuelto por /prompt
+        :return: diccionario con "outputs" y "status", o None si el prompt aún no ha terminado
+        '''
+        return self.get_json(f"/history/{prompt_id}").get(prompt_id)
+
+    def find_prompt(self, prompt_id, server=None):
+        '''
+        Busca en el servidor un prompt enviado en una ejecución anterior.
+
+        :param prompt_id: identificador devuelto por /prompt
+        :param server: dirección del servidor al que se envió (no se usa con un solo servidor)
+        :return: tupla (estado, entrada del historial): ("finished", entrada) si ya terminó, ("queued", None) si
+                 sigue en la cola y (None, None) si el servidor no lo conoce (p. ej. porque se reinició)
+        '''
+        entry = self.get_history(prompt_id)
+        if entry is not None:
+            return "finished", entry
+        if prompt_id in self.get_queue():
+            return "queued", None
+        return None, None
+
+    def poll_finished(self, prompt_ids):
+        '''
+        Comprueba qué prompts han terminado sin bloquear. Solo se consulta /queue, y /history únicamente para
+        los prompts que ya han salido de la cola.
+
+        :param prompt_ids: prompt_id a comprobar
+        :return: lista de tuplas (prompt_id, entrada del historial) de los prompts terminados
+        '''
+        active = self.get_queue()
+        finished = []
+        for prompt_id in sorted(set(prompt_ids) - active):
+            entry = self.get_history(prompt_id)
+            if entry is not None:
+                finished.append((prompt_id, entry))
+        return finished
+
+
+class ComfyUIPool:
+    '''
+    Conjunto de servidores ComfyUI con la misma interfaz que ComfyUIClient. Cada prompt se envía al servidor
+    disponible con menos trabajos en cola (según /queue y los envíos posteriores) y, si un servidor deja de
+    responder, sus prompts en curso se reenvían a los demás. Cada prompt se identifica con un id propio del
+    conjunto, que no cambia aunque se reenvíe a otro servidor.
+    '''
+
+    def __init__(self, servers, max_in_flight=4, retries=5, backoff=1.0, timeout=60, recheck_interval=30.0, inputs=None):
+        '''
+        :param servers: direcciones de los servidores ("IP:puerto" o "http://IP:puerto")
+        :param max_in_flight: número máximo de peticiones /prompt simultáneas por servidor
+        :param retries: número de reintentos ante fallos transitorios antes de dar un servidor por caído
+        :param backoff: espera base en segundos entre reintentos
+        :param timeout: tiempo máximo de espera de cada petición en segundos
+        :param recheck_interval: segundos entre comprobaciones de los servidores caídos
+        :param inputs: registro de imágenes de entrada (InputRegistry) que se suben a cada servidor
+        '''
+        self.clients = [ComfyUIClient(server, max_in_flight, retries, backoff, timeout, inputs=inputs) for server in servers]
+        self.inputs = inputs
+        self.recheck_interval = recheck_interval
+        self.down = {}                  # {cliente: instante en que se dio por caído}
+        self.prompts = {}               # {id del conjunto: [cliente, prompt_id en el servidor, pipeline]}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight * len(self.clients), thread_name_prefix="comfyui-pool")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        '''
+        Espera a los envíos pendientes y cierra los clientes.
+        '''
+        self._executor.shutdown(wait=True)
+        for client in self.clients:
+            client.close()
+
+    def _healthy(self):
+        return [client for client in self.clients if client not in self.down]
+
+    def _mark_down(self, client, error):
+        '''
+        Da un servidor por caído (sus prompts en curso se reenvían en la siguiente consulta).
+        '''
+        with self._lock:
+            if client not in self.down:
+                print(f"[WARN] Servidor {client.server} no disponible ({error}); se reparten sus trabajos entre el resto")
+            self.down[client] = time.time()
+        if self.inputs is not None:
+            # Si vuelve, puede haberse reiniciado sin las imágenes subidas
+            self.inputs.forget(client)
+
+    def _dispatch(self, pipeline, exclude=()):
+        '''
+        Envía un pipeline al servidor disponible con menos trabajos en cola.
+
+        :param pipeline: diccionario del pipeline en formato API
+        :param exclude: servidores que no se deben usar
+        :return: tupla (cliente, respuesta de /prompt)
+        '''
+        while True:
+            with self._lock:
+                candidates = [client for client in self._healthy() if client not in exclude]
+                if not candidates:
+                    raise ComfyUIError(503, "No quedan servidores de ComfyUI disponibles")
+                client = min(candidates, key=lambda c: c.queue_depth)
+                # Contar el envío hasta la siguiente consulta de /queue
+                client.queue_depth += 1
+            try:
+                return client, client.queue_prompt(pipeline)
+            except ComfyUIError as e:
+                if e.status not in TRANSIENT_STATUS:
+                    raise
+                self._mark_down(client, e)
+            except (OSError, http.client.HTTPException) as e:
+                self._mark_down(client, e)
+
+    def queue_prompt(self, pipeline):
+        '''
+        Envía un pipeline al servidor con menos trabajos en cola.
+
+        :param pipeline: diccionario del pipeline en formato API
+        :return: respuesta del servidor con el id del conjunto en "prompt_id" y la dirección en "server"
+        '''
+        client, response = self._dispatch(pipeline)
+        pool_id = response["prompt_id"]
+        with self._lock:
+            self.prompts[pool_id] = [client, response["prompt_id"], pipeline]
+        return dict(response, server=client.server)
+
+    def submit_prompt(self, pipeline):
+        '''
+        Envía un pipeline de forma asíncrona.
+
+        :param pipeline: diccionario del pipeline en formato API
+        :return: Future con la respuesta (ver queue_prompt)
+        '''
+        return self._executor.submit(self.queue_prompt, pipeline)
+
+    def _failover(self, pool_ids, failed_client):
+        '''
+        Reenvía a otros servidores los prompts de un servidor caído.
+
+        :param pool_ids: ids del conjunto a reenviar
+        :param failed_client: servidor caído
+        :return: lista de tuplas (id, entrada de error) de los prompts que no se pudieron reenviar
+        '''
+        lost = []
+        for pool_id in pool_ids:
+            pipeline = self.prompts[pool_id][2]
+            try:
+                if pipeline is None:
+                    # Prompt recuperado de una ejecución anterior (ver find_prompt): no hay pipeline que reenviar
+                    raise ComfyUIError(503, f"{failed_client.server} no responde y el prompt no se puede reenviar")
+                client, response = self._dispatch(pipeline, exclude=(failed_client,))
+            except ComfyUIError as e:
+                del self.prompts[pool_id]
+                lost.append((pool_id, {"outputs": {}, "status": {"status_str": "error", "completed": False, "messages": [["failover_error", {"message": str(e)}]]}}))
+                continue
+            print(f"Prompt {pool_id} reenviado de {failed_client.server} a {client.server}")
+            with self._lock:
+                self.prompts[pool_id] = [client, response["prompt_id"], pipeline]
+        return lost
+
+    def find_prompt(self, prompt_id, server=None):
+        '''
+        Busca un prompt enviado en una ejecución anterior en el servidor que lo recibió (en todos si no se
+        conoce) y, si ese servidor lo conoce, lo asocia a él para consultarlo y traer sus imágenes.
+
+        :param prompt_id: id del conjunto (el prompt_id del primer servidor que lo recibió)
+        :param server: dirección del servidor al que se envió
+        :return: tupla (estado, entrada del historial), como en ComfyUIClient.find_prompt
+        '''
+        for client in self._healthy():
+            if server is not None and client.server != server:
+                continue
+            try:
+                state, entry = client.find_prompt(prompt_id)
+            except (OSError, http.client.HTTPException, ComfyUIError) as e:
+                self._mark_down(client, e)
+                continue
+            if state is not None:
+                with self._lock:
+                    self.prompts[prompt_id] = [client, prompt_id, None]
+                return state, entry
+        return None, None
+
+    def _recheck(self):
+        '''
+        Vuelve a incorporar los servidores caídos que responden de nuevo.
+        '''
+        for client, since in list(self.down.items()):
+            if time.time() - since < self.recheck_interval:
+                continue
+            try:
+                client.get_queue()
+            except (OSError, http.client.HTTPException, ComfyUIError):
+                self.down[client] = time.time()
+                continue
+            print(f"Servidor {client.server} disponible de nuevo")
+            with self._lock:
+                del self.down[client]
+
+    def poll_finished(self, prompt_ids):
+        '''
+        Comprueba qué prompts han terminado en cualquiera de los servidores sin bloquear, actualiza la
+        profundidad de cola de cada servidor y reenvía los prompts de los servidores que no responden.
+
+        :param prompt_ids: ids del conjunto a comprobar
+        :return: lista de tuplas (id, entrada del historial) de los prompts terminados
+        '''
+        self._recheck()
+        by_client = {}
+        for pool_id in prompt_ids:
+            client, server_id, _ = self.prompts[pool_id]
+            by_client.setdefault(client, {})[server_id] = pool_id
+
+        finished = []
+        for client in self.clients:
+            ids = by_client.get(client, {})
+            if client in self.down:
+                if ids:
+                    finished.extend(self._failover(list(ids.values()), client))
+                continue
+            try:
+                # También actualiza client.queue_depth para el siguiente reparto
+                if ids:
+                    done = client.poll_finished(ids)
+                else:
+                    client.get_queue()
+                    done = []
+            except (OSError, http.client.HTTPException, ComfyUIError) as e:
+                self._mark_down(client, e)
+                finished.extend(self._failover(list(ids.values()), client))
+                continue
+            for server_id, entry in done:
+                pool_id = ids[server_id]
+                # Solo se conserva el servidor del prompt, para traer sus imágenes con fetch_output (hasta release)
+                self.prompts[pool_id][2] = None
+                finished.append((pool_id, entry))
+        return finished
+
+    def cancel_prompts(self, prompt_ids):
+        '''
+        Cancela prompts en sus servidores.
+
+        :param prompt_ids: ids del conjunto a cancelar
+        '''
+        by_client = {}
+        for pool_id in prompt_ids:
+            client, server_id, _ = self.prompts.pop(pool_id)
+            by_client.setdefault(client, []).append(server_id)
+        for client, ids in by_client.items():
+            if client in self.down:
+                continue
+            try:
+                client.cancel_prompts(ids)
+            except (OSError, http.client.HTTPException, ComfyUIError) as e:
+                self._mark_down(client, e)
+
+    def release(self, prompt_id):
+        '''
+        Olvida un prompt cuyas imágenes ya se han recogido (o que ha fallado), para que self.prompts no crezca
+        durante la ejecución.
+
+        :param prompt_id: id del conjunto
+        '''
+        with self._lock:
+            self.prompts.pop(prompt_id, None)
+
+    def fetch_output(self, prompt_id, image, destination):
+        '''
+        Descarga una imagen generada desde el servidor que ejecutó el prompt.
+
+        :param prompt_id: id del conjunto
+        :param image: diccionario {"filename", "subfolder", "type"} del historial
+        :param destination: ruta de destino
+        '''
+        client, server_id, _ = self.prompts[prompt_id]
+        try:
+            client.fetch_output(server_id, image, destination)
+        except (OSError, http.client.HTTPException) as e:
+            # El servidor cayó después de terminar el prompt: sus imágenes ya no se pueden recuperar
+            self._mark_down(client, e)
+            raise ComfyUIError(503, f"No se pudo descargar {image['filename']} de {client.server}: {e}")
+
+
+def history_images(entry, node_id=None):
+    '''
+    Extrae las imágenes generadas de una entrada del historial.
+
+    :param entry: entrada del historial de un prompt
+    :param node_id: id del nodo cuyas salidas se quieren (None para todos los nodos)
+    :return: lista de diccionarios {"filename", "subfolder", "type"}
+    '''
+    images = []
+    for nid, output in entry.get("outputs", {}).items():
+        if node_id is None or nid == node_id:
+            images.extend(output.get("images", []))
+    return images
+
+
+def history_succeeded(entry):
+    '''
+    Indica si un prompt del historial terminó correctamente.
+
+    :param entry: entrada del historial de un prompt
+    :return: True si el prompt terminó sin errores
+    '''
+    status = entry.get("status", {})
+    return status.get("completed", True) and status.get("status_str", "success") == "success"
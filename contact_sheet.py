@@ -0,0 +1,139 @@
+import hashlib
+import multiprocessing
+import os
+import numpy as np
+from PIL import Image
+
+''' DECLARACIONES'''
+# Carpeta por defecto de las miniaturas (una por imagen, tamaño de celda y versión del archivo)
+THUMBNAIL_CACHE = ".thumbnail_cache"
+
+# Separación en píxeles entre celdas de la tabla
+CELL_GAP = 8
+
+
+def thumbnail_path(path, cell_size, cache_dir):
+    '''
+    Ruta de la miniatura de una imagen. La clave incluye la fecha de modificación y el tamaño del archivo,
+    por lo que una imagen regenerada obtiene una miniatura nueva.
+
+    :param path: ruta de la imagen original
+    :param cell_size: lado máximo de la miniatura en píxeles
+    :param cache_dir: carpeta de las miniaturas
+    :return: ruta de la miniatura
+    '''
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{cell_size}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+
+def load_thumbnail(path, cell_size, cache_dir=THUMBNAIL_CACHE):
+    '''
+    Devuelve la miniatura RGB de una imagen: la decodifica y reduce una sola vez y después la lee de la caché.
+
+    :param path: ruta de la imagen original
+    :param cell_size: lado máximo de la miniatura en píxeles
+    :param cache_dir: carpeta de las miniaturas ("" para no usar caché)
+    :return: imagen PIL en modo RGB
+    '''
+    cached = thumbnail_path(path, cell_size, cache_dir) if cache_dir else ""
+    if cached and os.path.exists(cached):
+        return Image.open(cached).convert("RGB")
+
+    img = Image.open(path)
+    # Con JPEG el decodificador reduce directamente la resolución (sin decodificar la imagen completa)
+    img.draft("RGB", (cell_size, cell_size))
+    if img.mode in ("RGBA", "LA", "P"):
+        # Componer la transparencia sobre blanco, igual que el fondo de las figuras
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    else:
+        img = img.convert("RGB")
+    img.thumbnail((cell_size, cell_size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    if cached:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Escritura atómica: varios procesos pueden generar la misma miniatura a la vez
+        tmp_path = f"{cached}.{os.getpid()}.tmp"
+        img.save(tmp_path, format="PNG", compress_level=1)
+        os.replace(tmp_path, cached)
+    return img
+
+
+def build_canvas(grid, cell_size, cache_dir=THUMBNAIL_CACHE, gap=CELL_GAP):
+    '''
+    Compone una tabla de imágenes pegando las miniaturas en un lienzo preasignado.
+
+    :param grid: lista de filas, cada una con rutas de imagen (o None para dejar la celda vacía)
+    :param cell_size: lado de cada celda en píxeles
+    :param cache_dir: carpeta de las miniaturas
+    :param gap: separación entre celdas en píxeles
+    :return: array uint8 (alto, ancho, 3) con fondo blanco
+    '''
+    rows, cols = len(grid), max(len(row) for row in grid)
+    canvas = np.full((rows * cell_size + (rows - 1) * gap, cols * cell_size + (cols - 1) * gap, 3), 255, dtype=np.uint8)
+    for row_idx, row in enumerate(grid):
+        for col_idx, path in enumerate(row):
+            if path is None:
+                continue
+            thumb = np.asarray(load_thumbnail(str(path), cell_size, cache_dir))
+            height, width = thumb.shape[:2]
+            # Centrar la miniatura en su celda (conserva la relación de aspecto)
+            top = row_idx * (cell_size + gap) + (cell_size - height) // 2
+            left = col_idx * (cell_size + gap) + (cell_size - width) // 2
+            canvas[top:top + height, left:left + width] = thumb
+    return canvas
+
+
+def render_sheet(spec):
+    '''
+    Dibuja y guarda una tabla de imágenes: un único imshow del lienzo con los títulos de las columnas.
+
+    :param spec: diccionario con "output" (ruta de la figura), "grid" (ver build_canvas), "column_titles",
+                 "fontsize", "cell_size", "dpi" y "cache_dir"
+    :return: ruta de la figura guardada
+    '''
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    cell_size, dpi, gap = spec["cell_size"], spec["dpi"], spec.get("gap", CELL_GAP)
+    canvas = build_canvas(spec["grid"], cell_size, spec["cache_dir"], gap)
+
+    # Un píxel del lienzo por píxel de la figura
+    height, width = canvas.shape[:2]
+    fig = plt.figure(figsize=(width / dpi, height / dpi))
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.imshow(canvas, interpolation="none")
+    ax.axis("off")
+
+    # Títulos de las columnas, centrados sobre cada celda
+    for col_idx, title in enumerate(spec["column_titles"]):
+        ax.annotate(
+            title, xy=(col_idx * (cell_size + gap) + cell_size / 2, 0), xycoords="data",
+            xytext=(0, 10), textcoords="offset points", ha="center", va="bottom",
+            fontsize=spec["fontsize"], fontweight="bold", annotation_clip=False
+        )
+
+    # Compresión PNG rápida: con fotografías, zlib apenas reduce el tamaño a niveles altos y es la etapa más lenta
+    fig.savefig(str(spec["output"]), dpi=dpi, bbox_inches="tight", facecolor="white", pil_kwargs={"compress_level": 1})
+    plt.close(fig)
+    return spec["output"]
+
+
+def render_sheets(specs, workers=None):
+    '''
+    Dibuja varias tablas en paralelo, una por proceso.
+
+    :param specs: lista de especificaciones (ver render_sheet)
+    :param workers: número de procesos (None para usar todos los núcleos)
+    :return: generador con la ruta de cada figura a medida que se guarda
+    '''
+    if workers == 1 or len(specs) <= 1:
+        for spec in specs:
+            yield render_sheet(spec)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(render_sheet, specs)
@@ -0,0 +1,115 @@
+import math
+
+''' DECLARACIONES'''
+# Resultados de los que se obtiene la referencia: imágenes con rostro (results_face_comparison) y sin rostro
+# (failed_images) de face_comparison.py
+BASELINE_RESULTS = "results_face_comparison.csv"
+BASELINE_FAILED = "failed_images.csv"
+
+
+def baseline_from_results(results_path, failed_path, baseline_keys):
+    '''
+    Calcula la referencia de la parada temprana a partir de las imágenes del pipeline sin modificar: las de las
+    pruebas paramétricas que fijan un parámetro a su valor original (p. ej. noise_seed = 11), no la media de
+    todo el estudio, que incluye las configuraciones degeneradas.
+
+    :param results_path: resultados de las imágenes con rostro (carpeta Parquet o archivo .csv)
+    :param failed_path: imágenes sin rostro detectado (carpeta Parquet o archivo .csv)
+    :param baseline_keys: lista de tuplas (Type, Node, Parameter, Value) de las pruebas equivalentes al pipeline original
+    :return: tupla (tasa de detección, similitud coseno media)
+    '''
+    from results_store import read_results
+
+    keys = set(baseline_keys)
+    filters = [("Type", "in", sorted({key[0] for key in keys}))]
+    results = read_results(results_path, filters=filters, columns=["Type", "Node", "Parameter", "Value", "Cosine_Similarity"])
+    failed = read_results(failed_path, filters=filters, columns=["Type", "Node", "Parameter", "Value", "Image_Type"])
+    failed = failed[failed["Image_Type"] == "generated"]
+
+    # Las columnas de partición pueden leerse como categorías: comparar como texto
+    def is_baseline(df):
+        return [tuple(str(v) for v in row) in keys for row in df[["Type", "Node", "Parameter", "Value"]].itertuples(index=False)]
+
+    cosines = results.loc[is_baseline(results), "Cosine_Similarity"]
+    n_failed = sum(is_baseline(failed))
+    if len(cosines) == 0:
+        raise ValueError(f"No hay resultados del pipeline original en {results_path}")
+    return len(cosines) / (len(cosines) + n_failed), float(cosines.mean())
+
+
+class EarlyStopping:
+    '''
+    Regla secuencial para detener las pruebas degeneradas: a partir de min_people imágenes puntuadas, una prueba
+    se detiene si su tasa de detección (test binomial exacto) o su similitud coseno media (test t) es
+    significativamente inferior a la de referencia. El nivel de significación se reparte (Bonferroni) entre
+    todas las comprobaciones posibles de una prueba, ya que se repiten tras cada imagen.
+    '''
+
+    def __init__(self, baseline_detection_rate, baseline_cosine, min_people=5, confidence=0.95, max_people=29):
+        '''
+        :param baseline_detection_rate: tasa de detección de referencia del pipeline original (ver baseline_from_results)
+        :param baseline_cosine: similitud coseno media de referencia del pipeline original
+        :param min_people: imágenes mínimas antes de la primera comprobación
+        :param confidence: confianza con la que se decide que una prueba es peor que la referencia
+        :param max_people: número máximo de imágenes de una prueba (número de comprobaciones posibles)
+        '''
+        self.baseline_detection_rate = baseline_detection_rate
+        self.baseline_cosine = baseline_cosine
+        self.min_people = min_people
+        looks = max(1, max_people - min_people + 1)
+        self.alpha = (1 - confidence) / looks
+        self.stats = {}         # {prueba: [imágenes, detecciones, suma coseno, suma coseno^2]}
+        self.stopped = {}       # {prueba: motivo}
+
+    def observe(self, key, detected, cosine=None):
+        '''
+        Incorpora el resultado de una imagen y comprueba si la prueba debe detenerse.
+
+        :param key: identificador de la prueba (carpeta de salida)
+        :param detected: True si se detectó un rostro en la imagen generada
+        :param cosine: similitud coseno con la imagen real (si se detectó el rostro)
+        :return: motivo de la parada si la prueba se acaba de detener, o None
+        '''
+        stats = self.stats.setdefault(key, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        if detected:
+            stats[1] += 1
+            stats[2] += cosine
+            stats[3] += cosine * cosine
+        if key in self.stopped or stats[0] < self.min_people:
+            return None
+
+        reason = self._test(*stats)
+        if reason is not None:
+            self.stopped[key] = reason
+            print(f"[EARLY STOP] {key}: {reason}")
+        return reason
+
+    def _test(self, n, detected, total, total_sq):
+        '''
+        :return: motivo de la parada, o None si no hay evidencia suficiente
+        '''
+        from scipy import stats
+
+        # Detección: P(X <= detecciones | n, tasa de referencia)
+        p_detection = stats.binom.cdf(detected, n, self.baseline_detection_rate)
+        if p_detection < self.alpha:
+            return f"detección {detected}/{n} inferior a {self.baseline_detection_rate:.2f} (p={p_detection:.2g})"
+
+        # Similitud: test t unilateral sobre las imágenes con rostro
+        if detected >= 2:
+            mean = total / detected
+            variance = max(total_sq - detected * mean * mean, 0.0) / (detected - 1)
+            if variance > 0:
+                t = (mean - self.baseline_cosine) / math.sqrt(variance / detected)
+                p_cosine = stats.t.cdf(t, detected - 1)
+                if p_cosine < self.alpha:
+                    return f"similitud media {mean:.3f} inferior a {self.baseline_cosine:.3f} (p={p_cosine:.2g})"
+        return None
+
+    def is_stopped(self, key):
+        '''
+        :param key: identificador de la prueba (carpeta de salida)
+        :return: True si la prueba se ha detenido
+        '''
+        return key in self.stopped
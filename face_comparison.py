@@ -1,10 +1,28 @@
 import argparse
 import cv2 as cv
+import numpy as np
+import hashlib
+import io
+import json
+import multiprocessing
 import os
-import csv
 import re
+import threading
+from PIL import Image
+from results_store import ALL_PAIRS_COLUMNS, CATEGORY_COLUMNS, FAILED_COLUMNS, FLOAT_COLUMNS, RESULT_COLUMNS, is_csv, read_results, write_results
 
 ''' DECLARACIONES'''
+# Factor de escala de la decodificación (--scale): por defecto resolución completa, que reproduce los resultados
+# del estudio (results_face_comparison.csv); con un valor menor, las imágenes JPEG se decodifican directamente a
+# 1/2, 1/4 o 1/8 de su resolución, sin bajar nunca de target_size (más rápido, pero cambia las puntuaciones)
+DECODE_SCALE = 1.0
+REDUCED_READ_FLAGS = {1: cv.IMREAD_COLOR, 2: cv.IMREAD_REDUCED_COLOR_2, 4: cv.IMREAD_REDUCED_COLOR_4, 8: cv.IMREAD_REDUCED_COLOR_8}
+
+# Búferes de lectura y de escalado reutilizados entre imágenes (uno por hilo). La imagen decodificada a
+# resolución completa no se reutiliza: cv.imdecode no admite un array de destino en Python y reserva uno nuevo
+_buffers = threading.local()
+
+
 def str2bool(v):
     '''
     Devuelve un valor booleano en función del string proporcionado por parámetro.
@@ -19,185 +37,657 @@ def str2bool(v):
     else:
         raise NotImplementedError
 
+
+def read_file(path):
+    '''
+    Lee un archivo en un búfer reutilizado, sin reservar memoria nueva para cada imagen.
+
+    :param path: ruta del archivo
+    :return: memoryview con el contenido (válido hasta la siguiente lectura del mismo hilo)
+    '''
+    size = os.path.getsize(path)
+    buffer = getattr(_buffers, "read", None)
+    if buffer is None or len(buffer) < size:
+        buffer = _buffers.read = bytearray(max(size, 2 * len(buffer or b"")))
+    with open(path, 'rb') as f:
+        read = f.readinto(memoryview(buffer)[:size])
+    return memoryview(buffer)[:read]
+
+
+def reduction_factor(data, target_size, scale):
+    '''
+    Calcula el factor de reducción de la decodificación: la mayor potencia de 2 (hasta 8) no superior a 1/scale
+    que mantiene el lado menor de la imagen en al menos target_size. Solo se aplica a JPEG, cuyo decodificador
+    reduce la resolución sin decodificar la imagen completa (en PNG el coste sería el mismo).
+
+    :param data: contenido del archivo
+    :param target_size: tamaño al que se escala la imagen antes de la detección
+    :param scale: factor de escala de la decodificación (1 para decodificar a resolución completa)
+    :return: 1, 2, 4 u 8
+    '''
+    if scale >= 1 or bytes(data[:2]) != b"\xff\xd8":
+        return 1
+    try:
+        # Solo se lee la cabecera para conocer el tamaño
+        width, height = Image.open(io.BytesIO(data[:1 << 17])).size
+    except (OSError, SyntaxError, ValueError):
+        return 1
+    factor = 1
+    while factor < 8 and factor * 2 * scale <= 1 and min(width, height) // (factor * 2) >= target_size:
+        factor *= 2
+    return factor
+
+
+def decode_image(data, target_size, factor=1):
+    '''
+    Decodifica una imagen (reducida por factor) y la escala a target_size x target_size en un búfer reutilizado.
+    La decodificación sí reserva memoria para cada imagen (cv.imdecode no admite destino en Python); con
+    --scale < 1 las imágenes JPEG se decodifican reducidas y esa reserva es menor.
+
+    :param data: contenido del archivo
+    :param target_size: tamaño al que se escala la imagen antes de la detección
+    :param factor: factor de reducción de la decodificación (ver reduction_factor)
+    :return: imagen BGR, o None si no se pudo decodificar
+    '''
+    if len(data) == 0:
+        return None
+    img = cv.imdecode(np.frombuffer(data, np.uint8), REDUCED_READ_FLAGS[factor])
+    if img is None:
+        return None
+
+    resized = getattr(_buffers, "resized", None)
+    if resized is None or resized.shape[0] != target_size:
+        resized = _buffers.resized = np.empty((target_size, target_size, 3), dtype=np.uint8)
+    return cv.resize(img, (target_size, target_size), dst=resized)
+
+
+def load_feature_cache(cache_path):
+    '''
+    Carga el almacén de características (.npz) generado en ejecuciones anteriores.
+
+    :param cache_path: ruta del archivo .npz
+    :return: diccionario {ruta: (hash, feature, face)}. feature y face son None si no se detectó rostro
+    '''
+    cache = {}
+    if not cache_path or not os.path.exists(cache_path):
+        return cache
+
+    with np.load(cache_path, allow_pickle=False) as data:
+        for path, digest, feature, face, detected in zip(data["paths"], data["hashes"], data["features"], data["faces"], data["detected"]):
+            if detected:
+                cache[str(path)] = (str(digest), feature, face)
+            else:
+                cache[str(path)] = (str(digest), None, None)
+
+    print(f"Cargadas {len(cache)} entradas del almacén de características {cache_path}.")
+    return cache
+
+
+def save_feature_cache(cache_path, cache):
+    '''
+    Guarda el almacén de características en un único archivo .npz (escritura atómica).
+
+    :param cache_path: ruta del archivo .npz
+    :param cache: diccionario {ruta: (hash, feature, face)}
+    '''
+    if not cache_path:
+        return
+
+    paths = sorted(cache)
+    features = np.zeros((len(paths), 128), dtype=np.float32)
+    faces = np.zeros((len(paths), 15), dtype=np.float32)
+    detected = np.zeros(len(paths), dtype=bool)
+    for i, path in enumerate(paths):
+        _, feature, face = cache[path]
+        if feature is not None:
+            features[i] = feature
+            faces[i] = face
+            detected[i] = True
+
+    # Escribir en un archivo temporal y reemplazar para no corromper el almacén si se interrumpe
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 paths=np.array(paths, dtype=str),
+                 hashes=np.array([cache[p][0] for p in paths], dtype=str),
+                 features=features,
+                 faces=faces,
+                 detected=detected)
+    os.replace(tmp_path, cache_path)
+
+
+def file_signature(path):
+    '''
+    Firma barata de un archivo para detectar cambios sin leerlo.
+
+    :param path: ruta del archivo
+    :return: lista [mtime en nanosegundos, tamaño en bytes]
+    '''
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_processed_manifest(manifest_path):
+    '''
+    Carga el registro de imágenes procesadas por la última ejecución.
+
+    :param manifest_path: ruta del archivo .json
+    :return: diccionario {"real": {ruta: firma}, "generated": {ruta: firma}, "outputs": {...}}, o None si no existe
+    '''
+    if not manifest_path or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_processed_manifest(manifest_path, manifest):
+    '''
+    Guarda el registro de imágenes procesadas (escritura atómica).
+
+    :param manifest_path: ruta del archivo .json
+    :param manifest: diccionario {"real": {ruta: firma}, "generated": {ruta: firma}, "outputs": {...}}
+    '''
+    if not manifest_path:
+        return
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def previous_rows(path, columns, key_column, filters=None):
+    '''
+    Carga las filas de una ejecución anterior agrupadas por imagen generada.
+
+    :param path: resultados anteriores (carpeta Parquet o archivo .csv)
+    :param columns: columnas en el orden de escritura
+    :param key_column: columna con la ruta de la imagen generada
+    :param filters: filtros opcionales de lectura
+    :return: diccionario {ruta: [filas]}
+    '''
+    df = read_results(path, filters=filters, columns=columns)
+    rows = {}
+    for row in df.astype(object).values.tolist():
+        # Los valores leídos de Parquet son float32: redondear de nuevo como al escribirlos
+        row = [round(float(v), 4) if c in FLOAT_COLUMNS else str(v) if c in CATEGORY_COLUMNS else v for c, v in zip(columns, row)]
+        rows.setdefault(row[columns.index(key_column)], []).append(row)
+    return rows
+
+
+def extract_face_data(data, detector, recognizer, target_size, factor=1):
+    '''
+    Decodifica una imagen, detecta el rostro con YuNet y extrae su vector de características con SFace.
+
+    :param data: contenido del archivo de la imagen
+    :param detector: detector cv.FaceDetectorYN
+    :param recognizer: reconocedor cv.FaceRecognizerSF
+    :param target_size: tamaño al que se escala la imagen antes de la detección
+    :param factor: factor de reducción de la decodificación (ver reduction_factor)
+    :return: tupla (cargada, feature, face). feature y face son None si no se detectó rostro
+    '''
+    # Decodificar y escalar imagen
+    img = decode_image(data, target_size, factor)
+    if img is None:
+        return False, None, None
+
+    # Configurar tamaño de entrada para el detector
+    detector.setInputSize((img.shape[1], img.shape[0]))
+    faces = detector.detect(img)
+    if faces[1] is None:
+        return True, None, None
+
+    # Extraer características faciales
+    face = faces[1][0]
+    face_align = recognizer.alignCrop(img, face)
+    feature = recognizer.feature(face_align)
+    return True, feature.reshape(-1).astype(np.float32), face.astype(np.float32)
+
+
+def compute_face_data(path, known_digest, detector, recognizer, target_size, scale=DECODE_SCALE):
+    '''
+    Calcula el hash de una imagen y, solo si no coincide con el conocido, su detección y vector de características.
+    El archivo se lee una sola vez para ambas cosas.
+
+    :param path: ruta de la imagen
+    :param known_digest: hash almacenado para esa ruta (None si no existe)
+    :param detector: detector cv.FaceDetectorYN
+    :param recognizer: reconocedor cv.FaceRecognizerSF
+    :param target_size: tamaño al que se escala la imagen antes de la detección
+    :param scale: factor de escala de la decodificación
+    :return: tupla (hash, resultado). resultado es None si el hash coincide, o (cargada, feature, face)
+    '''
+    data = read_file(path)
+    factor = reduction_factor(data, target_size, scale)
+    digest = hashlib.sha1(data).hexdigest()
+    if factor > 1:
+        # Las características dependen de la resolución de decodificación
+        digest += f"/{factor}"
+    if digest == known_digest:
+        return digest, None
+    return digest, extract_face_data(data, detector, recognizer, target_size, factor)
+
+
+def get_face_data(path, cache, detector, recognizer, target_size, scale=DECODE_SCALE):
+    '''
+    Devuelve la detección y el vector de características de una imagen, reutilizando el almacén si el
+    contenido del archivo no ha cambiado.
+
+    :param path: ruta de la imagen
+    :param cache: diccionario {ruta: (hash, feature, face)} que se actualiza con los nuevos resultados
+    :param detector: detector cv.FaceDetectorYN
+    :param recognizer: reconocedor cv.FaceRecognizerSF
+    :param target_size: tamaño al que se escala la imagen antes de la detección
+    :param scale: factor de escala de la decodificación
+    :return: tupla (cargada, feature, face)
+    '''
+    cached = cache.get(path)
+    digest, result = compute_face_data(path, cached[0] if cached else None, detector, recognizer, target_size, scale)
+    return merge_face_data(cache, path, digest, result)
+
+
+def merge_face_data(cache, path, digest, result):
+    '''
+    Incorpora al almacén el resultado de compute_face_data.
+
+    :param cache: diccionario {ruta: (hash, feature, face)}
+    :param path: ruta de la imagen
+    :param digest: hash del contenido de la imagen
+    :param result: resultado de compute_face_data (None si se reutiliza la entrada del almacén)
+    :return: tupla (cargada, feature, face)
+    '''
+    if result is None:
+        cached = cache[path]
+        return True, cached[1], cached[2]
+
+    loaded, feature, face = result
+    # Las imágenes que no se pueden cargar no se guardan, para reintentarlas en la siguiente ejecución
+    if loaded:
+        cache[path] = (digest, feature, face)
+    return loaded, feature, face
+
+
+def create_models(face_detection_model, face_recognition_model, score_threshold, nms_threshold, top_k, target_size):
+    '''
+    Crea el detector YuNet y el reconocedor SFace.
+
+    :param face_detection_model: ruta del modelo de detección
+    :param face_recognition_model: ruta del modelo de reconocimiento
+    :param score_threshold: umbral de puntuación del detector
+    :param nms_threshold: umbral de NMS del detector
+    :param top_k: número de cajas conservadas antes de NMS
+    :param target_size: tamaño de entrada del detector
+    :return: tupla (detector, recognizer)
+    '''
+    detector = cv.FaceDetectorYN.create(
+        face_detection_model,
+        "",
+        (target_size, target_size),
+        score_threshold,
+        nms_threshold,
+        top_k
+    )
+    recognizer = cv.FaceRecognizerSF.create(face_recognition_model, "")
+    return detector, recognizer
+
+
+# Modelos de cada proceso del pool (se crean una sola vez por proceso en init_worker)
+_worker_models = None
+
+
+def init_worker(model_config, scale=DECODE_SCALE):
+    '''
+    Inicializa los modelos de un proceso del pool.
+
+    :param model_config: tupla con los argumentos de create_models
+    :param scale: factor de escala de la decodificación
+    '''
+    global _worker_models
+    _worker_models = (create_models(*model_config), model_config[-1], scale)
+
+
+def worker_face_data(task):
+    '''
+    Procesa una imagen en un proceso del pool.
+
+    :param task: tupla (ruta, hash conocido)
+    :return: tupla (ruta, hash, resultado de compute_face_data)
+    '''
+    path, known_digest = task
+    (detector, recognizer), target_size, scale = _worker_models
+    digest, result = compute_face_data(path, known_digest, detector, recognizer, target_size, scale)
+    return path, digest, result
+
+
+def embed_images(paths, cache, detector, recognizer, target_size, workers=1, model_config=None, scale=DECODE_SCALE):
+    '''
+    Obtiene la detección y el vector de características de una lista de imágenes, en serie o con un pool de
+    procesos. El resultado no depende del número de procesos.
+
+    :param paths: rutas de las imágenes (sin duplicados)
+    :param cache: diccionario {ruta: (hash, feature, face)} que se actualiza con los nuevos resultados
+    :param detector: detector cv.FaceDetectorYN (modo secuencial)
+    :param recognizer: reconocedor cv.FaceRecognizerSF (modo secuencial)
+    :param target_size: tamaño al que se escala la imagen antes de la detección
+    :param workers: número de procesos
+    :param model_config: tupla con los argumentos de create_models para los procesos del pool
+    :param scale: factor de escala de la decodificación
+    :return: diccionario {ruta: (cargada, feature, face)}
+    '''
+    face_data = {}
+    if workers <= 1:
+        for path in paths:
+            face_data[path] = get_face_data(path, cache, detector, recognizer, target_size, scale)
+        return face_data
+
+    tasks = [(path, cache[path][0] if path in cache else None) for path in paths]
+    chunk_size = max(1, min(64, len(tasks) // (workers * 4)))
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(model_config, scale)) as pool:
+        # imap conserva el orden de las tareas
+        for path, digest, result in pool.imap(worker_face_data, tasks, chunksize=chunk_size):
+            face_data[path] = merge_face_data(cache, path, digest, result)
+    return face_data
+
+
+def load_real_images(real_dir):
+    '''
+    Localiza las imágenes reales de referencia de cada persona (archivos <persona>_foto.*).
+
+    :param real_dir: carpeta con las imágenes reales
+    :return: diccionario {persona: ruta de la imagen real}
+    '''
+    real_images = {}
+    for real_file in os.listdir(real_dir):
+        if real_file.endswith(('.webp', '.jpg', '.png', '.jpeg')):
+            # Extraer el prefijo del archivo real
+            prefix_match = re.match(r"([a-zA-Z_]+)_foto", real_file)
+            if prefix_match:
+                person_prefix = prefix_match.group(1)
+                real_images[person_prefix] = os.path.normpath(os.path.join(real_dir, real_file))
+    return real_images
+
+
+def parse_test_path(root):
+    '''
+    Obtiene el tipo de prueba, el nodo, el parámetro y el valor a partir de la carpeta de una imagen generada.
+
+    :param root: carpeta que contiene la imagen generada
+    :return: tupla (tipo, nodo, parámetro, valor)
+    '''
+    # Extraer estructura del path
+    path_parts = root.split(os.sep)
+    # Identificar si es bypass, normal o parameters
+    if "bypass" in path_parts:
+        return "bypass", path_parts[-1], "N/A", "N/A"
+
+    if "sweep" in path_parts and path_parts[-1].startswith("combination_"):
+        # Barrido multiparamétrico: combination_Nodo.parámetro=valor__...
+        nodes = []
+        parameters = []
+        values = []
+        for pair in path_parts[-1].replace("combination_", "", 1).split("__"):
+            name, val = pair.split("=", 1)
+            node, param = name.split(".", 1)
+            nodes.append(node)
+            parameters.append(param)
+            values.append(val)
+        return "sweep", "|".join(nodes), "|".join(parameters), "|".join(values)
+
+    if "parameters" in path_parts:
+        # Detectar si es un caso compuesto
+        if path_parts[-1].startswith("combination"):
+            # Compuesto
+            node = path_parts[-2]
+            #Extraer los parametros y los valores
+            param_string = path_parts[-1].replace("combination_", "")
+            pairs = param_string.split("__")
+            parameters = []
+            values = []
+            for pair in pairs:
+                param, val = pair.split("=")
+                parameters.append(param)
+                values.append(val)
+            return "parameters", node, "|".join(parameters), "|".join(values)
+
+        # Simple
+        return "parameters", path_parts[-3], path_parts[-2], path_parts[-1]
+
+    # Ignorar otros directorios
+    return "N/A", "N/A", "N/A", "N/A"
+
+
+def score_features(gen_features, real_features):
+    '''
+    Calcula la similitud coseno y la distancia L2 (sobre vectores normalizados, como FR_COSINE y FR_NORM_L2
+    de cv.FaceRecognizerSF) entre todas las parejas de vectores con un único producto matricial.
+
+    :param gen_features: matriz (N, 128) con los vectores de las imágenes generadas
+    :param real_features: matriz (P, 128) con los vectores de las imágenes reales
+    :return: tupla (cosine, l2) de matrices (N, P)
+    '''
+    gen = np.asarray(gen_features, dtype=np.float64).reshape(-1, 128)
+    real = np.asarray(real_features, dtype=np.float64).reshape(-1, 128)
+    gen = gen / np.linalg.norm(gen, axis=1, keepdims=True)
+    real = real / np.linalg.norm(real, axis=1, keepdims=True)
+
+    cosine = gen @ real.T
+    # ||a - b||^2 = 2 - 2 cos(a, b) para vectores unitarios
+    l2 = np.sqrt(np.clip(2.0 - 2.0 * cosine, 0.0, None))
+    return cosine, l2
+
+
+def rank_identities(cosine):
+    '''
+    Posición de cada identidad real al ordenar por similitud coseno descendente cada imagen generada.
+
+    :param cosine: matriz (N, P) de similitudes coseno (ver score_features)
+    :return: matriz (N, P) de enteros, con 1 para la identidad más parecida
+    '''
+    ranks = np.empty_like(cosine, dtype=np.int64)
+    ranks[np.arange(cosine.shape[0])[:, None], np.argsort(-cosine, axis=1)] = np.arange(1, cosine.shape[1] + 1)
+    return ranks
+
+
 # Configurar argumentos
 parser = argparse.ArgumentParser()
 parser.add_argument('--generated_dir', type=str, help='Carpeta con las imágenes generadas (outputs_refacer)')
 parser.add_argument('--real_dir', type=str, help='Carpeta con las imágenes reales (inputs_refacer_real)')
-parser.add_argument('--output_csv', type=str, default='results_face_comparison.csv', help='Archivo de salida .csv')
-parser.add_argument('--scale', '-sc', type=float, default=0.5, help='Scale factor used to resize input video frames.')
+parser.add_argument('--output', '--output_csv', dest='output', type=str, default='results_face_comparison.parquet', help='Resultados: carpeta Parquet particionada por Type/Node, o archivo .csv (separado por ";")')
+parser.add_argument('--scale', '-sc', type=float, default=DECODE_SCALE, help='Factor de escala de la decodificación: 1 (por defecto) decodifica a resolución completa y reproduce los resultados del estudio; con 0.5, 0.25 o 0.125 las imágenes JPEG se decodifican reducidas sin bajar de 512 px (más rápido, pero las puntuaciones cambian)')
 parser.add_argument('--face_detection_model', '-fd', type=str, default='./models/face_detection_yunet_2023mar.onnx', help='Path to the face detection model. Download the model at https://github.com/opencv/opencv_zoo/tree/master/models/face_detection_yunet')
 parser.add_argument('--face_recognition_model', '-fr', type=str, default='./models/face_recognition_sface_2021dec.onnx', help='Path to the face recognition model. Download the model at https://github.com/opencv/opencv_zoo/tree/master/models/face_recognition_sface')
 parser.add_argument('--score_threshold', type=float, default=0.9, help='Filtering out faces of score < score_threshold.')
 parser.add_argument('--nms_threshold', type=float, default=0.3, help='Suppress bounding boxes of iou >= nms_threshold.')
 parser.add_argument('--top_k', type=int, default=5000, help='Keep top_k bounding boxes before NMS.')
-args = parser.parse_args()
+parser.add_argument('--all_pairs', '--all_pairs_csv', dest='all_pairs', type=str, default='', help='Carpeta Parquet (o archivo .csv) opcional con la puntuación de cada imagen generada frente a todas las identidades reales')
+parser.add_argument('--workers', type=int, default=1, help='Número de procesos para la detección y el reconocimiento facial')
+parser.add_argument('--feature_cache', type=str, default='face_features.npz', help='Almacén .npz de detecciones y características ya calculadas ("" para desactivarlo)')
+parser.add_argument('--incremental', action='store_true', help='Procesar solo las imágenes nuevas o modificadas desde la última ejecución y conservar el resto de resultados')
+parser.add_argument('--processed_manifest', type=str, default='face_comparison_manifest.json', help='Registro (.json) de las imágenes procesadas (ruta, mtime y tamaño) para el modo incremental')
+
+# Umbrales de decisión de SFace
+COSINE_SIMILARITY_THRESHOLD = 0.363
+L2_SIMILARITY_THRESHOLD = 1.128
 
 ''' ACCIONES '''
 if __name__ == '__main__':
+    args = parser.parse_args()
     target_size = 512
     failed_dir = "failed_images"
     os.makedirs(failed_dir, exist_ok=True)
 
     # Inicializar modelos
-    detector = cv.FaceDetectorYN.create(
-        args.face_detection_model,
-        "",
-        (target_size, target_size),
-        args.score_threshold,
-        args.nms_threshold,
-        args.top_k
-    )
-    recognizer = cv.FaceRecognizerSF.create(args.face_recognition_model, "")
+    model_config = (args.face_detection_model, args.face_recognition_model, args.score_threshold, args.nms_threshold, args.top_k, target_size)
+    detector, recognizer = create_models(*model_config)
+
+    # Cargar el almacén de características de ejecuciones anteriores
+    feature_cache = load_feature_cache(args.feature_cache)
+    real_face_data = {}
 
     # Pre-cargar las imágenes reales
-    real_images = {}
-    for real_file in os.listdir(args.real_dir):
-        if real_file.endswith(('.webp', '.jpg', '.png', '.jpeg')):
-            # Extraer el prefijo del archivo real
-            prefix_match = re.match(r"([a-zA-Z_]+)_foto", real_file)
-            if prefix_match:
-                person_prefix = prefix_match.group(1)
-                real_images[person_prefix] = os.path.normpath(os.path.join(args.real_dir, real_file))
+    real_images = load_real_images(args.real_dir)
 
     print(f"Cargadas {len(real_images)} imágenes reales.")
 
-    # Crear archivo CSV para almacenar los resultados
-    with open(args.output_csv, mode='w', newline='') as file:
-        writer = csv.writer(file, delimiter=';')
-        writer.writerow(["Type", "Node", "Parameter", "Value", "Person", "Generated_Image_Path", "Real_Image_Path", "Cosine_Similarity", "L2_Distance", "Same_Identity"])
-
-        # Crear archivo CSV para errores en la detección facial
-        failed_csv = os.path.join(os.path.dirname(args.output_csv), "failed_images.csv")
-
-        with open(failed_csv, mode='w', newline='') as fail_file:
-            fail_writer = csv.writer(fail_file, delimiter=';')
-            fail_writer.writerow(["Type", "Node", "Parameter", "Value", "Person", "Image_Path", "Image_Type"])
-
-            # Recorrer las imágenes generadas
-            for root, dirs, files in os.walk(args.generated_dir):
-                for gen_file in files:
-                    if gen_file.endswith(('.webp', '.jpg', '.png', '.jpeg')):
-                        # Extraer prefijo para identificar a la persona
-                        prefix_match = re.match(r"([a-zA-Z_]+)_retrato", gen_file)
-                        if not prefix_match:
-                            print(f"[WARN] No se pudo identificar a la persona para {gen_file}")
-                            continue
-
-                        person = prefix_match.group(1)
-
-                        # Buscar la imagen real correspondiente
-                        real_path = real_images.get(person)
-                        if not real_path:
-                            print(f"[WARN] No se encontró la imagen real para {person}, path: {real_path}")
-                            continue
-
-
-                        # Extraer estructura del path
-                        path_parts = root.split(os.sep)
-                        # Identificar si es bypass, normal o parameters
-                        if "bypass" in path_parts:
-                            prueba_tipo = "bypass"
-                            node = path_parts[-1]
-                            parameter = "N/A"
-                            value = "N/A"
-                        elif "parameters" in path_parts:
-                            prueba_tipo = "parameters"
-
-                            # Detectar si es un caso compuesto
-                            if path_parts[-1].startswith("combination"):
-                                # Compuesto
-                                node = path_parts[-2]
-                                #Extraer los parametros y los valores
-                                param_string = path_parts[-1].replace("combination_", "")
-                                pairs = param_string.split("__")
-                                parameters = []
-                                values = []
-                                for pair in pairs:
-                                    param, val = pair.split("=")
-                                    parameters.append(param)
-                                    values.append(val)
-                                parameter = "|".join(parameters)
-                                value = "|".join(values)
-                            else:
-                                # Simple
-                                node = path_parts[-3]
-                                parameter = path_parts[-2]
-                                value = path_parts[-1]
-
-                        else:
-                            # Ignorar otros directorios
-                            prueba_tipo = "N/A"
-                            node = "N/A"
-                            parameter = "N/A"
-                            value = "N/A"
-
-                        # Cargar imágenes
-                        gen_path = os.path.normpath(os.path.join(root, gen_file))
-                        print(f'{gen_path} \n')
-                        img1 = cv.imread(real_path)
-                        img2 = cv.imread(gen_path)
-
-                        # Validar carga
-                        if img1 is None :
-                            print(f"[WARN] No se pudo cargar {real_path} \n")
-                            continue
-
-                        if img2 is None :
-                            print(f"[WARN] No se pudo cargar {gen_path} \n")
-                            continue
-
-                        # Escalar imagen
-                        img1 = cv.resize(img1, (target_size, target_size))
-
-                        # Configurar tamaño de entrada para el detector
-                        detector.setInputSize((img1.shape[1], img1.shape[0]))
-                        faces1 = detector.detect(img1)
-
-                        # Validar detección
-                        if faces1[1] is None:
-                            print(f"[WARN] No se detectó rostro en {real_path}, image_real \n")
-                            fail_writer.writerow([prueba_tipo, node, parameter, value, person, real_path, "real"])
-                            '''cv.imshow("Imagen Real - Sin Rostro", img1)
-                            cv.waitKey(0)
-                            cv.destroyAllWindows()'''
-                            continue
-
-                        # Escalar imagen
-                        img2 = cv.resize(img2, (target_size, target_size))
-
-                        # Configurar tamaño de entrada para el detector
-                        detector.setInputSize((img2.shape[1], img2.shape[0]))
-                        faces2 = detector.detect(img2)
-
-                        # Validar detección
-                        if faces2[1] is None:
-                            print(f"[WARN] No se detectó rostro en {gen_path}, image_generated \n")
-                            fail_writer.writerow([prueba_tipo, node, parameter, value, person, gen_path, "generated"])
-                            '''cv.imshow("Imagen Generada - Sin Rostro", img2)
-                            cv.waitKey(0)
-                            cv.destroyAllWindows()'''
-                            continue
-
-                        # Extraer características faciales
-                        face1_align = recognizer.alignCrop(img1, faces1[1][0])
-                        face2_align = recognizer.alignCrop(img2, faces2[1][0])
-                        face1_feature = recognizer.feature(face1_align)
-                        face2_feature = recognizer.feature(face2_align)
-
-                        # Calcular similitudes
-                        cosine_score = recognizer.match(face1_feature, face2_feature, cv.FaceRecognizerSF_FR_COSINE)
-                        l2_score = recognizer.match(face1_feature, face2_feature, cv.FaceRecognizerSF_FR_NORM_L2)
-
-                        # Decidir si son la misma identidad
-                        cosine_similarity_threshold = 0.363
-                        l2_similarity_threshold = 1.128
-                        same_identity = cosine_score >= cosine_similarity_threshold and l2_score <= l2_similarity_threshold
-
-                        # Escribir resultado en el CSV
-                        writer.writerow([prueba_tipo, node, parameter, value, person, gen_path, real_path, round(cosine_score, 4), round(l2_score, 4), same_identity])
-
-
-
-
+    # Procesar una sola vez cada imagen real
+    for real_path in real_images.values():
+        real_face_data[real_path] = get_face_data(real_path, feature_cache, detector, recognizer, target_size, args.scale)
+
+    # Resultados de los errores en la detección facial, con el mismo formato que los resultados
+    failed_output = os.path.join(os.path.dirname(args.output), "failed_images" + (".csv" if is_csv(args.output) else ".parquet"))
+
+    # Recorrer las imágenes generadas
+    entries = []
+    for root, dirs, files in os.walk(args.generated_dir):
+        for gen_file in files:
+            if gen_file.endswith(('.webp', '.jpg', '.png', '.jpeg')):
+                # Extraer prefijo para identificar a la persona
+                prefix_match = re.match(r"([a-zA-Z_]+)_retrato", gen_file)
+                if not prefix_match:
+                    print(f"[WARN] No se pudo identificar a la persona para {gen_file}")
+                    continue
+
+                person = prefix_match.group(1)
+
+                # Buscar la imagen real correspondiente
+                real_path = real_images.get(person)
+                if not real_path:
+                    print(f"[WARN] No se encontró la imagen real para {person}, path: {real_path}")
+                    continue
+
+                prueba_tipo, node, parameter, value = parse_test_path(root)
+                gen_path = os.path.normpath(os.path.join(root, gen_file))
+                entries.append(([prueba_tipo, node, parameter, value, person], gen_path, real_path))
+
+    # Registro de las imágenes procesadas (ruta, mtime y tamaño) y salidas de esta ejecución
+    processed = {
+        "real": {path: file_signature(path) for path in real_images.values()},
+        "generated": {gen_path: file_signature(gen_path) for _, gen_path, _ in entries},
+        "outputs": {"output": args.output, "all_pairs": args.all_pairs},
+    }
+
+    # Modo incremental: reutilizar las filas de las imágenes sin cambios desde la última ejecución
+    unchanged = set()
+    kept_results, kept_failed, kept_pairs = {}, {}, {}
+    if args.incremental:
+        previous = load_processed_manifest(args.processed_manifest)
+        previous_outputs = [args.output, failed_output] + ([args.all_pairs] if args.all_pairs else [])
+        if previous is None or previous.get("outputs") != processed["outputs"] or not all(os.path.exists(p) for p in previous_outputs):
+            print("[WARN] No hay resultados anteriores compatibles: se procesan todas las imágenes.")
+        elif previous["real"] != processed["real"]:
+            # Las imágenes reales intervienen en todas las puntuaciones (y en el ranking de --all_pairs)
+            print("[WARN] Las imágenes reales han cambiado: se procesan todas las imágenes.")
+        else:
+            unchanged = {path for path, signature in processed["generated"].items() if previous["generated"].get(path) == signature}
+            kept_results = previous_rows(args.output, RESULT_COLUMNS, "Generated_Image_Path")
+            kept_failed = previous_rows(failed_output, FAILED_COLUMNS, "Image_Path", filters=[("Image_Type", "==", "generated")])
+            if args.all_pairs:
+                kept_pairs = previous_rows(args.all_pairs, ALL_PAIRS_COLUMNS, "Generated_Image_Path")
+            removed = len(set(previous["generated"]) - set(processed["generated"]))
+            print(f"Modo incremental: {len(unchanged)} imágenes sin cambios, {len(entries) - len(unchanged)} nuevas o modificadas, {removed} eliminadas.")
+
+    # Obtener detecciones y características (desde el almacén si ya se calcularon) de las imágenes generadas
+    # nuevas o modificadas cuya imagen real tiene rostro
+    gen_paths = list(dict.fromkeys(
+        gen_path for _, gen_path, real_path in entries
+        if gen_path not in unchanged and real_face_data[real_path][1] is not None
+    ))
+    gen_face_data = embed_images(gen_paths, feature_cache, detector, recognizer, target_size, args.workers, model_config, args.scale)
+
+    # Filas pendientes de puntuar: metadatos de la prueba, rutas y vectores de características
+    pending_rows = []
+    gen_features = []
+    result_rows = []
+    failed_rows = []
+    pair_rows = []
+
+    # Validar las imágenes en el orden del recorrido
+    for meta, gen_path, real_path in entries:
+        print(f'{gen_path} \n')
+        real_loaded, face1_feature, _ = real_face_data[real_path]
+        if not real_loaded:
+            print(f"[WARN] No se pudo cargar {real_path} \n")
+            continue
+
+        # Validar detección
+        if face1_feature is None:
+            print(f"[WARN] No se detectó rostro en {real_path}, image_real \n")
+            failed_rows.append(meta + [real_path, "real"])
+            continue
+
+        # Imagen sin cambios: conservar sus filas anteriores
+        if gen_path in unchanged:
+            result_rows.extend(kept_results.get(gen_path, []))
+            failed_rows.extend(kept_failed.get(gen_path, []))
+            pair_rows.extend(kept_pairs.get(gen_path, []))
+            continue
+
+        gen_loaded, face2_feature, _ = gen_face_data[gen_path]
+        if not gen_loaded:
+            print(f"[WARN] No se pudo cargar {gen_path} \n")
+            continue
+
+        # Validar detección
+        if face2_feature is None:
+            print(f"[WARN] No se detectó rostro en {gen_path}, image_generated \n")
+            failed_rows.append(meta + [gen_path, "generated"])
+            continue
+
+        pending_rows.append(meta + [gen_path, real_path])
+        gen_features.append(face2_feature)
+
+    write_results(failed_output, FAILED_COLUMNS, failed_rows)
+
+    # Guardar el almacén de características para las siguientes ejecuciones
+    save_feature_cache(args.feature_cache, feature_cache)
+
+    # Matriz de referencia con todas las identidades reales con rostro detectado
+    reference_paths = [path for path in real_images.values() if real_face_data[path][1] is not None]
+    reference_index = {path: i for i, path in enumerate(reference_paths)}
+    reference_persons = {path: person_prefix for person_prefix, path in real_images.items()}
+
+    # Calcular similitudes de todas las parejas (N generadas x P reales)
+    if pending_rows:
+        cosine, l2 = score_features(np.stack(gen_features), np.stack([real_face_data[p][1] for p in reference_paths]))
+        genuine_idx = np.array([reference_index[row[6]] for row in pending_rows])
+        rows_idx = np.arange(len(pending_rows))
+        genuine_cosine = cosine[rows_idx, genuine_idx]
+        genuine_l2 = l2[rows_idx, genuine_idx]
+
+        # Decidir si son la misma identidad
+        same_identity = (genuine_cosine >= COSINE_SIMILARITY_THRESHOLD) & (genuine_l2 <= L2_SIMILARITY_THRESHOLD)
+    else:
+        cosine = l2 = np.zeros((0, len(reference_paths)))
+        genuine_cosine = genuine_l2 = same_identity = []
 
+    # Posición de cada imagen en el recorrido, para mezclar las filas conservadas y las nuevas en el mismo
+    # orden que una ejecución completa
+    walk_order = {gen_path: i for i, (_, gen_path, _) in enumerate(entries)}
 
+    # Escribir todos los resultados
+    result_rows.extend(
+        row + [round(float(c), 4), round(float(d), 4), bool(same)]
+        for row, c, d, same in zip(pending_rows, genuine_cosine, genuine_l2, same_identity)
+    )
+    if unchanged:
+        result_rows.sort(key=lambda row: walk_order[row[5]])
+    write_results(args.output, RESULT_COLUMNS, result_rows)
+
+    # Escribir las puntuaciones frente a todas las identidades (análisis de impostores y rank-1)
+    if args.all_pairs:
+        # Posición de cada identidad al ordenar por similitud coseno descendente (1 = la más parecida)
+        ranks = rank_identities(cosine)
+        same_matrix = (cosine >= COSINE_SIMILARITY_THRESHOLD) & (l2 <= L2_SIMILARITY_THRESHOLD)
+
+        pair_rows.extend(
+            row[:6] + [reference_persons[ref_path], ref_path, ref_path == row[6],
+                       round(float(cosine[i, j]), 4), round(float(l2[i, j]), 4), bool(same_matrix[i, j]), int(ranks[i, j])]
+            for i, row in enumerate(pending_rows)
+            for j, ref_path in enumerate(reference_paths)
+        )
+        if unchanged:
+            # Orden estable: las filas de cada imagen mantienen el orden de las identidades
+            pair_rows.sort(key=lambda row: walk_order[row[5]])
+        write_results(args.all_pairs, ALL_PAIRS_COLUMNS, pair_rows)
+
+    # Guardar el registro para la siguiente ejecución incremental
+    save_processed_manifest(args.processed_manifest, processed)
@@ -0,0 +1,303 @@
+import argparse
+import http.server
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs, urlsplit
+
+''' DECLARACIONES'''
+def placeholder_png(width=8, height=8, color=(128, 128, 128)):
+    '''
+    Genera una imagen PNG RGB de un color sólido sin dependencias externas.
+
+    :param width: ancho de la imagen
+    :param height: alto de la imagen
+    :param color: color (R, G, B)
+    :return: bytes del archivo PNG
+    '''
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    row = b"\x00" + bytes(color) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+class FakeComfyUI:
+    '''
+    Servidor ComfyUI simulado para probar el runner sin GPU: ejecuta los prompts en orden con un retardo fijo,
+    escribe una imagen de relleno por cada nodo SaveImage y responde con un historial equivalente al real.
+    '''
+
+    def __init__(self, output_dir, delay=0.1):
+        '''
+        :param output_dir: carpeta donde se escriben las imágenes (equivalente a la carpeta "output" de ComfyUI)
+        :param delay: segundos que tarda en "generarse" cada prompt
+        '''
+        self.output_dir = output_dir
+        self.delay = delay
+        self.lock = threading.Condition()
+        self.queue = []            # [número, prompt_id, prompt, extra_data, outputs_to_execute]
+        self.running = []
+        self.history = {}
+        self.inputs = {}           # imágenes subidas con /upload/image
+        self.counters = {}
+        self.number = 0
+        self.executed = 0
+        self.interrupted = False
+        os.makedirs(output_dir, exist_ok=True)
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def queue_prompt(self, prompt, prompt_id=None):
+        '''
+        Añade un prompt a la cola.
+
+        :param prompt: diccionario del pipeline en formato API
+        :param prompt_id: id propuesto por el cliente (como en ComfyUI); None para generar uno
+        :return: respuesta de /prompt
+        '''
+        if not any(node.get("class_type") == "SaveImage" for node in prompt.values()):
+            return 400, {"error": {"type": "prompt_no_outputs", "message": "Prompt has no outputs"}, "node_errors": {}}
+        for node_id, node in prompt.items():
+            # LoadImage acepta rutas absolutas o imágenes subidas a la carpeta "input"
+            image = node.get("inputs", {}).get("image") if node.get("class_type") == "LoadImage" else None
+            if isinstance(image, str) and not os.path.isabs(image) and image not in self.inputs:
+                error = {"type": "custom_validation_failed", "message": "Custom validation failed for node", "details": f"image - Invalid image file: {image}"}
+                return 400, {"error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"}, "node_errors": {node_id: {"errors": [error], "class_type": "LoadImage"}}}
+        with self.lock:
+            prompt_id = prompt_id or str(uuid.uuid4())
+            self.queue.append([self.number, prompt_id, prompt, {}, []])
+            self.number += 1
+            self.lock.notify_all()
+        return 200, {"prompt_id": prompt_id, "number": self.number - 1, "node_errors": {}}
+
+    def _save_image(self, filename_prefix):
+        '''
+        Escribe una imagen de relleno siguiendo la numeración de SaveImage (prefijo_00001_.png).
+
+        :param filename_prefix: prefijo del nodo SaveImage (puede incluir subcarpeta)
+        :return: diccionario {"filename", "subfolder", "type"}
+        '''
+        subfolder, prefix = os.path.split(os.path.normpath(filename_prefix))
+        counter = self.counters.get((subfolder, prefix), 0) + 1
+        self.counters[(subfolder, prefix)] = counter
+        filename = f"{prefix}_{counter:05}_.png"
+        os.makedirs(os.path.join(self.output_dir, subfolder), exist_ok=True)
+        with open(os.path.join(self.output_dir, subfolder, filename), "wb") as f:
+            f.write(placeholder_png())
+        return {"filename": filename, "subfolder": subfolder, "type": "output"}
+
+    def _worker(self):
+        '''
+        Ejecuta los prompts de la cola de uno en uno.
+        '''
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.lock.wait()
+                item = self.queue.pop(0)
+                self.running = [item]
+            with self.lock:
+                # Esperar el tiempo de generación salvo que se interrumpa el prompt
+                self.interrupted = False
+                self.lock.wait_for(lambda: self.interrupted, timeout=self.delay)
+                interrupted = self.interrupted
+            prompt_id, prompt = item[1], item[2]
+            with self.lock:
+                if interrupted:
+                    self.history[prompt_id] = {
+                        "prompt": item,
+                        "outputs": {},
+                        "status": {"status_str": "error", "completed": False, "messages": [["execution_interrupted", {"prompt_id": prompt_id}]]},
+                    }
+                    self.running = []
+                    continue
+                outputs = {}
+                for node_id, node in prompt.items():
+                    if node.get("class_type") == "SaveImage":
+                        outputs[node_id] = {"images": [self._save_image(node["inputs"]["filename_prefix"])]}
+                self.history[prompt_id] = {
+                    "prompt": item,
+                    "outputs": outputs,
+                    "status": {"status_str": "success", "completed": True, "messages": []},
+                }
+                self.running = []
+                self.executed += 1
+
+    def queue_status(self):
+        '''
+        :return: respuesta de /queue
+        '''
+        with self.lock:
+            return {"queue_running": list(self.running), "queue_pending": list(self.queue)}
+
+    def delete(self, prompt_ids):
+        '''
+        Elimina prompts pendientes de la cola (POST /queue {"delete": [...]}).
+
+        :param prompt_ids: prompt_id a eliminar
+        '''
+        with self.lock:
+            self.queue = [item for item in self.queue if item[1] not in prompt_ids]
+
+    def interrupt(self, prompt_id=None):
+        '''
+        Interrumpe el prompt en ejecución (POST /interrupt), solo si es prompt_id cuando se indica.
+
+        :param prompt_id: prompt_id que se quiere interrumpir (None para el que esté en ejecución)
+        '''
+        with self.lock:
+            if self.running and (prompt_id is None or self.running[0][1] == prompt_id):
+                self.interrupted = True
+                self.lock.notify_all()
+
+    def upload_image(self, name, data):
+        '''
+        Guarda una imagen subida (POST /upload/image con overwrite).
+
+        :param name: nombre del archivo
+        :param data: bytes de la imagen
+        :return: respuesta de /upload/image
+        '''
+        with self.lock:
+            self.inputs[os.path.basename(name)] = data
+        return {"name": os.path.basename(name), "subfolder": "", "type": "input"}
+
+    def read_output(self, filename, subfolder=""):
+        '''
+        Lee una imagen generada (equivalente a /view con type=output).
+
+        :param filename: nombre del archivo
+        :param subfolder: subcarpeta dentro de output_dir
+        :return: bytes de la imagen, o None si no existe
+        '''
+        path = os.path.join(self.output_dir, subfolder, os.path.basename(filename))
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_history(self, prompt_id):
+        '''
+        :param prompt_id: identificador del prompt
+        :return: respuesta de /history/{prompt_id}
+        '''
+        with self.lock:
+            return {prompt_id: self.history[prompt_id]} if prompt_id in self.history else {}
+
+
+def make_handler(server):
+    '''
+    Crea el manejador HTTP de un servidor simulado.
+
+    :param server: instancia de FakeComfyUI
+    :return: clase del manejador
+    '''
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _send(self, status, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_empty(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/queue":
+                self._send(200, server.queue_status())
+            elif path.startswith("/history/"):
+                self._send(200, server.get_history(path[len("/history/"):]))
+            elif path == "/view":
+                query = parse_qs(urlsplit(self.path).query)
+                data = server.read_output(query.get("filename", [""])[0], query.get("subfolder", [""])[0])
+                if data is None:
+                    self._send(404, {})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send(404, {})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = urlsplit(self.path).path
+            if path == "/prompt":
+                data = json.loads(body)
+                self._send(*server.queue_prompt(data["prompt"], data.get("prompt_id")))
+            elif path == "/queue":
+                server.delete(json.loads(body or b"{}").get("delete", []))
+                self._send_empty()
+            elif path == "/interrupt":
+                server.interrupt(json.loads(body or b"{}").get("prompt_id"))
+                self._send_empty()
+            elif path == "/upload/image":
+                # Formulario multipart con el archivo en el campo "image"
+                form = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + self.headers.get("Content-Type", "").encode("latin-1") + b"\r\n\r\n" + body)
+                for part in form.iter_parts():
+                    if part.get_param("name", header="content-disposition") == "image":
+                        self._send(200, server.upload_image(part.get_filename(), part.get_payload(decode=True)))
+                        return
+                self._send(400, {})
+            else:
+                self._send(404, {})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(output_dir, host="127.0.0.1", port=8188, delay=0.1):
+    '''
+    Arranca un servidor simulado en un hilo en segundo plano.
+
+    :param output_dir: carpeta de salida de las imágenes
+    :param host: dirección de escucha
+    :param port: puerto de escucha (0 para elegir uno libre)
+    :param delay: segundos que tarda en "generarse" cada prompt
+    :return: tupla (httpd, FakeComfyUI)
+    '''
+    fake = FakeComfyUI(output_dir, delay)
+    httpd = http.server.ThreadingHTTPServer((host, port), make_handler(fake))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, fake
+
+
+# Configurar argumentos
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', type=str, default='127.0.0.1', help='Dirección de escucha')
+parser.add_argument('--port', type=int, default=8188, help='Puerto de escucha')
+parser.add_argument('--output_dir', type=str, default='output', help='Carpeta donde se escriben las imágenes generadas')
+parser.add_argument('--delay', type=float, default=0.1, help='Segundos que tarda en generarse cada prompt')
+
+''' ACCIONES '''
+if __name__ == '__main__':
+    args = parser.parse_args()
+    httpd, _ = serve(args.output_dir, args.host, args.port, args.delay)
+    print(f"Servidor ComfyUI simulado escuchando en {args.host}:{httpd.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        httpd.shutdown()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+
+''' DECLARACIONES'''
+# Archivo con la huella de cada figura, dentro de su carpeta de salida
+FINGERPRINT_FILE = ".fingerprints.json"
+
+
+def fingerprint(inputs, params=None):
+    '''
+    Calcula la huella de una figura a partir de sus imágenes de entrada (ruta, fecha de modificación y tamaño,
+    en el orden en que se colocan) y de sus parámetros de composición.
+
+    :param inputs: lista de rutas de entrada (None para una celda vacía)
+    :param params: objeto serializable en JSON con los parámetros de composición
+    :return: huella hexadecimal
+    '''
+    digest = hashlib.sha1()
+    for path in inputs:
+        if path is None:
+            digest.update(b"-\0")
+            continue
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(str(path))}|{stat.st_mtime_ns}|{stat.st_size}\0".encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FigureBuild:
+    '''
+    Regeneración incremental de figuras (al estilo de make): cada figura guarda la huella de sus entradas y
+    solo se vuelve a dibujar si la huella cambia, si falta el archivo o si se fuerza con force.
+    '''
+
+    def __init__(self, output_dir, force=False, dependencies=()):
+        '''
+        :param output_dir: carpeta de las figuras (donde se guarda FINGERPRINT_FILE)
+        :param force: regenerar todas las figuras
+        :param dependencies: archivos de los que dependen todas las figuras (p. ej. el propio script)
+        '''
+        self.output_dir = str(output_dir)
+        self.path = os.path.join(self.output_dir, FINGERPRINT_FILE)
+        self.force = force
+        self.dependencies = [str(path) for path in dependencies]
+        self.built = 0
+        self.skipped = 0
+        try:
+            with open(self.path) as f:
+                self.fingerprints = json.load(f)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def needs_build(self, output, inputs, params=None):
+        '''
+        Comprueba si una figura está desactualizada.
+
+        :param output: ruta de la figura
+        :param inputs: lista de rutas de entrada (None para una celda vacía)
+        :param params: parámetros de composición de la figura
+        :return: huella nueva si hay que regenerarla (para pasarla a done), o None si está al día
+        '''
+        digest = fingerprint(self.dependencies + list(inputs), params)
+        name = os.path.basename(str(output))
+        if not self.force and self.fingerprints.get(name) == digest and os.path.exists(output):
+            self.skipped += 1
+            return None
+        return digest
+
+    def done(self, output, digest):
+        '''
+        Registra una figura regenerada (se guarda en el momento para conservar el progreso si se interrumpe).
+
+        :param output: ruta de la figura
+        :param digest: huella devuelta por needs_build
+        '''
+        self.fingerprints[os.path.basename(str(output))] = digest
+        self.built += 1
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.fingerprints, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        print(f"Figuras regeneradas: {self.built}, al día: {self.skipped}")
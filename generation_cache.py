@@ -0,0 +1,83 @@
+import os
+import shutil
+
+''' DECLARACIONES'''
+def link_or_copy(origin, destination):
+    '''
+    Crea un enlace duro de origin en destination, o lo copia si el sistema de archivos no lo permite.
+
+    :param origin: ruta del archivo existente
+    :param destination: ruta del nuevo archivo
+    '''
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(origin, destination)
+    except OSError:
+        shutil.copy2(origin, destination)
+
+
+class GenerationCache:
+    '''
+    Caché direccionada por contenido de las imágenes generadas. Cada entrada es la carpeta
+    <raíz>/<hash[:2]>/<hash> con las imágenes que produjo el pipeline canónico con ese hash.
+    '''
+
+    def __init__(self, root):
+        '''
+        :param root: carpeta raíz de la caché
+        '''
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        '''
+        :param key: hash del pipeline canónico
+        :return: lista de rutas de las imágenes en caché, o None si no hay entrada
+        '''
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return None
+        files = sorted(os.path.join(entry, f) for f in os.listdir(entry))
+        return files or None
+
+    def store(self, key, paths):
+        '''
+        Guarda en la caché las imágenes generadas por un pipeline.
+
+        :param key: hash del pipeline canónico
+        :param paths: rutas de las imágenes generadas
+        '''
+        if not paths:
+            return
+        entry = self._entry(key)
+        # Escribir en una carpeta temporal y renombrarla para que no queden entradas incompletas
+        tmp_entry = entry + ".tmp"
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+        for path in paths:
+            link_or_copy(path, os.path.join(tmp_entry, os.path.basename(path)))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+
+    def materialize(self, key, output_folder):
+        '''
+        Enlaza (o copia) en la carpeta de salida las imágenes en caché de un pipeline.
+
+        :param key: hash del pipeline canónico
+        :param output_folder: carpeta de salida de la prueba
+        :return: lista de rutas de destino, o None si no hay entrada en la caché
+        '''
+        files = self.lookup(key)
+        if files is None:
+            return None
+        destinations = []
+        for path in files:
+            destination = os.path.join(output_folder, os.path.basename(path))
+            link_or_copy(path, destination)
+            print(f"Imagen reutilizada de la caché: {os.path.basename(path)} -> {destination}")
+            destinations.append(destination)
+        return destinations
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+
+''' DECLARACIONES'''
+# Prefijo de los nombres de las imágenes subidas a la carpeta "input" de cada servidor
+UPLOAD_PREFIX = "refacer_"
+
+# Clases de nodo y campo que reciben el nombre de una imagen de entrada
+IMAGE_INPUTS = {"LoadImage": "image"}
+
+
+def content_hash(path, chunk_size=1 << 20):
+    '''
+    :param path: ruta del archivo
+    :param chunk_size: tamaño de los bloques de lectura
+    :return: hash SHA-256 hexadecimal del contenido
+    '''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InputRegistry:
+    '''
+    Registro de las imágenes de entrada subidas a los servidores de ComfyUI con /upload/image. Cada imagen
+    recibe un nombre derivado de su contenido, igual en todos los servidores, de modo que los prompts no
+    dependen del servidor que los ejecuta; cada servidor recibe cada archivo una sola vez, justo antes del
+    primer prompt que lo usa.
+    '''
+
+    def __init__(self, prefix=UPLOAD_PREFIX):
+        '''
+        :param prefix: prefijo de los nombres en el servidor
+        '''
+        self.prefix = prefix
+        self.names = {}         # {ruta local absoluta: nombre en el servidor}
+        self.paths = {}         # {nombre en el servidor: ruta local absoluta}
+        self.uploaded = {}      # {servidor: nombres ya subidos}
+        self._lock = threading.Lock()
+
+    def register(self, path):
+        '''
+        Registra una imagen local (calcula su hash solo la primera vez).
+
+        :param path: ruta de la imagen
+        :return: nombre de la imagen en los servidores, para el campo "image" de LoadImage
+        '''
+        path = os.path.abspath(path)
+        name = self.names.get(path)
+        if name is None:
+            # Las imágenes con el mismo contenido comparten nombre y solo se suben una vez
+            name = f"{self.prefix}{content_hash(path)[:16]}{os.path.splitext(path)[1].lower()}"
+            self.names[path] = name
+            self.paths.setdefault(name, path)
+        return name
+
+    def ensure(self, client, pipeline):
+        '''
+        Sube a un servidor las imágenes registradas que usa un pipeline y que aún no tiene.
+
+        :param client: cliente (ComfyUIClient) del servidor
+        :param pipeline: diccionario del pipeline en formato API
+        '''
+        for node in pipeline.values():
+            field = IMAGE_INPUTS.get(node.get("class_type"))
+            name = node.get("inputs", {}).get(field) if field else None
+            if not isinstance(name, str) or name not in self.paths:
+                continue
+            # Un cerrojo global evita que dos envíos concurrentes suban la misma imagen a la vez
+            with self._lock:
+                uploaded = self.uploaded.setdefault(client.server, set())
+                if name in uploaded:
+                    continue
+                client.upload_image(self.paths[name], name)
+                uploaded.add(name)
+                print(f"Imagen de entrada subida a {client.server}: {os.path.basename(self.paths[name])} -> {name}")
+
+    def forget(self, client):
+        '''
+        Olvida las imágenes subidas a un servidor (p. ej. al darlo por caído: puede volver reiniciado y sin ellas).
+
+        :param client: cliente (ComfyUIClient) del servidor
+        '''
+        with self._lock:
+            self.uploaded.pop(client.server, None)
@@ -0,0 +1,105 @@
+import hashlib
+import json
+from run_manifest import canonical_value
+
+''' DECLARACIONES'''
+# Órdenes disponibles: el original (prueba a prueba), imagen a imagen y voraz (imagen a imagen, encadenando en
+# cada imagen las pruebas que comparten más nodos con el prompt anterior)
+ORDERS = ["test", "image", "greedy"]
+
+
+def node_signatures(prompt):
+    '''
+    Calcula la firma de cada nodo de un prompt, igual que la caché de salidas de ComfyUI: un nodo se reutiliza
+    del prompt anterior si su clase, sus valores y las firmas de todos los nodos de los que depende coinciden.
+
+    :param prompt: diccionario {id: nodo} en formato API
+    :return: conjunto de tuplas (id, firma)
+    '''
+    signatures = {}
+
+    def signature(node_id):
+        if node_id in signatures:
+            return signatures[node_id]
+        node = prompt[node_id]
+        parts = [node["class_type"]]
+        for name, value in sorted(node.get("inputs", {}).items()):
+            if isinstance(value, list) and len(value) == 2 and value[0] in prompt:
+                # Conexión [id, salida]: depende de la firma del nodo origen
+                parts.append([name, signature(value[0]), value[1]])
+            else:
+                parts.append([name, canonical_value(value)])
+        signatures[node_id] = hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return signatures[node_id]
+
+    return frozenset((node_id, signature(node_id)) for node_id in prompt)
+
+
+def expected_cache_hits(signature_sets):
+    '''
+    Calcula la proporción esperada de nodos que ComfyUI reutiliza de su caché al ejecutar los prompts en orden
+    (cada prompt solo reutiliza las salidas del inmediatamente anterior).
+
+    :param signature_sets: lista de firmas de cada prompt (ver node_signatures), en orden de ejecución
+    :return: tupla (nodos reutilizados, nodos totales)
+    '''
+    hits = 0
+    total = 0
+    previous = frozenset()
+    for signatures in signature_sets:
+        hits += len(signatures & previous)
+        total += len(signatures)
+        previous = signatures
+    return hits, total
+
+
+def order_jobs(jobs, order="greedy"):
+    '''
+    Reordena los trabajos para aprovechar la caché de nodos de ComfyUI entre prompts consecutivos.
+
+    - "test": orden original (todas las imágenes de una prueba antes de pasar a la siguiente)
+    - "image": todas las pruebas de una imagen antes de pasar a la siguiente (LoadImage, AutoCropFaces y la rama
+      de CLIP Vision se reutilizan entre pruebas)
+    - "greedy": imagen a imagen y, dentro de cada imagen, siempre la prueba que comparte más nodos con el prompt
+      anterior (las pruebas que modifican los mismos nodos quedan juntas)
+
+    :param jobs: lista de trabajos con su pipeline en "pipeline"
+    :param order: uno de ORDERS
+    :return: lista de trabajos reordenada
+    '''
+    if order == "test":
+        return list(jobs)
+    if order not in ORDERS:
+        raise ValueError(f"Orden de trabajos desconocido: {order}")
+
+    # Agrupar por imagen conservando el orden de aparición
+    by_image = {}
+    for job in jobs:
+        by_image.setdefault(job["image_name"], []).append(job)
+    if order == "image":
+        return [job for group in by_image.values() for job in group]
+
+    ordered = []
+    previous = frozenset()
+    for group in by_image.values():
+        pending = [(node_signatures(job["pipeline"]), job) for job in group]
+        while pending:
+            # Prueba que más nodos comparte con el prompt anterior (en caso de empate, la primera)
+            best = max(range(len(pending)), key=lambda i: (len(pending[i][0] & previous), -i))
+            previous, job = pending.pop(best)
+            ordered.append(job)
+    return ordered
+
+
+def report_cache_hits(jobs, label):
+    '''
+    Muestra la proporción esperada de nodos reutilizados por la caché de ComfyUI para un orden de trabajos.
+
+    :param jobs: lista de trabajos con su pipeline en "pipeline", en orden de ejecución
+    :param label: nombre del orden
+    :return: proporción de nodos reutilizados
+    '''
+    hits, total = expected_cache_hits([node_signatures(job["pipeline"]) for job in jobs])
+    ratio = hits / total if total else 0.0
+    print(f"Orden {label}: {hits}/{total} nodos reutilizados de la caché de ComfyUI ({100 * ratio:.1f}%)")
+    return ratio
@@ -1,122 +1,304 @@
+import argparse
+import math
+import os
+import random
+import re
 import pandas as pd
+from results_store import RESULT_COLUMNS, read_results, write_results
 from sklearn.model_selection import KFold
 
 ''' DECLARACIONES'''
-csv_path = "" # Quitado por privacidad
+results_path = "" # Quitado por privacidad (carpeta Parquet o archivo .csv de face_comparison.py)
 group_cols = ["Node", "Parameter", "Value"]
 n_folds = 3
 alpha = 0.02
 all_best_configs = []
 
-''' ACCIONES '''
-if __name__ == '__main__':
-    # Leer resultados
-    df_results = pd.read_csv(csv_path, delimiter=";")
-
-    # Filtrar solo configuraciones de tipo "parameter"
-    df_params = df_results[df_results["Type"] == "parameters"]
-
-    # Obtener nombres únicos de personas
-    persons = df_params['Person'].unique()
-
-    # Repetir para cada fold
-    kf = KFold(n_splits=n_folds, shuffle=True, random_state=42)
-    for fold, (train_idx, test_idx) in enumerate(kf.split(persons)):
-
-        # División por persona
-        train_persons = persons[train_idx]
-        test_persons = persons[test_idx]
-        df_train = df_params[df_params['Person'].isin(train_persons)]
-        df_test = df_params[df_params['Person'].isin(test_persons)]
-
-        # ****** PARAMS ******
-        # Calcular medias en TRAIN
-        train_stats = (
-            df_train
-            .groupby(group_cols)["Cosine_Similarity"]
-            .mean()
-            .reset_index()
-            .rename(columns={"Cosine_Similarity": "cosine_train"})
-        )
+# Configurar argumentos
+parser = argparse.ArgumentParser()
+parser.add_argument('--results', type=str, default=results_path, help='Resultados de face_comparison.py (carpeta Parquet o archivo .csv)')
+parser.add_argument('--adaptive', action='store_true', help='Búsqueda adaptativa (successive halving): genera y evalúa las configuraciones con el runner descartando pronto las peores')
+parser.add_argument('--server', type=str, default='127.0.0.1:8188', help='Dirección del servidor de ComfyUI (IP:puerto)')
+parser.add_argument('--real_dir', type=str, default='inputs_refacer_real', help='Carpeta con las imágenes reales (inputs_refacer_real)')
+parser.add_argument('--sweep', type=str, default='', help='Archivo JSON de barrido con las configuraciones candidatas (por defecto, las pruebas paramétricas de ABLATION_TESTS)')
+parser.add_argument('--min_people', type=int, default=4, help='Personas evaluadas en la primera ronda')
+parser.add_argument('--eta', type=int, default=2, help='Factor de reducción: en cada ronda se conserva 1/eta de las configuraciones y se multiplica por eta el número de personas')
+parser.add_argument('--seed', type=int, default=42, help='Semilla para el orden de las personas')
+parser.add_argument('--queue_depth', type=int, default=8, help='Número de prompts que se mantienen en la cola del servidor')
+parser.add_argument('--manifest', type=str, default='adaptive_manifest.jsonl', help='Registro (.jsonl) del estado de cada trabajo')
+parser.add_argument('--generation_cache', type=str, default='generation_cache', help='Carpeta de la caché de imágenes por hash del pipeline ("" para desactivarla)')
+parser.add_argument('--feature_cache', type=str, default='face_features.npz', help='Almacén .npz de detecciones y características ya calculadas')
+parser.add_argument('--face_detection_model', '-fd', type=str, default='./models/face_detection_yunet_2023mar.onnx', help='Path to the face detection model.')
+parser.add_argument('--face_recognition_model', '-fr', type=str, default='./models/face_recognition_sface_2021dec.onnx', help='Path to the face recognition model.')
+parser.add_argument('--output', '--output_csv', dest='output', type=str, default='results_adaptive.parquet', help='Evaluaciones realizadas por la búsqueda adaptativa, con el formato de los resultados de face_comparison.py (carpeta Parquet o archivo .csv)')
 
-        # Obtener mejor configuración en TRAIN
-        best_train = (
-            train_stats
-            .sort_values(by=["Node", "Parameter", "cosine_train"], ascending=[True, True, False])
-            .groupby(["Node", "Parameter"], group_keys=False)
-            .head(1)
-            .copy()
-        )
 
-        # Media en Test para esas configuraciones
-        test_stats = (
-            df_test
-            .groupby(group_cols)["Cosine_Similarity"]
-            .mean()
-            .reset_index()
-            .rename(columns={"Cosine_Similarity": "cosine_test"})
-        )
+def test_group(test):
+    '''
+    Grupo de una prueba: las configuraciones de un mismo grupo compiten entre sí (equivale a (Node, Parameter)).
+
+    :param test: tupla (tipo, nodo, datos) de ABLATION_TESTS o de un barrido
+    :return: tupla que identifica el grupo
+    '''
+    test_type, node_name, data = test
+    if test_type == "sweep":
+        return test_type, node_name
+    return node_name, tuple(data.keys())
+
+
+def successive_halving(groups, persons, evaluate, min_people=4, eta=2):
+    '''
+    Successive halving por grupo: todas las configuraciones se evalúan con pocas personas, se conserva la
+    mejor fracción 1/eta de cada grupo y las supervivientes se evalúan con eta veces más personas, hasta que
+    queda una por grupo o se han usado todas las personas.
+
+    :param groups: diccionario {grupo: lista de configuraciones (claves hashables)}
+    :param persons: lista ordenada de personas
+    :param evaluate: función (configuraciones, personas) -> {(configuración, persona): puntuación} que genera
+                     y puntúa solo las parejas indicadas
+    :param min_people: personas de la primera ronda
+    :param eta: factor de reducción
+    :return: tupla ({grupo: configuraciones supervivientes}, {configuración: {persona: puntuación}})
+    '''
+    alive = {group: list(arms) for group, arms in groups.items()}
+    scores = {arm: {} for arms in groups.values() for arm in arms}
+    evaluated = 0
+    n_people = min_people
+
+    while True:
+        n = min(n_people, len(persons))
+        # Solo siguen compitiendo los grupos con más de una configuración
+        racing = [arm for arms in alive.values() if len(arms) > 1 for arm in arms]
+        if not racing or evaluated >= len(persons):
+            break
+
+        new_persons = persons[evaluated:n]
+        print(f"Ronda con {n} personas: {len(racing)} configuraciones, {len(racing) * len(new_persons)} generaciones")
+        for (arm, person), score in evaluate(racing, new_persons).items():
+            scores[arm][person] = score
+        evaluated = n
+
+        # Conservar la mejor fracción de cada grupo (las generaciones sin rostro puntúan 0)
+        for group, arms in alive.items():
+            if len(arms) > 1:
+                ranked = sorted(arms, key=lambda arm: -sum(scores[arm].get(p, 0.0) for p in persons[:n]) / n)
+                alive[group] = ranked if n == len(persons) else ranked[:max(1, math.ceil(len(arms) / eta))]
+        n_people *= eta
+
+    return alive, scores
+
+
+def adaptive_search(args):
+    '''
+    Busca la mejor configuración de cada (Node, Parameter) generando solo las imágenes necesarias: las
+    configuraciones se envían al runner, se puntúan con la similitud facial a medida que llegan y las peores
+    se descartan tras evaluarlas con un subconjunto de personas.
+
+    :param args: argumentos de la línea de comandos
+    '''
+    import numpy as np
+    import face_comparison as fc
+    import run_comfyui_ablation_study as runner
+    from comfyui_client import ComfyUIClient
+    from generation_cache import GenerationCache
+    from run_manifest import RunManifest
+    from sweep import sweep_tests
+
+    # Configuraciones candidatas agrupadas por (Node, Parameter)
+    tests = list(sweep_tests(args.sweep)) if args.sweep else [t for t in runner.ABLATION_TESTS if t[0] == "parameters"]
+    tests_by_key = {str(runner.get_output_folder(*test)): test for test in tests}
+    groups = {}
+    for key, test in tests_by_key.items():
+        groups.setdefault(test_group(test), []).append(key)
 
-        # Juntar train y test
-        merged = best_train.merge(test_stats, on=group_cols, how="left")
-        merged["fold"] = fold
-        all_best_configs.append(merged)
-
-    # Unir todos los folds
-    df_all = pd.concat(all_best_configs, ignore_index=True)
-
-    summary = (
-        df_all
-        .groupby(group_cols)
-        .agg(
-            avg_cosine_test = ("cosine_test", "mean"),
-            std_cosine_test = ("cosine_test", "std"),
-            count_test_evals = ("fold", "count")
+    # Personas con imagen de entrada y foto real, en orden aleatorio reproducible
+    real_images = fc.load_real_images(args.real_dir)
+    person_images = {}
+    for image_name in runner.list_input_images(runner.INPUT_IMAGES_FOLDER):
+        prefix_match = re.match(r"([a-zA-Z_]+)_retrato", image_name)
+        if prefix_match and prefix_match.group(1) in real_images:
+            person_images[prefix_match.group(1)] = image_name
+    persons = sorted(person_images)
+    random.Random(args.seed).shuffle(persons)
+
+    # Modelos de reconocimiento y vectores de las imágenes reales
+    target_size = 512
+    detector, recognizer = fc.create_models(args.face_detection_model, args.face_recognition_model, 0.9, 0.3, 5000, target_size)
+    feature_cache = fc.load_feature_cache(args.feature_cache)
+    real_features = {person: fc.get_face_data(path, feature_cache, detector, recognizer, target_size)[1] for person, path in real_images.items()}
+
+    # Runner
+    os.makedirs(runner.OUTPUT_IMAGES_FOLDER, exist_ok=True)
+    base_pipeline, load_image_node_id, save_image_node_id = runner.load_base_pipeline(runner.WORKFLOW_PATH)
+    manifest = RunManifest(args.manifest, resume=True)
+    cache = GenerationCache(args.generation_cache) if args.generation_cache else None
+    client = ComfyUIClient(args.server, output_dir=runner.OUTPUT_DEFAULT_FOLDER)
+    rows = []
+
+    def evaluate(arms, new_persons):
+        results = {}
+
+        def score_job(job, outputs):
+            person = re.match(r"([a-zA-Z_]+)_retrato", job["image_name"]).group(1)
+            arm = str(job["output_folder"])
+            score = 0.0
+            real_feature = real_features.get(person)
+            for output in outputs:
+                _, feature, _ = fc.get_face_data(os.path.normpath(str(output)), feature_cache, detector, recognizer, target_size)
+                if feature is not None and real_feature is not None:
+                    cosine, l2 = fc.score_features(feature, real_feature)
+                    score = float(cosine[0, 0])
+                    same_identity = score >= fc.COSINE_SIMILARITY_THRESHOLD and float(l2[0, 0]) <= fc.L2_SIMILARITY_THRESHOLD
+                    rows.append(list(fc.parse_test_path(arm)) + [person, os.path.normpath(str(output)), real_images[person], round(score, 4), round(float(l2[0, 0]), 4), same_identity])
+            results[(arm, person)] = score
+
+        runner.execute_jobs(
+            client,
+            runner.generate_jobs([tests_by_key[arm] for arm in arms], [person_images[p] for p in new_persons]),
+            build=lambda job: runner.build_pipeline(base_pipeline, job["test"], job["image_name"], load_image_node_id, save_image_node_id),
+            manifest=manifest,
+            save_image_node_id=save_image_node_id,
+            queue_depth=args.queue_depth,
+            cache=cache,
+            on_done=score_job,
         )
-        .reset_index()
-    )
+        return results
 
-    # Calcular score penalizado por varianza
-    summary["score"] = summary["avg_cosine_test"] + alpha * (summary["count_test_evals"] / n_folds)
+    alive, scores = successive_halving(groups, persons, evaluate, args.min_people, args.eta)
+    client.close()
+    manifest.close()
+    fc.save_feature_cache(args.feature_cache, feature_cache)
 
-    # Separar configuraciones óptimas por criterio
-    mejores_configs = (
-        summary
-        .sort_values(by=["Node", "Parameter", "score"], ascending=[True, True, False])
-        .groupby(["Node", "Parameter"], group_keys=False)
-        .head(1)
-        .reset_index(drop=True)
-    )
+    # Guardar todas las evaluaciones con el formato de los resultados de face_comparison.py
+    write_results(args.output, RESULT_COLUMNS, rows)
 
-    # Añadir configuración de bypass por nodo
-    df_bypass = df_results[df_results["Type"] == "bypass"]
+    # Mejor configuración de cada grupo
+    best = []
+    single = []
+    for group, arms in alive.items():
+        arm = arms[0]
+        evaluated = scores[arm]
+        _, node, parameter, value = fc.parse_test_path(arm)
+        if not evaluated:
+            # Grupo con una sola configuración: no compite con ninguna y no se genera ni se puntúa
+            single.append(f"{node} - {parameter} = {value}")
+            continue
+        best.append({
+            "Node": node, "Parameter": parameter, "Value": value,
+            "avg_cosine": np.mean(list(evaluated.values())),
+            "people_evaluated": len(evaluated),
+        })
+    generations = sum(len(evaluated) for evaluated in scores.values())
 
-    bypass_summary = (
-        df_bypass
-        .groupby("Node")["Cosine_Similarity"]
-        .mean()
-        .reset_index()
-        .rename(columns={"Cosine_Similarity": "bypass_cosine"})
-    )
+    print("\n******* Mejores configuraciones (búsqueda adaptativa): ******* ")
+    if best:
+        print(pd.DataFrame(best).sort_values(by=["Node", "Parameter"]).to_string(index=False))
+    if single:
+        print(f"\nGrupos con una sola configuración (sin alternativas, no se evalúan): {', '.join(sorted(single))}")
+    print(f"\nGeneraciones evaluadas: {generations} de {len(tests_by_key) * len(persons)} en el estudio exhaustivo")
 
-    # Comparar con las mejores configuraciones
-    comparativa = (
-        mejores_configs
-        .merge(bypass_summary, on="Node", how="left")
-        .assign(bypass_better=lambda df: df["bypass_cosine"] > df["avg_cosine_test"])
-    )
 
-    # Mostrar resultados obtenidos
-    print("\n*******  Comparativa con configuración bypass: ******* ")
-    print(comparativa[["Node", "Parameter", "Value", "avg_cosine_test", "bypass_cosine", "bypass_better"]].to_string(index=False))
-    print("\n******* Mejores configuraciones por estabilidad: ******* ")
-    print(mejores_configs.to_string(index=False))
+''' ACCIONES '''
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.adaptive:
+        adaptive_search(args)
+    else:
+        # Leer solo las configuraciones de tipo "parameters" (filtro aplicado al leer las particiones)
+        df_params = read_results(args.results, filters=[("Type", "==", "parameters")], columns=group_cols + ["Person", "Cosine_Similarity"])
+
+        # Obtener nombres únicos de personas
+        persons = df_params['Person'].unique()
+
+        # Repetir para cada fold
+        kf = KFold(n_splits=n_folds, shuffle=True, random_state=42)
+        for fold, (train_idx, test_idx) in enumerate(kf.split(persons)):
 
+            # División por persona
+            train_persons = persons[train_idx]
+            test_persons = persons[test_idx]
+            df_train = df_params[df_params['Person'].isin(train_persons)]
+            df_test = df_params[df_params['Person'].isin(test_persons)]
 
+            # ****** PARAMS ******
+            # Calcular medias en TRAIN
+            train_stats = (
+                df_train
+                .groupby(group_cols, observed=True)["Cosine_Similarity"]
+                .mean()
+                .reset_index()
+                .rename(columns={"Cosine_Similarity": "cosine_train"})
+            )
 
+            # Obtener mejor configuración en TRAIN
+            best_train = (
+                train_stats
+                .sort_values(by=["Node", "Parameter", "cosine_train"], ascending=[True, True, False])
+                .groupby(["Node", "Parameter"], group_keys=False, observed=True)
+                .head(1)
+                .copy()
+            )
 
+            # Media en Test para esas configuraciones
+            test_stats = (
+                df_test
+                .groupby(group_cols, observed=True)["Cosine_Similarity"]
+                .mean()
+                .reset_index()
+                .rename(columns={"Cosine_Similarity": "cosine_test"})
+            )
 
+            # Juntar train y test
+            merged = best_train.merge(test_stats, on=group_cols, how="left")
+            merged["fold"] = fold
+            all_best_configs.append(merged)
 
+        # Unir todos los folds
+        df_all = pd.concat(all_best_configs, ignore_index=True)
 
+        summary = (
+            df_all
+            .groupby(group_cols, observed=True)
+            .agg(
+                avg_cosine_test = ("cosine_test", "mean"),
+                std_cosine_test = ("cosine_test", "std"),
+                count_test_evals = ("fold", "count")
+            )
+            .reset_index()
+        )
 
+        # Calcular score penalizado por varianza
+        summary["score"] = summary["avg_cosine_test"] + alpha * (summary["count_test_evals"] / n_folds)
+
+        # Separar configuraciones óptimas por criterio
+        mejores_configs = (
+            summary
+            .sort_values(by=["Node", "Parameter", "score"], ascending=[True, True, False])
+            .groupby(["Node", "Parameter"], group_keys=False, observed=True)
+            .head(1)
+            .reset_index(drop=True)
+        )
+
+        # Añadir configuración de bypass por nodo
+        df_bypass = read_results(args.results, filters=[("Type", "==", "bypass")], columns=["Node", "Cosine_Similarity"])
+
+        bypass_summary = (
+            df_bypass
+            .groupby("Node", observed=True)["Cosine_Similarity"]
+            .mean()
+            .reset_index()
+            .rename(columns={"Cosine_Similarity": "bypass_cosine"})
+        )
+
+        # Comparar con las mejores configuraciones
+        comparativa = (
+            mejores_configs
+            .merge(bypass_summary, on="Node", how="left")
+            .assign(bypass_better=lambda df: df["bypass_cosine"] > df["avg_cosine_test"])
+        )
 
+        # Mostrar resultados obtenidos
+        print("\n*******  Comparativa con configuración bypass: ******* ")
+        print(comparativa[["Node", "Parameter", "Value", "avg_cosine_test", "bypass_cosine", "bypass_better"]].to_string(index=False))
+        print("\n******* Mejores configuraciones por estabilidad: ******* ")
+        print(mejores_configs.to_string(index=False))
@@ -0,0 +1,166 @@
+import json
+
+''' DECLARACIONES'''
+class Pipeline:
+    '''
+    Pipeline de ComfyUI en formato API, indexado una sola vez por id y por class_type. Las variantes de cada
+    prueba se crean con variant() y solo copian los nodos que modifican.
+    '''
+
+    def __init__(self, nodes):
+        '''
+        :param nodes: diccionario {id: nodo} del pipeline en formato API
+        '''
+        self.nodes = nodes
+        self.by_class = {}
+        for node_id, node in nodes.items():
+            self.by_class.setdefault(node["class_type"], []).append(node_id)
+
+    @classmethod
+    def from_file(cls, path):
+        '''
+        Carga un pipeline en formato API desde un archivo JSON.
+
+        :param path: ruta del archivo
+        :return: Pipeline
+        '''
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def ids_by_class(self, class_type):
+        '''
+        :param class_type: atributo "class_type" de los nodos
+        :return: lista de ids de los nodos de esa clase, en el orden del pipeline
+        '''
+        return list(self.by_class.get(class_type, []))
+
+    def first_id(self, class_type):
+        '''
+        :param class_type: atributo "class_type" del nodo
+        :return: id del primer nodo de esa clase, o None si no existe
+        '''
+        ids = self.by_class.get(class_type)
+        return ids[0] if ids else None
+
+    def variant(self):
+        '''
+        :return: nueva variante copy-on-write del pipeline
+        '''
+        return PipelineVariant(self)
+
+
+class PipelineVariant:
+    '''
+    Variante copy-on-write de un Pipeline: los nodos sin cambios se comparten con el pipeline base y los
+    modificados se copian en una capa propia la primera vez que se editan.
+    '''
+
+    def __init__(self, base):
+        '''
+        :param base: Pipeline del que parte la variante
+        '''
+        self.base = base
+        self.overlay = {}
+        self.removed = set()
+
+    def __contains__(self, node_id):
+        return node_id in self.base.nodes and node_id not in self.removed
+
+    def get(self, node_id):
+        '''
+        Devuelve un nodo para lectura (no se debe modificar; para ello usar edit o set_input).
+
+        :param node_id: id del nodo
+        :return: diccionario del nodo
+        '''
+        return self.overlay.get(node_id, self.base.nodes[node_id])
+
+    def items(self):
+        '''
+        :return: iterador de tuplas (id, nodo) de los nodos de la variante, para lectura
+        '''
+        for node_id in self.base.nodes:
+            if node_id not in self.removed:
+                yield node_id, self.get(node_id)
+
+    def ids_by_class(self, class_type):
+        '''
+        :param class_type: atributo "class_type" de los nodos
+        :return: lista de ids de los nodos de esa clase presentes en la variante
+        '''
+        return [node_id for node_id in self.base.by_class.get(class_type, []) if node_id not in self.removed]
+
+    def first_id(self, class_type):
+        '''
+        :param class_type: atributo "class_type" del nodo
+        :return: id del primer nodo de esa clase presente en la variante, o None si no existe
+        '''
+        ids = self.ids_by_class(class_type)
+        return ids[0] if ids else None
+
+    def edit(self, node_id):
+        '''
+        Devuelve el nodo para modificarlo, copiándolo (junto a sus inputs) la primera vez.
+
+        :param node_id: id del nodo
+        :return: diccionario del nodo propio de la variante
+        '''
+        node = self.overlay.get(node_id)
+        if node is None:
+            node = dict(self.base.nodes[node_id])
+            node["inputs"] = dict(node.get("inputs", {}))
+            self.overlay[node_id] = node
+        return node
+
+    def set_input(self, node_id, name, value):
+        '''
+        Modifica un input de un nodo.
+
+        :param node_id: id del nodo
+        :param name: nombre del input
+        :param value: nuevo valor (o conexión [id, salida])
+        '''
+        self.edit(node_id)["inputs"][name] = value
+
+    def remove(self, node_id):
+        '''
+        Elimina un nodo de la variante.
+
+        :param node_id: id del nodo
+        '''
+        self.removed.add(node_id)
+        self.overlay.pop(node_id, None)
+
+    def prune(self, output_ids):
+        '''
+        Elimina los nodos muertos: los que no se alcanzan recorriendo las conexiones hacia atrás desde los nodos
+        de salida (p. ej. un nodo al que se ha aplicado un bypass y las ramas que solo lo alimentaban).
+
+        :param output_ids: ids de los nodos de salida que se conservan (p. ej. SaveImage)
+        :return: lista de ids eliminados
+        '''
+        reachable = set()
+        pending = [node_id for node_id in output_ids if node_id in self]
+        while pending:
+            node_id = pending.pop()
+            if node_id in reachable:
+                continue
+            reachable.add(node_id)
+            # Las conexiones tienen la forma [id del nodo origen, índice de salida]
+            for value in self.get(node_id).get("inputs", {}).values():
+                if isinstance(value, list) and len(value) == 2 and value[0] in self:
+                    pending.append(value[0])
+
+        dead = [node_id for node_id, _ in self.items() if node_id not in reachable]
+        for node_id in dead:
+            self.remove(node_id)
+        return dead
+
+    def to_prompt(self):
+        '''
+        Serializa la variante al diccionario "prompt" de /prompt (los nodos sin cambios se comparten con el
+        pipeline base, por lo que el resultado no se debe modificar).
+
+        :return: diccionario {id: nodo}
+        '''
+        return dict(self.items())
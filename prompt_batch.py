@@ -0,0 +1,149 @@
+from job_order import node_signatures
+
+''' DECLARACIONES'''
+# Clases de nodo cuyas variantes se pueden agrupar en un mismo prompt: las pruebas que solo cambian estos nodos
+# (semilla, cfg, pasos, sampler...) comparten todo lo anterior (modelos, recorte, CLIP Vision, IPAdapter y
+# condicionamiento) y solo necesitan una rama propia desde el sampler hasta SaveImage
+BATCH_CLASSES = ["KSamplerAdvanced", "KSampler"]
+
+
+def branch_nodes(prompt, classes):
+    '''
+    Devuelve los nodos de las clases indicadas y todos los que dependen de ellos.
+
+    :param prompt: diccionario {id: nodo} en formato API
+    :param classes: atributos "class_type" de los nodos que pueden variar dentro de un prompt agrupado
+    :return: conjunto de ids
+    '''
+    consumers = {}
+    for node_id, node in prompt.items():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, list) and len(value) == 2 and value[0] in prompt:
+                consumers.setdefault(value[0], []).append(node_id)
+
+    branch = set()
+    pending = [node_id for node_id, node in prompt.items() if node["class_type"] in classes]
+    while pending:
+        node_id = pending.pop()
+        if node_id not in branch:
+            branch.add(node_id)
+            pending.extend(consumers.get(node_id, []))
+    return branch
+
+
+def fold_prompts(prompts, output_id):
+    '''
+    Combina varios prompts en uno solo: los nodos con la misma firma en todos ellos (ver node_signatures) se
+    ejecutan una vez y el resto se duplica en una rama por prompt, con el id "<id>_<índice>".
+
+    :param prompts: lista de diccionarios {id: nodo} con los mismos ids
+    :param output_id: id del nodo SaveImage de los prompts
+    :return: tupla (prompt combinado, id del SaveImage de cada prompt)
+    '''
+    signatures = [dict(node_signatures(prompt)) for prompt in prompts]
+    shared = {node_id for node_id, signature in signatures[0].items() if all(s[node_id] == signature for s in signatures[1:])}
+
+    folded = {node_id: prompts[0][node_id] for node_id in shared}
+    for index, prompt in enumerate(prompts):
+        for node_id, node in prompt.items():
+            if node_id in shared:
+                continue
+            inputs = {}
+            for name, value in node.get("inputs", {}).items():
+                # Las conexiones a nodos de la rama apuntan a la copia de la misma rama
+                if isinstance(value, list) and len(value) == 2 and value[0] in prompt and value[0] not in shared:
+                    value = [f"{value[0]}_{index}", value[1]]
+                inputs[name] = value
+            folded[f"{node_id}_{index}"] = dict(node, inputs=inputs)
+    return folded, [f"{output_id}_{index}" for index in range(len(prompts))]
+
+
+class PromptBatch:
+    '''
+    Trabajos de una misma imagen pendientes de agruparse en un prompt.
+    '''
+
+    def __init__(self, job, classes, output_id):
+        '''
+        :param job: primer trabajo del grupo (con su pipeline en "pipeline")
+        :param classes: clases de nodo que pueden variar dentro del grupo
+        :param output_id: id del nodo SaveImage
+        '''
+        self.output_id = output_id
+        self.branch = branch_nodes(job["pipeline"], classes)
+        self.jobs = [job]
+        self.signatures = [dict(node_signatures(job["pipeline"]))]
+
+    def accepts(self, job):
+        '''
+        Comprueba si un trabajo se puede añadir al grupo: debe tener los mismos nodos, diferenciarse de todos
+        los trabajos del grupo solo en la rama de las clases agrupables y producir una imagen distinta.
+
+        :param job: trabajo con su pipeline en "pipeline"
+        :return: firmas del trabajo si es compatible, o None
+        '''
+        signatures = dict(node_signatures(job["pipeline"]))
+        if signatures.keys() != self.signatures[0].keys():
+            return None
+        for other in self.signatures:
+            differing = {node_id for node_id, signature in signatures.items() if other[node_id] != signature}
+            if self.output_id not in differing or not differing <= self.branch:
+                return None
+        return signatures
+
+    def add(self, job, signatures):
+        self.jobs.append(job)
+        self.signatures.append(signatures)
+
+    def to_job(self):
+        '''
+        Convierte el grupo en un único trabajo. Cada trabajo agrupado recibe el id de su SaveImage en
+        "save_image_node_id" para llevar sus imágenes a su propia carpeta.
+
+        :return: el trabajo original si el grupo tiene uno solo, o {"jobs", "image_name", "pipeline"}
+        '''
+        if len(self.jobs) == 1:
+            return self.jobs[0]
+        pipeline, output_ids = fold_prompts([job.pop("pipeline") for job in self.jobs], self.output_id)
+        for job, output_id in zip(self.jobs, output_ids):
+            job["save_image_node_id"] = output_id
+        return {"jobs": self.jobs, "image_name": self.jobs[0]["image_name"], "pipeline": pipeline}
+
+
+def batch_jobs(jobs, batch_size, output_id, classes=BATCH_CLASSES):
+    '''
+    Agrupa en un mismo prompt hasta batch_size trabajos compatibles de la misma imagen (ver PromptBatch). Cada
+    imagen mantiene un grupo abierto, que se envía al llenarse o al llegar un trabajo incompatible, por lo que
+    las pruebas de sampler consecutivas (p. ej. las semillas de noise_seed) se agrupan también en el orden por
+    pruebas.
+
+    :param jobs: iterable de trabajos con su pipeline en "pipeline"
+    :param batch_size: número máximo de trabajos por prompt
+    :param output_id: id del nodo SaveImage
+    :param classes: clases de nodo que pueden variar dentro de un prompt
+    :return: generador de trabajos (los agrupados con la lista de sus trabajos en "jobs")
+    '''
+    open_batches = {}
+    for job in jobs:
+        batch = open_batches.get(job["image_name"])
+        signatures = batch.accepts(job) if batch is not None else None
+        if signatures is None:
+            if batch is not None:
+                yield batch.to_job()
+            open_batches[job["image_name"]] = PromptBatch(job, classes, output_id)
+            continue
+        batch.add(job, signatures)
+        if len(batch.jobs) >= batch_size:
+            del open_batches[job["image_name"]]
+            yield batch.to_job()
+
+    for batch in open_batches.values():
+        yield batch.to_job()
+
+
+def batch_members(job):
+    '''
+    :param job: trabajo, agrupado o no
+    :return: lista de los trabajos que contiene
+    '''
+    return job.get("jobs", [job])
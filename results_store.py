@@ -0,0 +1,140 @@
+import csv
+import os
+import shutil
+
+''' DECLARACIONES'''
+# Columnas de los resultados de face_comparison.py
+RESULT_COLUMNS = ["Type", "Node", "Parameter", "Value", "Person", "Generated_Image_Path", "Real_Image_Path", "Cosine_Similarity", "L2_Distance", "Same_Identity"]
+FAILED_COLUMNS = ["Type", "Node", "Parameter", "Value", "Person", "Image_Path", "Image_Type"]
+ALL_PAIRS_COLUMNS = ["Type", "Node", "Parameter", "Value", "Person", "Generated_Image_Path", "Candidate_Person", "Candidate_Image_Path", "Genuine", "Cosine_Similarity", "L2_Distance", "Same_Identity", "Rank"]
+
+# Columnas con pocos valores distintos (codificadas como diccionario en Parquet y category en pandas)
+CATEGORY_COLUMNS = ["Type", "Node", "Parameter", "Value", "Person", "Real_Image_Path", "Candidate_Person", "Candidate_Image_Path", "Image_Type"]
+FLOAT_COLUMNS = ["Cosine_Similarity", "L2_Distance"]
+BOOL_COLUMNS = ["Same_Identity", "Genuine"]
+INT_COLUMNS = ["Rank"]
+
+# Columnas por las que se particiona el conjunto Parquet (una carpeta Type=.../Node=... por grupo)
+PARTITION_COLUMNS = ["Type", "Node"]
+
+
+def is_csv(path):
+    '''
+    :param path: ruta de los resultados
+    :return: True si es un archivo .csv (formato antiguo separado por ";"), False si es un conjunto Parquet
+    '''
+    return path.lower().endswith(".csv")
+
+
+def typed_frame(rows, columns):
+    '''
+    Crea un DataFrame con los tipos de los resultados: categóricas para los textos repetidos, float32 para las
+    puntuaciones y booleanos para las decisiones.
+
+    :param rows: iterable de filas (listas con el orden de columns)
+    :param columns: nombres de las columnas
+    :return: DataFrame
+    '''
+    import pandas as pd
+
+    df = pd.DataFrame(list(rows), columns=columns)
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype(str).astype("category")
+        elif column in FLOAT_COLUMNS:
+            df[column] = df[column].astype("float32")
+        elif column in BOOL_COLUMNS:
+            df[column] = df[column].astype(bool)
+        elif column in INT_COLUMNS:
+            df[column] = df[column].astype("int32")
+    return df
+
+
+def write_results(path, columns, rows):
+    '''
+    Guarda los resultados como conjunto Parquet particionado por Type/Node o, si la ruta termina en .csv, como
+    CSV separado por ";".
+
+    :param path: carpeta del conjunto Parquet o archivo .csv
+    :param columns: nombres de las columnas
+    :param rows: iterable de filas (listas con el orden de columns)
+    '''
+    if is_csv(path):
+        with open(path, mode='w', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(columns)
+            writer.writerows(rows)
+        return
+
+    df = typed_frame(rows, columns)
+    # Escribir en una carpeta temporal y renombrarla para no mezclar archivos de ejecuciones anteriores
+    tmp_path = path.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    if df.empty:
+        os.makedirs(tmp_path)
+        df.to_parquet(os.path.join(tmp_path, "empty.parquet"), index=False)
+    else:
+        df.to_parquet(tmp_path, partition_cols=[c for c in PARTITION_COLUMNS if c in columns], index=False)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def apply_filters(df, filters):
+    '''
+    Aplica en memoria filtros con el formato de pyarrow ([(columna, operador, valor), ...], unidos con AND).
+
+    :param df: DataFrame
+    :param filters: lista de tuplas (columna, operador, valor)
+    :return: DataFrame filtrado
+    '''
+    for column, op, value in filters:
+        series = df[column]
+        if op in ("=", "=="):
+            mask = series == value
+        elif op == "!=":
+            mask = series != value
+        elif op == "<":
+            mask = series < value
+        elif op == "<=":
+            mask = series <= value
+        elif op == ">":
+            mask = series > value
+        elif op == ">=":
+            mask = series >= value
+        elif op == "in":
+            mask = series.isin(value)
+        elif op == "not in":
+            mask = ~series.isin(value)
+        else:
+            raise ValueError(f"Operador de filtro desconocido: {op}")
+        df = df[mask]
+    return df
+
+
+def read_results(path, filters=None, columns=None):
+    '''
+    Lee los resultados de un conjunto Parquet (los filtros se aplican sobre las particiones y las estadísticas
+    de cada archivo, sin leer los datos descartados) o de un CSV separado por ";".
+
+    :param path: carpeta del conjunto Parquet o archivo .csv
+    :param filters: lista opcional de tuplas (columna, operador, valor) unidas con AND, p. ej. [("Type", "==", "parameters")]
+    :param columns: lista opcional de columnas a leer
+    :return: DataFrame
+    '''
+    import pandas as pd
+
+    if is_csv(path):
+        # "N/A" (parámetro y valor de las pruebas bypass) se conserva como texto, igual que en Parquet
+        df = pd.read_csv(path, delimiter=";", keep_default_na=False)
+        if filters:
+            df = apply_filters(df, filters)
+        return df[columns] if columns else df
+
+    df = pd.read_parquet(path, filters=filters or None, columns=columns)
+    # Las columnas de partición se leen con todas las categorías del conjunto y en orden de descubrimiento:
+    # conservar solo las usadas y ordenarlas alfabéticamente para que sort_values ordene igual que con el CSV
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            values = df[column].cat.remove_unused_categories()
+            df[column] = values.cat.reorder_categories(sorted(values.cat.categories))
+    return df
@@ -1,10 +1,17 @@
-import shutil
+import argparse
+import http.client
 from pathlib import Path
-from urllib import request
-import json
 import os
-import copy
 import time
+from comfyui_client import ComfyUIClient, ComfyUIError, ComfyUIPool, history_images, history_succeeded
+from run_manifest import RunManifest, canonical_value, job_key, pipeline_hash
+from generation_cache import GenerationCache
+from input_registry import InputRegistry
+from pipeline_graph import Pipeline
+from sweep import sweep_tests
+from early_stopping import BASELINE_FAILED, BASELINE_RESULTS, EarlyStopping, baseline_from_results
+from job_order import ORDERS, order_jobs, report_cache_hits
+from prompt_batch import BATCH_CLASSES, batch_jobs, batch_members
 
 ''' DECLARACIONES'''
 # Ruta al workflow por defecto
@@ -17,8 +24,39 @@ OUTPUT_DEFAULT_FOLDER = "output"                # Carpeta por defecto donde se a
 TEMP_WORKFLOW = "user/default/workflows/temp_pipeline.json"   # Pipeline temporal
 
 # Gestión de resultados
-MAX_WAIT_TIM_SEC = 300
-CHECK_INTERVAL = 5
+MAX_WAIT_TIM_SEC = 300     # Tiempo máximo sin que termine ningún prompt
+CHECK_INTERVAL = 1         # Segundos entre consultas a la cola del servidor
+
+# Configurar argumentos
+parser = argparse.ArgumentParser()
+parser.add_argument('--server', type=str, nargs='+', default=['127.0.0.1:8188'], help='Dirección de uno o varios servidores de ComfyUI (IP:puerto). Con varios, cada trabajo va al que tiene menos prompts en cola y las imágenes se descargan con /view')
+parser.add_argument('--comfyui_output', type=str, default=OUTPUT_DEFAULT_FOLDER, help='Carpeta de salida del servidor local de ComfyUI (su opción --output-directory). Si contiene outputs_refacer, SaveImage guarda cada imagen directamente en la carpeta de su prueba; si no, se escribe en una subcarpeta propia de la prueba y después se renombra ("" si el servidor es remoto: las imágenes se descargan con /view)')
+parser.add_argument('--upload_inputs', action='store_true', help='Subir una vez a cada servidor las imágenes de inputs_refacer con /upload/image (nombre según su contenido) en lugar de pasar a LoadImage su ruta local, para servidores remotos sin carpeta compartida')
+parser.add_argument('--max_in_flight', type=int, default=4, help='Número máximo de envíos simultáneos a /prompt')
+parser.add_argument('--queue_depth', type=int, default=8, help='Número de prompts que se mantienen en la cola del servidor')
+parser.add_argument('--manifest', type=str, default='ablation_manifest.jsonl', help='Registro (.jsonl) del estado de cada trabajo')
+parser.add_argument('--resume', action='store_true', help='Reanudar una ejecución: omitir los trabajos terminados, recoger del servidor los prompts que terminaron o siguen en cola y volver a encolar solo los que no conoce')
+parser.add_argument('--generation_cache', type=str, default='generation_cache', help='Carpeta de la caché de imágenes por hash del pipeline ("" para desactivarla)')
+parser.add_argument('--sweep', type=str, default='', help='Archivo JSON con un barrido de parámetros (grid, random, lhs o sobol) que sustituye a ABLATION_TESTS')
+parser.add_argument('--order', type=str, default='test', choices=ORDERS, help='Orden de los trabajos: test (prueba a prueba), image (imagen a imagen) o greedy (imagen a imagen, agrupando las pruebas que comparten más nodos) para aprovechar la caché de nodos de ComfyUI. Con --early_stop, los órdenes por imagen retrasan la parada hasta puntuar --early_stop_min_people imágenes de cada prueba')
+parser.add_argument('--batch_size', type=int, default=1, help='Número máximo de trabajos de una misma imagen que se agrupan en un prompt cuando solo difieren en el sampler (semilla, cfg, pasos...): los nodos comunes se ejecutan una vez y cada trabajo tiene su rama hasta SaveImage')
+parser.add_argument('--batch_classes', type=str, nargs='+', default=BATCH_CLASSES, help='Clases de nodo que pueden variar dentro de un prompt agrupado con --batch_size')
+parser.add_argument('--retries', type=int, default=5, help='Reintentos ante fallos transitorios del servidor')
+parser.add_argument('--score', action='store_true', help='Puntuar cada imagen con face_comparison en cuanto se genera (procesos de CPU en paralelo a la generación)')
+parser.add_argument('--score_workers', type=int, default=2, help='Número de procesos de puntuación con --score')
+parser.add_argument('--real_dir', type=str, default='inputs_refacer_real', help='Carpeta con las imágenes reales (inputs_refacer_real) para --score')
+parser.add_argument('--scores_output', type=str, default='results_streaming.parquet', help='Resultados de --score (carpeta Parquet o archivo .csv), con el formato de face_comparison.py. Los errores de detección se escriben junto a ellos en failed_images_streaming. Se sobrescriben en cada ejecución, por lo que no deben coincidir con los resultados del estudio completo de face_comparison.py')
+parser.add_argument('--live_summary', type=str, default='live_summary.csv', help='Archivo .csv con los agregados parciales por prueba, actualizado durante la ejecución con --score')
+parser.add_argument('--feature_cache', type=str, default='face_features.npz', help='Almacén .npz de detecciones y características para --score ("" para desactivarlo)')
+parser.add_argument('--early_stop', action='store_true', help='Con --score, detener las pruebas cuya detección o similitud es significativamente inferior a la de referencia y cancelar sus prompts en cola')
+parser.add_argument('--early_stop_min_people', type=int, default=5, help='Imágenes puntuadas de una prueba antes de la primera comprobación de parada temprana')
+parser.add_argument('--early_stop_confidence', type=float, default=0.95, help='Confianza de la regla de parada temprana')
+parser.add_argument('--baseline_results', type=str, default=BASELINE_RESULTS, help='Resultados de face_comparison.py de los que se obtiene la referencia de la parada temprana: las imágenes de las pruebas que dejan el pipeline sin modificar')
+parser.add_argument('--baseline_failed', type=str, default=BASELINE_FAILED, help='Imágenes sin rostro de face_comparison.py para la tasa de detección de referencia')
+parser.add_argument('--baseline_detection_rate', type=float, default=None, help='Tasa de detección de referencia para la parada temprana (por defecto, la del pipeline original en --baseline_results)')
+parser.add_argument('--baseline_cosine', type=float, default=None, help='Similitud coseno media de referencia para la parada temprana (por defecto, la del pipeline original en --baseline_results)')
+parser.add_argument('--face_detection_model', '-fd', type=str, default='./models/face_detection_yunet_2023mar.onnx', help='Path to the face detection model.')
+parser.add_argument('--face_recognition_model', '-fr', type=str, default='./models/face_recognition_sface_2021dec.onnx', help='Path to the face recognition model.')
 
 def safe_value_name(value):
     '''
@@ -33,7 +71,11 @@ def safe_value_name(value):
     elif isinstance(value, bool):
         return str(value).lower()
     elif isinstance(value, str):
-        return value.replace(" ", "-").replace(".", "_")
+        value = value.replace(" ", "-").replace(".", "_")
+        # Los separadores de ruta (p. ej. "K+V w/ C penalty") crearían subcarpetas
+        for separator in {"/", "\\", os.sep, os.altsep} - {None}:
+            value = value.replace(separator, "-")
+        return value
     elif isinstance(value, int):
         return str(value)
     else:
@@ -44,28 +86,22 @@ def get_node_ids_by_class(pipeline, class_type):
     '''
     Devuelve los ids dado el string correspondiente al atributo "class_type" de un nodo.
 
-    :param pipeline: diccionario del pipeline
+    :param pipeline: variante del pipeline
     :param class_type: string que equivale al nombre del nodo
     :return: ids
     '''
-    id = None
-    for nids, node in pipeline.items():
-        if node["class_type"] == class_type:
-            id = nids
-            break
-
-    return id
+    return pipeline.first_id(class_type)
 
 
 def bypass_nodes(pipeline, target_class, replacement_class, destination_classes):
     '''
-    Reemplaza en los nodos destino el id de target_class por el de replacement_class (NO está optimizado para eliminar el nodo silenciado).
+    Reemplaza en los nodos destino el id de target_class por el de replacement_class. El nodo silenciado y las
+    ramas que solo lo alimentaban se eliminan después en build_pipeline (PipelineVariant.prune).
 
-    :param pipeline: diccionario del pipeline a modificar
+    :param pipeline: variante del pipeline a modificar
     :param target_class: atributo "class_type" del nodo al cual se le aplica el bypass
     :param replacement_class: atributo "class_type" del nodo que debe sustituir al nodo al que se le aplica el bypass
     :param destination_classes: atributos "class_type" de los nodos destino que deben modificar el id del nodo eliminado
-    :param remove: si al hacer bypass se elimina el nodo del flujo o se queda desconectado (con o sin, hay formas más óptimas)
     :return: pipeline modificado
     '''
 
@@ -73,9 +109,8 @@ def bypass_nodes(pipeline, target_class, replacement_class, destination_classes)
     target_id = get_node_ids_by_class(pipeline, target_class)
     replacement_id = get_node_ids_by_class(pipeline, replacement_class)
     destination_ids = []
-    for nid, node in pipeline.items():
-        if node["class_type"] in destination_classes:
-            destination_ids.append(nid)
+    for destination_class in destination_classes:
+        destination_ids.extend(pipeline.ids_by_class(destination_class))
 
     # Comprobar si se han encontrado los ids
     if not target_id or not replacement_id or not destination_ids:
@@ -86,12 +121,12 @@ def bypass_nodes(pipeline, target_class, replacement_class, destination_classes)
     # Iterar sobre cada nodo destino para modificar el id antiguo
     for dest_id in destination_ids:
         # Obtener los campos inputs de ese nodo
-        inputs = pipeline[dest_id].get("inputs", {})
+        inputs = pipeline.get(dest_id).get("inputs", {})
         # Iterar sobre cada input hasta encontrar el atributo que se pretende modificar
-        for input_name, val in inputs.items():
+        for input_name, val in list(inputs.items()):
             if isinstance(val, list) and val[0] == target_id:
                 new_val = [replacement_id, val[1]] # Ej: ["6", 1] -> ["13", 1]
-                pipeline[dest_id]["inputs"][input_name] = new_val
+                pipeline.set_input(dest_id, input_name, new_val)
 
     print(f" Bypass de {target_class} finalizado: (target {target_id}, replacement {replacement_class}, destinations {destination_classes}")
     return pipeline
@@ -101,7 +136,7 @@ def clear_prompt_in_node(pipeline, class_type):
     '''
     Reemplaza el atributo text, de los nodos PhotoMakerEncode y ClipTextEncode para emular un bypass.
 
-    :param pipeline: diccionario del pipeline a modificar
+    :param pipeline: variante del pipeline a modificar
     :param class_type: nombre del nodo al que se desea aplicar la modificación
     :return: pipeline modificado
     '''
@@ -109,44 +144,544 @@ def clear_prompt_in_node(pipeline, class_type):
     field = "text"
 
     # Encontrar el nodo
-    for node_id, node in pipeline.items():
-        if node["class_type"] == class_type and field in node.get("inputs", {}):
+    for node_id in pipeline.ids_by_class(class_type):
+        if field in pipeline.get(node_id).get("inputs", {}):
             print(f"Limpieza del campo '{field}' en nodo {node_id} ({class_type})")
-            node["inputs"][field] = ""
+            pipeline.set_input(node_id, field, "")
 
     return pipeline
 
 
 def set_multiple_params_by_class(pipeline, class_type, param_value_dict):
     '''
-    Modifica uno o varios parámetros del primer nodo encontrado con el class_type especificado.
+    Modifica uno o varios parámetros de los nodos con el class_type especificado.
 
-    :param pipeline: diccionario del pipeline a modificar
+    :param pipeline: variante del pipeline a modificar
     :param class_type: string con el class_type del nodo objetivo
     :param param_value_dict: diccionario con los parámetros a modificar
     :return: pipeline modificado
     '''
 
-    found = False
-    # Iterar para buscar el nodo objetivo
-    for node_id, node in pipeline.items():
-        # Comprobar si es el mismo "class_type"
-        if node.get("class_type") == class_type:
-            found = True
-            # Iterar para cada parámetro a modificar
-            for param, value in param_value_dict.items():
-                # Asegurarse de que el parámetro está presente
-                if param in node.get("inputs", {}):
-                    print(f"Modificando nodo {node_id} ({class_type} -> {param} = {value})")
-                    node["inputs"][param] = value
-                else:
-                    print(f"Nodo {node_id} ({class_type} no tiene el parámetro '{param}'")
-
-    if not found:
+    node_ids = pipeline.ids_by_class(class_type)
+    # Iterar sobre los nodos objetivo
+    for node_id in node_ids:
+        # Iterar para cada parámetro a modificar
+        for param, value in param_value_dict.items():
+            # Asegurarse de que el parámetro está presente
+            if param in pipeline.get(node_id).get("inputs", {}):
+                print(f"Modificando nodo {node_id} ({class_type} -> {param} = {value})")
+                pipeline.set_input(node_id, param, value)
+            else:
+                print(f"Nodo {node_id} ({class_type} no tiene el parámetro '{param}'")
+
+    if not node_ids:
         print(f"No se encontró ningún nodo con class_type '{class_type}'")
 
     return pipeline
 
+
+def get_output_folder(test_type, node_name, data):
+    '''
+    Devuelve la carpeta de salida de una prueba.
+
+    :param test_type: tipo de prueba ("parameters" o "bypass")
+    :param node_name: nombre del nodo de la prueba
+    :param data: parámetros a modificar (parameters) o función de modificación (bypass)
+    :return: ruta de la carpeta de salida
+    '''
+    # Comprobar el tipo de test
+    if test_type == "parameters":
+        # Establecer la ruta de la carpeta de salida
+        if len(data) == 1:
+            key = list(data.keys())[0]
+            value = safe_value_name(data[key])
+
+            # Reemplazar ":" solo en los nombres de carpetas
+            if key == "aspect_ratio":
+                value = value.replace(":", "x")
+
+            return Path(OUTPUT_IMAGES_FOLDER) / "parameters" / node_name / key / value
+
+        parts = [f"{k}={safe_value_name(v)}" for k, v in data.items()]
+
+        # Reemplazar ":" solo en los nombres de carpetas
+        parts = [p.replace(":", "x") if "aspect_ratio" in p else p for p in parts]
+
+        test_name = "combination_" + "__".join(parts)
+        return Path(OUTPUT_IMAGES_FOLDER) / "parameters" / node_name / test_name
+
+    elif test_type == "bypass":
+        # Establecer la ruta de la carpeta de salida
+        return Path(OUTPUT_IMAGES_FOLDER) / "bypass" / node_name
+
+    elif test_type == "sweep":
+        # Barridos multiparamétricos: node_name es el nombre del barrido y data {nodo: {parámetro: valor}}
+        parts = [f"{node}.{k}={safe_value_name(v)}" for node, params in data.items() for k, v in params.items()]
+        parts = [p.replace(":", "x") for p in parts]
+        return Path(OUTPUT_IMAGES_FOLDER) / "sweep" / node_name / ("combination_" + "__".join(parts))
+
+    raise ValueError(f"No se encontró el tipo de prueba {test_type}")
+
+
+def build_pipeline(base_pipeline, test, image_name, load_image_node_id, save_image_node_id, inputs=None):
+    '''
+    Construye el pipeline de una prueba para una imagen de entrada.
+
+    :param base_pipeline: Pipeline base
+    :param test: tupla (tipo, nodo, datos) de ABLATION_TESTS
+    :param image_name: nombre de la imagen de entrada
+    :param load_image_node_id: id del nodo LoadImage
+    :param save_image_node_id: id del nodo SaveImage
+    :param inputs: registro de imágenes subidas a los servidores (None para usar la ruta local)
+    :return: diccionario "prompt" listo para enviar a /prompt
+    '''
+    test_type, node_name, data = test
+
+    # Obtener ruta de la imagen (o su nombre en los servidores) y crear una variante del pipeline (solo copia
+    # los nodos modificados)
+    image_path = os.path.abspath(os.path.join(INPUT_IMAGES_FOLDER, image_name))
+    if inputs is not None:
+        image_path = inputs.register(image_path)
+    pipeline = base_pipeline.variant()
+
+    # Obtener nombre base (sin extensión)
+    base_image_name = Path(image_name).stem
+
+    # Establecer imagen de entrada en LoadImage
+    pipeline.set_input(load_image_node_id, "image", image_path)
+
+    # Establecer el prefijo de salida en SaveImage
+    pipeline.set_input(save_image_node_id, "filename_prefix", base_image_name)
+
+    # Aplicar modificación
+    if test_type == "parameters":
+        pipeline = set_multiple_params_by_class(pipeline, node_name, data)
+    elif test_type == "bypass":
+        pipeline = data(pipeline)
+        # Eliminar los nodos que ya no contribuyen a SaveImage (ablación estructural real, sin cómputo muerto)
+        removed = pipeline.prune([save_image_node_id])
+        if removed:
+            print(f" Nodos eliminados tras el bypass de {node_name}: {', '.join(pipeline.base.nodes[node_id]['class_type'] for node_id in removed)}")
+    elif test_type == "sweep":
+        for node_class, params in data.items():
+            pipeline = set_multiple_params_by_class(pipeline, node_class, params)
+    else:
+        raise ValueError(f"Tipo de test no encontrado {test_type}")
+
+    return pipeline.to_prompt()
+
+
+def baseline_test_keys(base_pipeline, tests):
+    '''
+    Devuelve las pruebas paramétricas que no modifican el pipeline (fijan cada parámetro a su valor original),
+    cuyas imágenes son las del pipeline original.
+
+    :param base_pipeline: Pipeline base
+    :param tests: lista de pruebas con el formato de ABLATION_TESTS
+    :return: lista de tuplas (Type, Node, Parameter, Value) con el formato de los resultados de face_comparison.py
+    '''
+    from face_comparison import parse_test_path
+
+    keys = []
+    for test in tests:
+        test_type, node_name, data = test
+        node_ids = base_pipeline.ids_by_class(node_name)
+        if test_type != "parameters" or not node_ids:
+            continue
+        if all(canonical_value(base_pipeline.nodes[node_id]["inputs"].get(param)) == canonical_value(value) for node_id in node_ids for param, value in data.items()):
+            keys.append(parse_test_path(os.path.normpath(str(get_output_folder(*test)))))
+    return keys
+
+
+def generate_jobs(tests, input_images):
+    '''
+    Genera de forma perezosa los trabajos (prueba, imagen) en el orden del estudio.
+
+    :param tests: lista de pruebas con el formato de ABLATION_TESTS
+    :param input_images: nombres de las imágenes de entrada
+    :return: generador de diccionarios {"test", "image_name", "output_folder"}
+    '''
+    for test in tests:
+        output_folder = get_output_folder(*test)
+        # Crear carpeta de salida
+        output_folder.mkdir(parents=True, exist_ok=True)
+        for image_name in input_images:
+            yield {"test": test, "image_name": image_name, "output_folder": output_folder}
+
+
+def prepare_jobs(jobs, build, manifest, cache=None, followers=None, on_done=None):
+    '''
+    Construye el pipeline de cada trabajo y descarta los trabajos que no necesitan ejecutarse: los que el
+    registro ya da por terminados, los que tienen su resultado en la caché de generación (se enlaza desde
+    ella) y los que repiten un pipeline que ya está en cola (esperan al primero en followers).
+
+    :param jobs: iterable de trabajos
+    :param build: función que construye el pipeline de un trabajo
+    :param manifest: registro de la ejecución
+    :param cache: caché de generación (None para desactivarla)
+    :param followers: diccionario {cache_key: trabajos duplicados} de los pipelines en cola
+    :param on_done: función (trabajo, rutas de salida) llamada para los trabajos que no necesitan ejecutarse
+    :return: generador de trabajos pendientes con "pipeline", "cache_key" y "key"
+    '''
+    for job in jobs:
+        # El pipeline puede venir ya construido (p. ej. al reordenar los trabajos con job_order)
+        if "pipeline" not in job:
+            job["pipeline"] = build(job)
+        job["cache_key"] = pipeline_hash(job["pipeline"])
+        job["key"] = job_key(job["cache_key"], job["output_folder"])
+        if manifest.is_done(job["key"]):
+            print(f"Trabajo ya completado, se omite: {job['output_folder']} / {job['image_name']}")
+            if on_done is not None:
+                on_done(job, manifest.jobs[job["key"]].get("outputs", []))
+            continue
+
+        if cache is not None:
+            outputs = cache.materialize(job["cache_key"], job["output_folder"])
+            if outputs is not None:
+                manifest.record(job["key"], "done", image=job["image_name"], output_folder=str(job["output_folder"]), outputs=[str(path) for path in outputs], cached=True)
+                if on_done is not None:
+                    on_done(job, outputs)
+                continue
+            if job["cache_key"] in followers:
+                # El mismo pipeline ya está en cola: reutilizar su resultado al terminar
+                followers[job["cache_key"]].append(job)
+                continue
+            followers[job["cache_key"]] = []
+
+        yield job
+
+
+def route_output(job, save_image_node_id, output_root=None):
+    '''
+    Dirige el nodo SaveImage de un trabajo a la carpeta de su prueba mediante una subcarpeta en filename_prefix.
+    Si la carpeta de la prueba está dentro de la carpeta de salida de ComfyUI, la imagen se guarda directamente
+    en ella; si no, se guarda en output_root con la misma ruta relativa (p. ej. output/outputs_refacer/...), por
+    lo que cada prueba tiene su propia subcarpeta en el servidor. Se aplica después de calcular el hash del
+    pipeline, para que la caché de generación y el registro no dependan de la carpeta de destino.
+
+    :param job: trabajo con su pipeline en "pipeline"
+    :param save_image_node_id: id del nodo SaveImage
+    :param output_root: carpeta de salida del servidor local (None si el servidor es remoto)
+    :return: el propio trabajo
+    '''
+    folder = Path(job["output_folder"])
+    if output_root is not None:
+        root = Path(os.path.abspath(output_root))
+        if Path(os.path.commonpath([root, os.path.abspath(folder)])) == root:
+            folder = Path(os.path.abspath(folder)).relative_to(root)
+
+    # El pipeline comparte los nodos sin cambios con el pipeline base: se sustituye el nodo en lugar de editarlo
+    node = job["pipeline"][save_image_node_id]
+    prefix = (folder / node["inputs"]["filename_prefix"]).as_posix()
+    job["pipeline"][save_image_node_id] = dict(node, inputs=dict(node["inputs"], filename_prefix=prefix))
+    return job
+
+
+def collect_outputs(client, job, entry, save_image_node_id):
+    '''
+    Lleva las imágenes generadas por un prompt a la carpeta de su prueba (ya están en ella si SaveImage las
+    guardó allí; si no, se renombran desde la carpeta de salida del servidor local o se descargan del servidor
+    que lo ejecutó).
+
+    :param client: cliente o conjunto de servidores de ComfyUI
+    :param job: trabajo al que pertenece el prompt (con su "prompt_id")
+    :param entry: entrada del historial del prompt
+    :param save_image_node_id: id del nodo SaveImage (en un prompt agrupado, cada trabajo tiene el suyo)
+    :return: lista de rutas de destino
+    '''
+    destinations = []
+    # Iterar sobre las imágenes generadas por el nodo SaveImage
+    for image in history_images(entry, job.get("save_image_node_id", save_image_node_id)):
+        generated_file = image["filename"]
+
+        # Obtener ruta de destino
+        destination = job["output_folder"] / generated_file
+
+        # Renombrar o descargar la imagen (si SaveImage ya la guardó en su destino no se hace nada)
+        client.fetch_output(job["prompt_id"], image, destination)
+        print(f"Imagen guardada: {generated_file} -> {destination}")
+        destinations.append(destination)
+    return destinations
+
+
+def run_jobs(client, jobs, on_submitted, on_finished, queue_depth, timeout=MAX_WAIT_TIM_SEC, poll_interval=CHECK_INTERVAL, should_cancel=None, on_cancelled=None):
+    '''
+    Ejecuta los trabajos manteniendo siempre queue_depth prompts en la cola del servidor, sin barreras entre
+    pruebas. Cada prompt queda asociado a su trabajo y sus resultados se procesan en cuanto terminan.
+
+    :param client: cliente de ComfyUI
+    :param jobs: iterable de trabajos (con su pipeline en "pipeline")
+    :param on_submitted: función (trabajo, prompt_id) llamada al encolar cada prompt
+    :param on_finished: función (trabajo, entrada del historial) llamada al terminar cada prompt (entrada None si falla)
+    :param queue_depth: número de prompts que se mantienen en cola
+    :param timeout: segundos máximos sin que termine ningún prompt
+    :param poll_interval: segundos entre consultas a la cola
+    :param should_cancel: función opcional (trabajo) -> True si el trabajo ya no debe ejecutarse (parada temprana)
+    :param on_cancelled: función (trabajo) llamada al descartar o cancelar cada trabajo
+    '''
+    jobs = iter(jobs)
+    in_flight = {}
+    exhausted = False
+    last_progress = time.time()
+
+    while True:
+        # Rellenar la cola hasta la profundidad objetivo
+        submissions = []
+        while not exhausted and len(in_flight) + len(submissions) < queue_depth:
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                break
+            if should_cancel is not None and should_cancel(job):
+                on_cancelled(job)
+                continue
+            submissions.append((client.submit_prompt(job.pop("pipeline")), job))
+
+        for submission, job in submissions:
+            response = submission.result()
+            print(response)
+            job["prompt_id"] = response["prompt_id"]
+            # Con varios servidores, el que lo recibió (para recuperarlo al reanudar)
+            job["server"] = response.get("server")
+            in_flight[response["prompt_id"]] = job
+            on_submitted(job, response["prompt_id"])
+
+        # Cancelar en el servidor los prompts de las pruebas detenidas
+        if should_cancel is not None:
+            cancelled = [prompt_id for prompt_id, job in in_flight.items() if should_cancel(job)]
+            if cancelled:
+                client.cancel_prompts(cancelled)
+                print(f"Cancelados {len(cancelled)} prompts de pruebas detenidas")
+                for prompt_id in cancelled:
+                    on_cancelled(in_flight.pop(prompt_id))
+
+        if not in_flight:
+            if exhausted:
+                break
+            # Todos los prompts en cola se han cancelado: volver a llenar la cola
+            continue
+
+        # Procesar los prompts terminados
+        finished = client.poll_finished(in_flight)
+        for prompt_id, entry in finished:
+            job = in_flight.pop(prompt_id)
+            if not history_succeeded(entry):
+                print(f"[WARN] Error en el prompt {prompt_id} ({job['image_name']}): {entry.get('status')}")
+                on_finished(job, None)
+                continue
+            on_finished(job, entry)
+
+        if finished:
+            last_progress = time.time()
+        elif time.time() - last_progress > timeout:
+            print("Tiempo máximo de espera alcanzado")
+            # Cancelar en el servidor los prompts pendientes para que no sigan ocupando la GPU
+            try:
+                client.cancel_prompts(list(in_flight))
+            except (OSError, http.client.HTTPException, ComfyUIError) as e:
+                print(f"[WARN] No se pudieron cancelar los prompts pendientes: {e}")
+            for prompt_id, job in in_flight.items():
+                print(f"[WARN] No terminó el prompt {prompt_id} ({job['image_name']})")
+                on_finished(job, None)
+            in_flight.clear()
+            last_progress = time.time()
+        else:
+            time.sleep(poll_interval)
+
+
+def recover_prompts(client, manifest, timeout=MAX_WAIT_TIM_SEC, poll_interval=CHECK_INTERVAL):
+    '''
+    Consulta en el servidor los prompts que el registro de una ejecución interrumpida daba por enviados sin
+    terminar: espera a los que siguen en la cola y devuelve los que terminaron correctamente, para recoger sus
+    imágenes en lugar de volver a generarlas. Los que el servidor no conoce (o que fallaron) se vuelven a encolar.
+
+    :param client: cliente o conjunto de servidores de ComfyUI
+    :param manifest: registro de la ejecución
+    :param timeout: segundos máximos sin que termine ningún prompt en cola (después se cancelan)
+    :param poll_interval: segundos entre consultas a la cola
+    :return: diccionario {prompt_id: entrada del historial} de los prompts recuperados
+    '''
+    prompts = {}
+    for key in manifest.in_flight():
+        event = manifest.jobs[key]
+        if event.get("prompt_id"):
+            prompts.setdefault(event["prompt_id"], event.get("server"))
+
+    finished = {}
+    queued = set()
+    for prompt_id, server in prompts.items():
+        try:
+            state, entry = client.find_prompt(prompt_id, server)
+        except (OSError, http.client.HTTPException, ComfyUIError) as e:
+            print(f"[WARN] No se pudo consultar el prompt {prompt_id}: {e}")
+            continue
+        if state == "finished":
+            finished[prompt_id] = entry
+        elif state == "queued":
+            queued.add(prompt_id)
+
+    # Esperar a los prompts en cola antes de enviar otros nuevos (como mucho queue_depth)
+    if queued:
+        print(f"Esperando a {len(queued)} prompts de la ejecución anterior que siguen en cola")
+    last_progress = time.time()
+    while queued:
+        done = client.poll_finished(queued)
+        for prompt_id, entry in done:
+            queued.discard(prompt_id)
+            finished[prompt_id] = entry
+        if done:
+            last_progress = time.time()
+        elif time.time() - last_progress > timeout:
+            print("Tiempo máximo de espera alcanzado")
+            try:
+                client.cancel_prompts(list(queued))
+            except (OSError, http.client.HTTPException, ComfyUIError) as e:
+                print(f"[WARN] No se pudieron cancelar los prompts pendientes: {e}")
+            break
+        else:
+            time.sleep(poll_interval)
+
+    recovered = {prompt_id: entry for prompt_id, entry in finished.items() if history_succeeded(entry)}
+    for prompt_id in finished.keys() - recovered.keys():
+        client.release(prompt_id)
+    print(f"Prompts de la ejecución anterior: {len(recovered)} recuperados, {len(prompts) - len(recovered)} se vuelven a encolar")
+    return recovered
+
+
+def execute_jobs(client, jobs, build, manifest, save_image_node_id, queue_depth, cache=None, on_done=None, should_cancel=None, batch_size=1, batch_classes=BATCH_CLASSES, poll_interval=CHECK_INTERVAL):
+    '''
+    Ejecuta un conjunto de trabajos: omite los terminados, reutiliza la caché de generación, mantiene la cola
+    del servidor llena, guarda las imágenes en su carpeta y actualiza el registro.
+
+    :param client: cliente de ComfyUI
+    :param jobs: iterable de trabajos (ver generate_jobs)
+    :param build: función que construye el pipeline de un trabajo
+    :param manifest: registro de la ejecución
+    :param save_image_node_id: id del nodo SaveImage
+    :param queue_depth: número de prompts que se mantienen en cola
+    :param cache: caché de generación (None para desactivarla)
+    :param on_done: función opcional (trabajo, rutas de salida) llamada al disponer de las imágenes de cada trabajo
+    :param should_cancel: función opcional (trabajo) -> True si el trabajo ya no debe ejecutarse (parada temprana)
+    :param batch_size: número máximo de trabajos compatibles de una imagen por prompt (ver prompt_batch)
+    :param batch_classes: clases de nodo que pueden variar dentro de un prompt agrupado
+    :param poll_interval: segundos entre consultas a la cola
+    '''
+    followers = {}
+
+    def finish(job, outputs, **fields):
+        manifest.record(job["key"], "done", image=job["image_name"], output_folder=str(job["output_folder"]), outputs=[str(path) for path in outputs], **fields)
+        if on_done is not None:
+            on_done(job, outputs)
+
+    def on_submitted(batch, prompt_id):
+        fields = {"server": batch["server"]} if batch.get("server") else {}
+        for job in batch_members(batch):
+            job["prompt_id"] = prompt_id
+            if "save_image_node_id" in job:
+                # Rama del trabajo en un prompt agrupado, para recoger sus imágenes al reanudar
+                fields["save_image_node_id"] = job["save_image_node_id"]
+            manifest.record(job["key"], "submitted", prompt_id=prompt_id, image=job["image_name"], output_folder=str(job["output_folder"]), **fields)
+
+    def collect(batch, entry):
+        for job in batch_members(batch):
+            duplicates = followers.pop(job.get("cache_key"), [])
+            outputs = None
+            if entry is not None:
+                try:
+                    outputs = collect_outputs(client, job, entry, save_image_node_id)
+                except ComfyUIError as e:
+                    print(f"[WARN] No se pudieron obtener las imágenes de {job['image_name']}: {e}")
+            if outputs is None:
+                for failed_job in [job] + duplicates:
+                    manifest.record(failed_job["key"], "failed", image=failed_job["image_name"], output_folder=str(failed_job["output_folder"]))
+                continue
+            finish(job, outputs)
+            if cache is not None:
+                cache.store(job["cache_key"], outputs)
+                for duplicate in duplicates:
+                    finish(duplicate, cache.materialize(duplicate["cache_key"], duplicate["output_folder"]) or [], cached=True)
+
+    def on_finished(batch, entry):
+        collect(batch, entry)
+        # Las imágenes de todos los trabajos del prompt ya están en su carpeta
+        client.release(batch["prompt_id"])
+
+    def on_cancelled(batch):
+        for job in batch_members(batch):
+            for cancelled_job in [job] + followers.pop(job.get("cache_key"), []):
+                manifest.record(cancelled_job["key"], "cancelled", image=cancelled_job["image_name"], output_folder=str(cancelled_job["output_folder"]))
+
+    def recover(jobs, recovered):
+        # Los trabajos cuyo prompt terminó en la ejecución anterior solo necesitan recoger sus imágenes
+        for job in jobs:
+            event = manifest.jobs.get(job["key"], {})
+            entry = recovered.get(event.get("prompt_id")) if event.get("state") == "submitted" else None
+            if entry is None:
+                yield job
+                continue
+            print(f"Trabajo recuperado de la ejecución anterior: {job['output_folder']} / {job['image_name']}")
+            job["prompt_id"] = event["prompt_id"]
+            if "save_image_node_id" in event:
+                job["save_image_node_id"] = event["save_image_node_id"]
+            # Los demás trabajos de un prompt agrupado llegan después: se libera al terminar la ejecución
+            collect(job, entry)
+
+    pending = prepare_jobs(jobs, build, manifest, cache=cache, followers=followers, on_done=on_done)
+    # Cada SaveImage escribe en la carpeta de su prueba (o en una subcarpeta propia en el servidor)
+    output_root = getattr(client, "output_dir", None)
+    pending = (route_output(job, save_image_node_id, output_root) for job in pending)
+    recovered = {}
+    if manifest.in_flight():
+        # Reanudación: solo se vuelven a encolar los prompts que el servidor no llegó a ejecutar
+        recovered = recover_prompts(client, manifest, poll_interval=poll_interval)
+        pending = recover(pending, recovered)
+    if batch_size > 1:
+        # Agrupar los trabajos que solo difieren en el sampler: un prompt con una rama por trabajo
+        pending = batch_jobs(pending, batch_size, save_image_node_id, batch_classes)
+    if should_cancel is not None:
+        # Un prompt agrupado solo se cancela si se han detenido las pruebas de todos sus trabajos
+        cancel_job = should_cancel
+        should_cancel = lambda batch: all(cancel_job(job) for job in batch_members(batch))
+    run_jobs(client, pending, on_submitted, on_finished, queue_depth=queue_depth, poll_interval=poll_interval, should_cancel=should_cancel, on_cancelled=on_cancelled)
+    for prompt_id in recovered:
+        client.release(prompt_id)
+
+
+def load_base_pipeline(path=WORKFLOW_PATH):
+    '''
+    Carga el pipeline base y localiza sus nodos de entrada y salida.
+
+    :param path: ruta del workflow en formato API
+    :return: tupla (Pipeline, id de LoadImage, id de SaveImage)
+    '''
+    # Cargar el pipeline base (indexado por id y class_type)
+    base_pipeline = Pipeline.from_file(path)
+
+    # Detectar el nodo LoadImage (Nodo de carga inicial e input del pipeline)
+    load_image_node_id = base_pipeline.first_id("LoadImage")
+
+    # Detectar el nodo SaveImage (Nodo de salida, output del pipeline)
+    save_image_node_id = base_pipeline.first_id("SaveImage")
+
+    # Comprobar que se ha encontrado el nodo LoadImage
+    if load_image_node_id is None:
+        raise ValueError("No se encontró el nodo LoadImage")
+
+    return base_pipeline, load_image_node_id, save_image_node_id
+
+
+def list_input_images(folder=INPUT_IMAGES_FOLDER):
+    '''
+    :param folder: carpeta de las imágenes de entrada
+    :return: lista de nombres de las imágenes de entrada
+    '''
+    input_images = []
+    for img in os.listdir(folder):
+        if img.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            input_images.append(img)
+    return input_images
+
+
 # Pruebas del estudio de ablación
 ABLATION_TESTS = [
     # Ablación estructural (bypass)
@@ -308,137 +843,87 @@ ABLATION_TESTS = [
 
 ''' ACCIONES '''
 def main():
+    args = parser.parse_args()
+
     # Crear carpeta de salida si no existe
     os.makedirs(OUTPUT_IMAGES_FOLDER, exist_ok=True)
 
     # Cargar el pipeline base
-    f = open(WORKFLOW_PATH, "r")
-    base_pipeline = json.load(f)
-
-    # Detectar el nodo LoadImage (Nodo de carga inicial e input del pipeline)
-    load_image_node_id = None
-    for node_id, node in base_pipeline.items():
-        if node["class_type"] == "LoadImage":
-            load_image_node_id = node_id
-            break   # Finalizar si se ha encontrado
-
-    # Detectar el nodo SaveImage (Nodo de salida, output del pipeline)
-    save_image_node_id = None
-    for node_id, node in base_pipeline.items():
-        if node["class_type"] == "SaveImage":
-            save_image_node_id = node_id
-            break  # Finalizar si se ha encontrado
-
-    # Comprobar que se ha encontrado el nodo LoadImage
-    if load_image_node_id is None:
-        raise ValueError("No se encontró el nodo LoadImage")
+    base_pipeline, load_image_node_id, save_image_node_id = load_base_pipeline(WORKFLOW_PATH)
 
     # Obtener la lista de imágenes de entrada
-    input_images = []
-    for img in os.listdir(INPUT_IMAGES_FOLDER):
-        if img.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
-            input_images.append(img)
-    expected_count = len(input_images)
-
-    # Iterar sobre todas las pruebas
-    for test_type, node_name, data in ABLATION_TESTS:
+    input_images = list_input_images(INPUT_IMAGES_FOLDER)
 
-        # Comprobar el tipo de test
-        if test_type == "parameters":
-            # Establecer la ruta de la carpeta de salida
-            if len(data) == 1:
-                key = list(data.keys())[0]
-                value = safe_value_name(data[key])
+    # Registro de la ejecución (permite reanudarla con --resume)
+    manifest = RunManifest(args.manifest, resume=args.resume)
+    if args.resume:
+        print(f"Trabajos en curso en la ejecución anterior: {len(manifest.in_flight())} (se recogen los que el servidor terminó o tiene en cola y se vuelven a encolar el resto)")
 
-                # Reemplazar ":" solo en los nombres de carpetas
-                if key == "aspect_ratio":
-                    value = value.replace(":", "x")
+    # Caché de generación: los pipelines idénticos solo se generan una vez
+    cache = GenerationCache(args.generation_cache) if args.generation_cache else None
 
-                output_folder = Path(OUTPUT_IMAGES_FOLDER) / "parameters" / node_name / key / value
-            else:
-               parts = [f"{k}={safe_value_name(v)}" for k, v in data.items()]
-
-               # Reemplazar ":" solo en los nombres de carpetas
-               parts = [p.replace(":", "x") if "aspect_ratio" in p else p for p in parts]
-
-               test_name = "combination_" + "__".join(parts)
-               output_folder = Path(OUTPUT_IMAGES_FOLDER) / "parameters" / node_name / test_name
-
-        elif test_type == "bypass":
-            # Establecer la ruta de la carpeta de salida
-            output_folder = Path(OUTPUT_IMAGES_FOLDER) / "bypass" / node_name
-        else:
-            raise ValueError(f"No se encontró el tipo de prueba {test_type}")
-
-        # Crear carpeta de salida
-        output_folder.mkdir(parents=True, exist_ok=True)
+    # Imágenes de entrada subidas a cada servidor la primera vez que se usan
+    inputs = InputRegistry() if args.upload_inputs else None
 
-        # Iterar para todas las imágenes
-        for image_name in input_images:
-
-            # Obtener ruta de la imagen y clonar el pipeline
-            image_path = os.path.abspath(os.path.join(INPUT_IMAGES_FOLDER, image_name))
-            pipeline = copy.deepcopy(base_pipeline)
-
-            # Obtener nombre base (sin extensión)
-            base_image_name = Path(image_name).stem
-
-            # Establecer imagen de entrada en LoadImage
-            pipeline[load_image_node_id]["inputs"]["image"] = image_path
-
-            # Establecer el prefijo de salida en SaveImage
-            pipeline[save_image_node_id]["inputs"]["filename_prefix"] = base_image_name
-
-            # Aplicar modificación
-            if test_type == "parameters":
-                pipeline = set_multiple_params_by_class(pipeline, node_name, data)
-            elif test_type == "bypass":
-                pipeline = data(pipeline)
-            else:
-                raise ValueError(f"Tipo de test no encontrado {test_type}")
-
-            # Enviar el workflow al servidor de ComfyUI
-            p = {"prompt": pipeline}
-            payload = json.dumps(p).encode('utf-8')
-            req = request.Request("http://IP/prompt", data=payload) # Quitado por privacidad
-            response = request.urlopen(req)
-            print(response.read().decode())
-
-        # Esperar hasta que se generen las imágenes
-        start_time = time.time()
-        print("Esperando a que se generen todas las imagenes...")
-
-        generated_files = set()
-        while True:
-            # Buscar nuevos archivos generados
-            for f in os.listdir(OUTPUT_DEFAULT_FOLDER):
-                if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
-                    generated_files.add(f)
-
-            if len(generated_files) >= expected_count:
-                print("Todas las imágenes generadas, moviendo archivos...")
-                break
-
-            elapsed_time = time.time() - start_time
-            if elapsed_time > MAX_WAIT_TIM_SEC:
-                print("Tiempo máximo de espera alcanzado")
-                break
-
-            time.sleep(CHECK_INTERVAL)
-
-        # Iterar sobre las imágenes generadas
-        for generated_file in os.listdir(OUTPUT_DEFAULT_FOLDER):
-            if not generated_file.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
-                continue # Ignorar archivos no válidos
-
-            # Obtener ruta de origen y destino
-            origin = os.path.join(OUTPUT_DEFAULT_FOLDER, generated_file)
-            destination = output_folder / generated_file
-
-            # Mover la imagen
-            shutil.move(origin, destination)
-            print(f"Imagen movida: {generated_file} -> {destination}")
+    # Cliente de ComfyUI con conexiones reutilizables y envíos concurrentes (o conjunto de servidores)
+    if len(args.server) == 1:
+        client = ComfyUIClient(args.server[0], max_in_flight=args.max_in_flight, retries=args.retries, output_dir=args.comfyui_output or None, inputs=inputs)
+    else:
+        client = ComfyUIPool(args.server, max_in_flight=args.max_in_flight, retries=args.retries, inputs=inputs)
+
+    # Puntuación en streaming: cada imagen se puntúa en CPU mientras la GPU sigue generando
+    scorer = None
+    monitor = None
+    if args.score:
+        from streaming_scorer import StreamingScorer
+        model_config = (args.face_detection_model, args.face_recognition_model, 0.9, 0.3, 5000, 512)
+        # Parada temprana de las pruebas degeneradas a partir de las puntuaciones en streaming
+        if args.early_stop:
+            baseline_detection_rate, baseline_cosine = args.baseline_detection_rate, args.baseline_cosine
+            if baseline_detection_rate is None or baseline_cosine is None:
+                # Referencia: imágenes del pipeline original en un estudio anterior
+                if not (os.path.exists(args.baseline_results) and os.path.exists(args.baseline_failed)):
+                    parser.error("--early_stop necesita --baseline_results y --baseline_failed, o --baseline_detection_rate y --baseline_cosine")
+                detection_rate, cosine = baseline_from_results(args.baseline_results, args.baseline_failed, baseline_test_keys(base_pipeline, ABLATION_TESTS))
+                baseline_detection_rate = detection_rate if baseline_detection_rate is None else baseline_detection_rate
+                baseline_cosine = cosine if baseline_cosine is None else baseline_cosine
+            print(f"Referencia de la parada temprana: detección {baseline_detection_rate:.3f}, similitud coseno media {baseline_cosine:.3f}")
+            monitor = EarlyStopping(baseline_detection_rate, baseline_cosine, args.early_stop_min_people, args.early_stop_confidence, max_people=len(input_images))
+        scorer = StreamingScorer(args.real_dir, model_config, args.score_workers, args.feature_cache, args.live_summary, monitor=monitor)
+    elif args.early_stop:
+        parser.error("--early_stop necesita --score")
+
+    # Trabajos (prueba, imagen), opcionalmente reordenados para reutilizar la caché de nodos de ComfyUI
+    build = lambda job: build_pipeline(base_pipeline, job["test"], job["image_name"], load_image_node_id, save_image_node_id, inputs)
+    jobs = generate_jobs(sweep_tests(args.sweep) if args.sweep else ABLATION_TESTS, input_images)
+    if args.order != "test":
+        jobs = list(jobs)
+        for job in jobs:
+            job["pipeline"] = build(job)
+        report_cache_hits(jobs, "test")
+        jobs = order_jobs(jobs, args.order)
+        report_cache_hits(jobs, args.order)
+
+    # Ejecutar todas las pruebas manteniendo la cola del servidor llena entre pruebas
+    execute_jobs(
+        client,
+        jobs,
+        build=build,
+        manifest=manifest,
+        save_image_node_id=save_image_node_id,
+        queue_depth=args.queue_depth,
+        cache=cache,
+        on_done=scorer.submit if scorer is not None else None,
+        should_cancel=(lambda job: monitor.is_stopped(os.path.normpath(str(job["output_folder"])))) if monitor is not None else None,
+        batch_size=args.batch_size,
+        batch_classes=args.batch_classes,
+    )
+
+    client.close()
+    manifest.close()
+    if scorer is not None:
+        failed_output = os.path.join(os.path.dirname(args.scores_output), "failed_images_streaming" + (".csv" if args.scores_output.lower().endswith(".csv") else ".parquet"))
+        scorer.close(args.scores_output, failed_output)
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
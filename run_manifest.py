@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import time
+
+''' DECLARACIONES'''
+def canonical_value(value):
+    '''
+    Normaliza un valor del pipeline para el hash: los float enteros se representan como int (4 y 4.0 son el
+    mismo valor para ComfyUI) y los diccionarios y listas se normalizan recursivamente. Los int se conservan
+    exactos: como float, los mayores de 2**53 (p. ej. semillas de un barrido) colisionarían.
+
+    :param value: valor a normalizar
+    :return: valor normalizado
+    '''
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, dict):
+        return {k: canonical_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        # Las conexiones [id, salida] se conservan tal cual
+        if len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int):
+            return value
+        return [canonical_value(v) for v in value]
+    return value
+
+
+def pipeline_hash(pipeline):
+    '''
+    Calcula el hash del pipeline canónico (claves ordenadas, sin espacios y con los números normalizados), de
+    forma que dos pipelines equivalentes producen el mismo hash.
+
+    :param pipeline: diccionario del pipeline en formato API
+    :return: string hexadecimal con el hash SHA-256
+    '''
+    canonical = json.dumps(canonical_value(pipeline), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def job_key(pipeline_digest, output_folder):
+    '''
+    Clave de un trabajo en el registro: hash del pipeline final y de su carpeta de destino (dos pruebas con el
+    mismo pipeline son trabajos distintos aunque compartan las imágenes generadas).
+
+    :param pipeline_digest: hash del pipeline canónico
+    :param output_folder: carpeta de salida del trabajo
+    :return: string hexadecimal con el hash SHA-256
+    '''
+    return hashlib.sha256(f"{pipeline_digest}|{output_folder}".encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    '''
+    Registro append-only (JSONL) del estado de cada trabajo (prueba, imagen) del estudio de ablación.
+    Cada línea es un evento {"key", "state", ...}; el estado de un trabajo es el de su último evento.
+    Estados: "submitted" (enviado, con prompt_id y el servidor que lo recibió), "done" (con las rutas de salida), "failed" y "cancelled"
+    (prueba detenida por la parada temprana; se vuelve a encolar al reanudar).
+    '''
+
+    def __init__(self, path, resume=False):
+        '''
+        :param path: ruta del archivo .jsonl
+        :param resume: si es True se cargan los eventos existentes; si no, se empieza un registro nuevo
+        '''
+        self.path = path
+        self.jobs = {}
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Última línea incompleta si el proceso se interrumpió al escribirla
+                        continue
+                    self.jobs[event["key"]] = event
+            print(f"Cargados {len(self.jobs)} trabajos del registro {path}.")
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        if resume and self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # Terminar la línea incompleta para que el siguiente evento no se pierda con ella
+                    self._file.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        '''
+        Cierra el archivo del registro.
+        '''
+        self._file.close()
+
+    def record(self, key, state, **fields):
+        '''
+        Añade un evento al registro y lo escribe inmediatamente en disco.
+
+        :param key: hash del pipeline del trabajo
+        :param state: nuevo estado del trabajo
+        :param fields: campos adicionales (prompt_id, outputs, output_folder, image...)
+        '''
+        event = dict(self.jobs.get(key, {}), **fields, key=key, state=state, time=time.time())
+        self.jobs[key] = event
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def is_done(self, key):
+        '''
+        Indica si un trabajo terminó y sus imágenes siguen en disco.
+
+        :param key: hash del pipeline del trabajo
+        :return: True si no hace falta volver a ejecutarlo
+        '''
+        event = self.jobs.get(key)
+        if event is None or event["state"] != "done":
+            return False
+        return all(os.path.exists(path) for path in event.get("outputs", []))
+
+    def in_flight(self):
+        '''
+        :return: claves de los trabajos que estaban enviados sin terminar
+        '''
+        return [key for key, event in self.jobs.items() if event["state"] == "submitted"]
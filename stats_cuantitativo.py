@@ -1,14 +1,17 @@
-import pandas as pd
+from results_store import read_results
 
 ''' DECLARACIONES'''
-# Rutas a los archivos CSV
+# Rutas a los resultados (carpetas Parquet o archivos CSV)
 detected_faces_path = "" # Quitado por privacidad
 non_detected_faces_path = "" # Quitado por privacidad
 
+# Tipos de prueba del estudio de ablación: solo se leen sus particiones Type=... (los barridos quedan fuera)
+STUDY_FILTERS = [("Type", "in", ["bypass", "parameters"])]
+
 ''' ACCIONES '''
-# Cargar CSV
-detected_faces_df = pd.read_csv(detected_faces_path, delimiter=";")
-non_detected_faces_df = pd.read_csv(non_detected_faces_path, delimiter=";")
+# Cargar resultados (solo las particiones del estudio y las columnas necesarias)
+detected_faces_df = read_results(detected_faces_path, filters=STUDY_FILTERS, columns=["Person", "Same_Identity"])
+non_detected_faces_df = read_results(non_detected_faces_path, filters=STUDY_FILTERS, columns=["Node", "Parameter", "Value"])
 
 # ****** DETECCIÓN ******
 # Obtener la longitud de ambos datsets y calcular el porcentaje de imágenes en las que se ha detectado una cara
@@ -38,7 +41,7 @@ print(f" Imágenes con rostro reconocido: {recognised_faces_length} --- Imágene
 # Top 5 más reconocidas
 top_recognised_people = (
     detected_faces_df[detected_faces_df["Same_Identity"]==True]
-    .groupby("Person").size()
+    .groupby("Person", observed=True).size()
     .sort_values(ascending=False)
     .head(5)
 )
@@ -47,7 +50,7 @@ print(f"TOP 5 personas más imágenes reconocidas (entre las detectadas): \n{top
 # Top 5 menos reconocidas
 top_non_recognised_people = (
     detected_faces_df[detected_faces_df["Same_Identity"]==True]
-    .groupby("Person").size()
+    .groupby("Person", observed=True).size()
     .sort_values(ascending=True)
     .head(5)
 )
@@ -57,7 +60,7 @@ print(f"TOP 5 personas con menos imágenes reconocidas (entre las detectadas): \
 # Top 10 configuraciones con más fallos en la detección
 top_non_detected_configs = (
     non_detected_faces_df
-    .groupby(["Node", "Parameter", "Value"])
+    .groupby(["Node", "Parameter", "Value"], observed=True)
     .size()
     .sort_values(ascending=False)
     .head(10)
@@ -0,0 +1,173 @@
+import csv
+import multiprocessing
+import os
+import re
+import threading
+import time
+import face_comparison as fc
+from results_store import FAILED_COLUMNS, RESULT_COLUMNS, write_results
+
+''' DECLARACIONES'''
+# Columnas del resumen en vivo (una fila por prueba)
+SUMMARY_COLUMNS = ["Type", "Node", "Parameter", "Value", "Images", "Faces_Detected", "Mean_Cosine_Similarity", "Recognition_Rate"]
+
+
+class StreamingScorer:
+    '''
+    Puntúa las imágenes a medida que el runner las genera: cada imagen se envía a un pool de procesos (CPU)
+    mientras la GPU sigue generando, y los agregados por prueba se actualizan en cuanto llega cada puntuación.
+    '''
+
+    def __init__(self, real_dir, model_config, workers=2, feature_cache_path="", summary_path="", summary_interval=5.0, monitor=None):
+        '''
+        :param real_dir: carpeta con las imágenes reales
+        :param model_config: tupla con los argumentos de face_comparison.create_models
+        :param workers: número de procesos de puntuación
+        :param feature_cache_path: almacén .npz de características ("" para desactivarlo)
+        :param summary_path: archivo .csv del resumen en vivo por prueba ("" para desactivarlo)
+        :param summary_interval: segundos mínimos entre escrituras del resumen en vivo
+        :param monitor: EarlyStopping opcional que recibe el resultado de cada imagen
+        '''
+        self.feature_cache_path = feature_cache_path
+        self.summary_path = summary_path
+        self.summary_interval = summary_interval
+        self.monitor = monitor
+        self.feature_cache = fc.load_feature_cache(feature_cache_path)
+        self.lock = threading.Lock()
+        self.rows = []
+        self.failed_rows = []
+        self.aggregates = {}            # {(Type, Node, Parameter, Value): [imágenes, rostros, suma coseno, reconocidas]}
+        self.pending = 0
+        self.last_summary = 0.0
+
+        # Vectores de las imágenes reales (se calculan una vez en el proceso principal)
+        detector, recognizer = fc.create_models(*model_config)
+        self.real_images = fc.load_real_images(real_dir)
+        self.real_features = {
+            person: fc.get_face_data(path, self.feature_cache, detector, recognizer, model_config[-1])[1]
+            for person, path in self.real_images.items()
+        }
+        print(f"Puntuación en streaming con {workers} procesos y {len(self.real_images)} imágenes reales.")
+
+        self.pool = multiprocessing.Pool(workers, initializer=fc.init_worker, initargs=(model_config,))
+
+    def submit(self, job, outputs):
+        '''
+        Encola la puntuación de las imágenes de un trabajo terminado (se usa como on_done de execute_jobs).
+
+        :param job: trabajo del runner (con "image_name" y "output_folder")
+        :param outputs: rutas de las imágenes generadas
+        '''
+        test_key = os.path.normpath(str(job["output_folder"]))
+        meta = list(fc.parse_test_path(test_key))
+        prefix_match = re.match(r"([a-zA-Z_]+)_retrato", job["image_name"])
+        person = prefix_match.group(1) if prefix_match else None
+        if person not in self.real_images:
+            print(f"[WARN] No se encontró la imagen real para {job['image_name']}")
+            return
+
+        real_path = self.real_images[person]
+        for output in outputs:
+            gen_path = os.path.normpath(str(output))
+            if self.real_features[person] is None:
+                self._record_failed(meta + [person, real_path, "real"])
+                continue
+            with self.lock:
+                cached = self.feature_cache.get(gen_path)
+                self.pending += 1
+            self.pool.apply_async(
+                fc.worker_face_data, ((gen_path, cached[0] if cached else None),),
+                callback=lambda result, meta=meta, person=person: self._scored(test_key, meta, person, result),
+                error_callback=lambda error, gen_path=gen_path: self._error(gen_path, error),
+            )
+
+    def _scored(self, test_key, meta, person, result):
+        '''
+        Incorpora la puntuación de una imagen (se ejecuta en el hilo de resultados del pool).
+
+        :param test_key: carpeta de salida de la prueba
+        :param meta: [Type, Node, Parameter, Value]
+        :param person: persona de la imagen
+        :param result: tupla (ruta, hash, resultado) de face_comparison.worker_face_data
+        '''
+        gen_path, digest, data = result
+        with self.lock:
+            self.pending -= 1
+            loaded, feature, _ = fc.merge_face_data(self.feature_cache, gen_path, digest, data)
+            aggregate = self.aggregates.setdefault(tuple(meta), [0, 0, 0.0, 0])
+            aggregate[0] += 1
+            if not loaded:
+                print(f"[WARN] No se pudo cargar {gen_path}")
+            elif feature is None:
+                self.failed_rows.append(meta + [person, gen_path, "generated"])
+                if self.monitor is not None:
+                    self.monitor.observe(test_key, False)
+            else:
+                cosine, l2 = fc.score_features(feature, self.real_features[person])
+                cosine, l2 = float(cosine[0, 0]), float(l2[0, 0])
+                same_identity = cosine >= fc.COSINE_SIMILARITY_THRESHOLD and l2 <= fc.L2_SIMILARITY_THRESHOLD
+                self.rows.append(meta + [person, gen_path, self.real_images[person], round(cosine, 4), round(l2, 4), same_identity])
+                aggregate[1] += 1
+                aggregate[2] += cosine
+                aggregate[3] += int(same_identity)
+                if self.monitor is not None:
+                    self.monitor.observe(test_key, True, cosine)
+        self._maybe_write_summary()
+
+    def _error(self, gen_path, error):
+        with self.lock:
+            self.pending -= 1
+        print(f"[WARN] Error al puntuar {gen_path}: {error}")
+
+    def _record_failed(self, row):
+        with self.lock:
+            self.failed_rows.append(row)
+            self.aggregates.setdefault(tuple(row[:4]), [0, 0, 0.0, 0])[0] += 1
+
+    def summary(self):
+        '''
+        :return: lista de filas con SUMMARY_COLUMNS (agregados parciales por prueba)
+        '''
+        with self.lock:
+            items = sorted(self.aggregates.items())
+        return [
+            list(key) + [images, faces, round(total / faces, 4) if faces else "", round(recognised / faces, 4) if faces else ""]
+            for key, (images, faces, total, recognised) in items
+        ]
+
+    def _maybe_write_summary(self, force=False):
+        '''
+        Escribe el resumen en vivo como mucho una vez cada summary_interval segundos.
+
+        :param force: escribirlo aunque no haya pasado el intervalo
+        '''
+        now = time.time()
+        if not self.summary_path or (not force and now - self.last_summary < self.summary_interval):
+            return
+        self.last_summary = now
+        rows = self.summary()
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, mode='w', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(SUMMARY_COLUMNS)
+            writer.writerows(rows)
+        os.replace(tmp_path, self.summary_path)
+        with self.lock:
+            scored, pending = len(self.rows), self.pending
+        print(f"Resumen en vivo actualizado: {len(rows)} pruebas, {scored} imágenes puntuadas, {pending} pendientes")
+
+    def close(self, output, failed_output):
+        '''
+        Espera a que terminen las puntuaciones pendientes y guarda los resultados con el formato de
+        face_comparison.py, el resumen final y el almacén de características.
+
+        :param output: resultados (carpeta Parquet o archivo .csv)
+        :param failed_output: errores de detección (carpeta Parquet o archivo .csv)
+        '''
+        self.pool.close()
+        self.pool.join()
+        # Orden determinista, independiente del orden de llegada de las puntuaciones
+        write_results(output, RESULT_COLUMNS, sorted(self.rows, key=lambda row: row[:6]))
+        write_results(failed_output, FAILED_COLUMNS, sorted(self.failed_rows, key=lambda row: row[:6]))
+        self._maybe_write_summary(force=True)
+        fc.save_feature_cache(self.feature_cache_path, self.feature_cache)
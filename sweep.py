@@ -0,0 +1,253 @@
+import itertools
+import json
+import math
+import random
+
+''' DECLARACIONES'''
+# Formato del archivo de barrido (JSON):
+# {
+#     "name": "cfg_weight",                 # nombre del barrido (carpeta outputs_refacer/sweep/<name>)
+#     "design": "lhs",                      # grid, random, lhs o sobol
+#     "budget": 200,                        # número máximo de configuraciones distintas
+#     "seed": 42,
+#     "parameters": {
+#         "KSamplerAdvanced.cfg": {"min": 1, "max": 15, "type": "float", "num": 15},
+#         "KSamplerAdvanced.steps": {"min": 4, "max": 40, "type": "int"},
+#         "IPAdapterAdvanced.weight": {"min": 0.1, "max": 2.0, "round": 2},
+#         "IPAdapterAdvanced.embeds_scaling": {"values": ["V only", "K+V", "K+V w/ C penalty"]}
+#     }
+# }
+# Los rangos continuos necesitan "num" o "step" en los diseños grid.
+
+# Número máximo de intentos por configuración al descartar duplicados
+MAX_DRAWS_PER_CONFIG = 100
+
+
+class ParameterSpace:
+    '''
+    Espacio de valores de un parámetro de un nodo ("Nodo.parámetro"): lista de valores discretos o rango
+    numérico (opcionalmente logarítmico) de tipo int o float.
+    '''
+
+    def __init__(self, name, spec):
+        '''
+        :param name: nombre "Nodo.parámetro"
+        :param spec: lista de valores, o diccionario con "values" o con "min", "max" y opcionalmente "type",
+                     "num", "step", "log" y "round"
+        '''
+        if "." not in name:
+            raise ValueError(f"El parámetro {name} debe tener el formato Nodo.parámetro")
+        self.node, self.parameter = name.split(".", 1)
+        if isinstance(spec, list):
+            spec = {"values": spec}
+        self.values = spec.get("values")
+        self.low = spec.get("min")
+        self.high = spec.get("max")
+        self.type = spec.get("type", "float")
+        self.num = spec.get("num")
+        self.step = spec.get("step")
+        self.log = spec.get("log", False)
+        self.round = spec.get("round", 4)
+        self._grid = None
+        if self.values is None and (self.low is None or self.high is None):
+            raise ValueError(f"El parámetro {name} necesita 'values' o 'min' y 'max'")
+        if self.log and (self.low <= 0 or self.high <= 0):
+            raise ValueError(f"El parámetro {name} no puede ser logarítmico con valores no positivos")
+
+    def _cast(self, value):
+        if self.type == "int":
+            return int(round(value))
+        return round(float(value), self.round)
+
+    def from_unit(self, u):
+        '''
+        Convierte un valor del intervalo [0, 1) en un valor del parámetro.
+
+        :param u: valor en [0, 1)
+        :return: valor del parámetro
+        '''
+        if self.values is not None:
+            return self.values[min(int(u * len(self.values)), len(self.values) - 1)]
+        if self.step is not None or (self.num is not None and self.type != "int"):
+            if self._grid is None:
+                self._grid = self.grid_values()
+            return self._grid[min(int(u * len(self._grid)), len(self._grid) - 1)]
+        if self.type == "int":
+            # Cada entero del rango recibe la misma probabilidad
+            return min(int(self.low + u * (self.high - self.low + 1)), int(self.high))
+        if self.log:
+            return self._cast(math.exp(math.log(self.low) + u * (math.log(self.high) - math.log(self.low))))
+        return self._cast(self.low + u * (self.high - self.low))
+
+    def grid_values(self):
+        '''
+        :return: lista de los valores del parámetro en un diseño grid
+        '''
+        if self.values is not None:
+            return list(self.values)
+        if self.step is not None:
+            count = int(math.floor((self.high - self.low) / self.step + 1e-9)) + 1
+            return list(dict.fromkeys(self._cast(self.low + i * self.step) for i in range(count)))
+        if self.num is not None:
+            if self.num == 1:
+                return [self._cast(self.low)]
+            if self.log:
+                points = [math.exp(math.log(self.low) + i * (math.log(self.high) - math.log(self.low)) / (self.num - 1)) for i in range(self.num)]
+            else:
+                points = [self.low + i * (self.high - self.low) / (self.num - 1) for i in range(self.num)]
+            return list(dict.fromkeys(self._cast(p) for p in points))
+        if self.type == "int":
+            return list(range(int(self.low), int(self.high) + 1))
+        raise ValueError(f"El parámetro {self.node}.{self.parameter} necesita 'num' o 'step' en un diseño grid")
+
+
+def grid_design(spaces, budget, rng):
+    '''
+    Diseño factorial completo. Si el número de combinaciones supera el presupuesto se elige una muestra
+    aleatoria sin reemplazo de índices de la rejilla, sin construirla en memoria.
+
+    :param spaces: lista de ParameterSpace
+    :param budget: número máximo de configuraciones (None para todas)
+    :param rng: generador aleatorio
+    :return: generador de tuplas de valores
+    '''
+    axes = [space.grid_values() for space in spaces]
+    size = math.prod(len(axis) for axis in axes)
+    if budget is None or budget >= size:
+        yield from itertools.product(*axes)
+        return
+
+    for index in rng.sample(range(size), budget):
+        # Decodificar el índice en base mixta (un dígito por eje)
+        values = []
+        for axis in reversed(axes):
+            index, digit = divmod(index, len(axis))
+            values.append(axis[digit])
+        yield tuple(reversed(values))
+
+
+def random_design(spaces, budget, rng):
+    '''
+    Muestreo aleatorio uniforme e independiente de cada parámetro.
+
+    :param spaces: lista de ParameterSpace
+    :param budget: número de configuraciones
+    :param rng: generador aleatorio
+    :return: generador de tuplas de valores
+    '''
+    while True:
+        yield tuple(space.from_unit(rng.random()) for space in spaces)
+
+
+def lhs_design(spaces, budget, rng):
+    '''
+    Muestreo por hipercubo latino: cada parámetro se divide en budget estratos y cada estrato se usa una vez.
+    Si hay duplicados (valores discretos), se continúa con nuevos hipercubos.
+
+    :param spaces: lista de ParameterSpace
+    :param budget: número de configuraciones
+    :param rng: generador aleatorio
+    :return: generador de tuplas de valores
+    '''
+    while True:
+        permutations = [rng.sample(range(budget), budget) for _ in spaces]
+        for i in range(budget):
+            yield tuple(space.from_unit((perm[i] + rng.random()) / budget) for space, perm in zip(spaces, permutations))
+
+
+def sobol_design(spaces, budget, rng):
+    '''
+    Secuencia de Sobol (scipy.stats.qmc, dependencia de scikit-learn) con aleatorización, en bloques de
+    potencias de 2.
+
+    :param spaces: lista de ParameterSpace
+    :param budget: número de configuraciones
+    :param rng: generador aleatorio
+    :return: generador de tuplas de valores
+    '''
+    from scipy.stats import qmc
+
+    sampler = qmc.Sobol(d=len(spaces), scramble=True, seed=rng.randrange(2 ** 32))
+    while True:
+        for point in sampler.random(64):
+            yield tuple(space.from_unit(float(u)) for space, u in zip(spaces, point))
+
+
+DESIGNS = {
+    "grid": grid_design,
+    "random": random_design,
+    "lhs": lhs_design,
+    "sobol": sobol_design,
+}
+
+
+def generate_configs(spaces, design="grid", budget=None, seed=42):
+    '''
+    Genera de forma perezosa configuraciones distintas del espacio de parámetros.
+
+    :param spaces: lista de ParameterSpace
+    :param design: nombre del diseño (grid, random, lhs o sobol)
+    :param budget: número máximo de configuraciones distintas (obligatorio salvo en grid)
+    :param seed: semilla del generador aleatorio
+    :return: generador de diccionarios {nodo: {parámetro: valor}}
+    '''
+    if design not in DESIGNS:
+        raise ValueError(f"Diseño de barrido desconocido: {design}")
+    if budget is None and design != "grid":
+        raise ValueError(f"El diseño {design} necesita un presupuesto (budget)")
+
+    rng = random.Random(seed)
+    # Las combinaciones de la rejilla ya son distintas; el resto de diseños pueden repetir valores discretos
+    seen = set()
+    count = 0
+    draws = 0
+    for values in DESIGNS[design](spaces, budget, rng):
+        if budget is not None and count >= budget:
+            break
+        draws += 1
+        if budget is not None and draws > budget * MAX_DRAWS_PER_CONFIG:
+            print(f"[WARN] Solo se encontraron {count} configuraciones distintas de {budget}")
+            break
+
+        # Descartar configuraciones repetidas
+        if design != "grid":
+            key = json.dumps(values, sort_keys=True)
+            if key in seen:
+                continue
+            seen.add(key)
+        count += 1
+
+        config = {}
+        for space, value in zip(spaces, values):
+            config.setdefault(space.node, {})[space.parameter] = value
+        yield config
+
+
+def load_sweep(path):
+    '''
+    Carga la definición de un barrido.
+
+    :param path: ruta del archivo JSON
+    :return: diccionario con "name", "design", "budget", "seed" y "spaces"
+    '''
+    with open(path, "r") as f:
+        spec = json.load(f)
+    return {
+        "name": spec.get("name", "sweep"),
+        "design": spec.get("design", "grid"),
+        "budget": spec.get("budget"),
+        "seed": spec.get("seed", 42),
+        "spaces": [ParameterSpace(name, space) for name, space in spec["parameters"].items()],
+    }
+
+
+def sweep_tests(path):
+    '''
+    Genera de forma perezosa las pruebas de un barrido con el formato de ABLATION_TESTS.
+
+    :param path: ruta del archivo JSON del barrido
+    :return: generador de tuplas ("sweep", nombre del barrido, {nodo: {parámetro: valor}})
+    '''
+    sweep = load_sweep(path)
+    for config in generate_configs(sweep["spaces"], sweep["design"], sweep["budget"], sweep["seed"]):
+        yield "sweep", sweep["name"], config
@@ -0,0 +1,92 @@
+import pytest
+
+import fake_comfyui_server
+from comfyui_client import ComfyUIClient, ComfyUIError
+
+''' DECLARACIONES'''
+PROMPT = {
+    "1": {"class_type": "LoadImage", "inputs": {"image": "/inputs/persona.png"}},
+    "2": {"class_type": "SaveImage", "inputs": {"images": ["1", 0], "filename_prefix": "ComfyUI"}},
+}
+
+
+def drop_response(fake, queue_first):
+    '''
+    Hace que el primer /prompt del servidor simulado corte la conexión sin responder, después de encolar el
+    prompt (queue_first) o antes de hacerlo.
+
+    :return: lista de los prompt_id que llegan al servidor
+    '''
+    received = []
+    queue_prompt = fake.queue_prompt
+
+    def flaky_queue_prompt(prompt, prompt_id=None):
+        received.append(prompt_id)
+        if len(received) == 1:
+            if queue_first:
+                queue_prompt(prompt, prompt_id)
+            raise ConnectionResetError("respuesta perdida")
+        return queue_prompt(prompt, prompt_id)
+
+    fake.queue_prompt = flaky_queue_prompt
+    return received
+
+
+def prompts_on_server(fake):
+    status = fake.queue_status()
+    return [item[1] for item in status["queue_running"] + status["queue_pending"]] + list(fake.history)
+
+
+@pytest.fixture
+def server(tmp_path):
+    httpd, fake = fake_comfyui_server.serve(str(tmp_path / "output"), port=0, delay=0.01)
+    yield httpd, fake
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server):
+    httpd, _ = server
+    with ComfyUIClient(f"127.0.0.1:{httpd.server_port}", retries=2, backoff=0.01, timeout=5) as client:
+        yield client
+
+
+''' ACCIONES '''
+def test_lost_response_after_queueing_is_not_resubmitted(server, client):
+    _, fake = server
+    received = drop_response(fake, queue_first=True)
+
+    response = client.queue_prompt(PROMPT)
+
+    # El servidor ya tenía el prompt: no se vuelve a enviar
+    assert received == [response["prompt_id"]]
+    assert prompts_on_server(fake) == [response["prompt_id"]]
+
+
+def test_failure_before_queueing_is_retried_once(server, client):
+    _, fake = server
+    received = drop_response(fake, queue_first=False)
+
+    response = client.queue_prompt(PROMPT)
+
+    # El reintento usa el mismo prompt_id y el trabajo queda encolado una sola vez
+    assert received == [response["prompt_id"]] * 2
+    assert prompts_on_server(fake) == [response["prompt_id"]]
+
+
+def test_invalid_prompt_is_not_retried(server, client):
+    _, fake = server
+    received = drop_response(fake, queue_first=False)
+    received.append(None)
+
+    with pytest.raises(ComfyUIError) as error:
+        client.queue_prompt({"1": PROMPT["1"]})
+    assert error.value.status == 400
+    assert len(received) == 2
+    assert prompts_on_server(fake) == []
+
+
+def test_client_prompt_ids_are_unique(server, client):
+    ids = {client.queue_prompt(PROMPT)["prompt_id"] for _ in range(3)}
+    assert len(ids) == 3
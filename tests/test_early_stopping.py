@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+import run_comfyui_ablation_study as runner
+from early_stopping import BASELINE_FAILED, BASELINE_RESULTS, EarlyStopping, baseline_from_results
+from pipeline_graph import Pipeline
+
+''' DECLARACIONES'''
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Valores originales de Refacer.json en los parámetros que estudia ABLATION_TESTS
+BASE_NODES = {
+    "48": {"class_type": "AutoCropFaces", "inputs": {"aspect_ratio": "1:1", "scale_factor": 2, "shift_factor": 0.5}},
+    "14": {"class_type": "IPAdapterAdvanced", "inputs": {"embeds_scaling": "K+V", "start_at": 0, "end_at": 1, "weight": 0.52}},
+    "38": {"class_type": "SDXLAspectRatioSelector", "inputs": {"aspect_ratio": "1:1"}},
+    "18": {"class_type": "TGateApplySimple", "inputs": {"start_at": 0.42}},
+    "7": {"class_type": "KSamplerAdvanced", "inputs": {"cfg": 4.5, "noise_seed": 11, "steps": 12}},
+    "43": {"class_type": "LoraLoaderModelOnly", "inputs": {"strength_model": 0.66}},
+    "1": {"class_type": "PhotoMakerEncode", "inputs": {"text": "A professional HDR photograph of photomaker person in full colour. cinematic film quality photorealism, clear photo, amazing textures, sharp focus, high-contrast, stunning professionalism,"}},
+}
+BASELINE_KEYS = [
+    ("parameters", "AutoCropFaces", "scale_factor", "2_0"),
+    ("parameters", "SDXLAspectRatioSelector", "aspect_ratio", "1x1"),
+    ("parameters", "KSamplerAdvanced", "noise_seed", "11"),
+    ("parameters", "KSamplerAdvanced", "steps", "12"),
+    ("parameters", "LoraLoaderModelOnly", "strength_model", "0_66"),
+]
+BASELINE_DETECTION_RATE = 0.979
+BASELINE_COSINE = 0.289
+
+
+def observe_all(monitor, key, observations):
+    '''
+    :param observations: lista de tuplas (detectado, coseno)
+    :return: número de imágenes observadas al detenerse la prueba, o None si no se detiene
+    '''
+    for index, (detected, cosine) in enumerate(observations, start=1):
+        if monitor.observe(key, detected, cosine) is not None:
+            return index
+    return None
+
+
+''' ACCIONES '''
+def test_baseline_test_keys_are_the_tests_that_keep_the_original_values():
+    keys = runner.baseline_test_keys(Pipeline(BASE_NODES), runner.ABLATION_TESTS)
+    assert keys == BASELINE_KEYS
+
+
+def test_baseline_from_committed_results():
+    detection_rate, cosine = baseline_from_results(os.path.join(ROOT, BASELINE_RESULTS), os.path.join(ROOT, BASELINE_FAILED), BASELINE_KEYS)
+    assert detection_rate == pytest.approx(BASELINE_DETECTION_RATE, abs=5e-4)
+    assert cosine == pytest.approx(BASELINE_COSINE, abs=5e-4)
+
+
+def test_alpha_is_split_over_every_look():
+    monitor = EarlyStopping(BASELINE_DETECTION_RATE, BASELINE_COSINE, min_people=5, confidence=0.95, max_people=29)
+    assert monitor.alpha == pytest.approx(0.05 / 25)
+
+
+def test_faceless_stream_stops_after_min_people():
+    monitor = EarlyStopping(BASELINE_DETECTION_RATE, BASELINE_COSINE, min_people=5, max_people=29)
+    assert observe_all(monitor, "sin_rostro", [(False, None)] * 29) == 5
+    assert monitor.is_stopped("sin_rostro")
+    assert "detección" in monitor.stopped["sin_rostro"]
+
+
+def test_low_similarity_stream_stops():
+    rng = np.random.default_rng(0)
+    monitor = EarlyStopping(BASELINE_DETECTION_RATE, BASELINE_COSINE, min_people=5, max_people=29)
+    stopped_at = observe_all(monitor, "baja", [(True, c) for c in rng.normal(0.05, 0.05, size=29)])
+    assert stopped_at is not None and stopped_at >= 5
+    assert "similitud" in monitor.stopped["baja"]
+
+
+def test_better_than_baseline_stream_never_stops():
+    rng = np.random.default_rng(1)
+    monitor = EarlyStopping(BASELINE_DETECTION_RATE, BASELINE_COSINE, min_people=5, max_people=29)
+    assert observe_all(monitor, "mejor", [(True, c) for c in rng.normal(0.6, 0.05, size=29)]) is None
+
+
+def test_baseline_like_streams_rarely_stop():
+    # Pruebas con el comportamiento del pipeline original: la tasa de paradas (falsos positivos) debe quedar
+    # por debajo de 1 - confidence con el reparto de Bonferroni entre las comprobaciones
+    rng = np.random.default_rng(2)
+    monitor = EarlyStopping(BASELINE_DETECTION_RATE, BASELINE_COSINE, min_people=5, confidence=0.95, max_people=29)
+    streams = 200
+    for stream in range(streams):
+        detected = rng.random(29) < BASELINE_DETECTION_RATE
+        cosines = rng.normal(BASELINE_COSINE, 0.1, size=29)
+        observe_all(monitor, stream, [(bool(d), float(c) if d else None) for d, c in zip(detected, cosines)])
+    assert len(monitor.stopped) / streams <= 0.05
@@ -0,0 +1,172 @@
+import os
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+import face_comparison
+
+''' DECLARACIONES'''
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+
+
+@pytest.fixture(scope="module")
+def recognizer():
+    '''
+    Reconocedor SFace de referencia para FaceRecognizerSF.match. match no usa la red, por lo que si el modelo
+    SFace no está descargado basta con cualquier modelo ONNX que OpenCV pueda cargar (el detector YuNet).
+    '''
+    for model in ("face_recognition_sface_2021dec.onnx", "face_detection_yunet_2023mar.onnx"):
+        path = os.path.join(MODELS_DIR, model)
+        if os.path.exists(path):
+            return cv.FaceRecognizerSF.create(path, "")
+    pytest.skip("No hay ningún modelo ONNX en models/")
+
+
+''' ACCIONES '''
+def test_score_features_matches_face_recognizer_sf(recognizer):
+    rng = np.random.default_rng(0)
+    gen = rng.normal(size=(6, 128)).astype(np.float32)
+    real = rng.normal(size=(4, 128)).astype(np.float32)
+    # Una pareja casi idéntica, cerca de los umbrales de decisión y de la distancia 0
+    gen[0] = real[2] + rng.normal(scale=1e-3, size=128).astype(np.float32)
+
+    cosine, l2 = face_comparison.score_features(gen, real)
+
+    assert cosine.shape == l2.shape == (6, 4)
+    for i in range(len(gen)):
+        for j in range(len(real)):
+            expected_cosine = recognizer.match(gen[i:i + 1], real[j:j + 1], cv.FaceRecognizerSF_FR_COSINE)
+            expected_l2 = recognizer.match(gen[i:i + 1], real[j:j + 1], cv.FaceRecognizerSF_FR_NORM_L2)
+            assert cosine[i, j] == pytest.approx(expected_cosine, abs=1e-5)
+            assert l2[i, j] == pytest.approx(expected_l2, abs=1e-4)
+
+
+def test_score_features_accepts_single_vectors(recognizer):
+    rng = np.random.default_rng(1)
+    gen, real = rng.normal(size=(1, 128)).astype(np.float32), rng.normal(size=(128,)).astype(np.float32)
+    cosine, l2 = face_comparison.score_features(gen.reshape(-1), real)
+    assert cosine.shape == (1, 1)
+    assert float(cosine[0, 0]) == pytest.approx(recognizer.match(gen, real.reshape(1, -1), cv.FaceRecognizerSF_FR_COSINE), abs=1e-5)
+
+
+def test_rank_identities_orders_by_descending_cosine(recognizer):
+    rng = np.random.default_rng(2)
+    real = rng.normal(size=(5, 128)).astype(np.float32)
+    # Cada imagen generada se parece a una identidad distinta (genuina = j)
+    genuine = [3, 0, 4]
+    gen = np.stack([real[j] + rng.normal(scale=0.3, size=128).astype(np.float32) for j in genuine])
+
+    cosine, _ = face_comparison.score_features(gen, real)
+    ranks = face_comparison.rank_identities(cosine)
+
+    for i, j in enumerate(genuine):
+        # Rank-1 en la identidad genuina y posiciones 1..P calculadas con FaceRecognizerSF.match
+        assert ranks[i, j] == 1
+        scores = [recognizer.match(gen[i:i + 1], real[k:k + 1], cv.FaceRecognizerSF_FR_COSINE) for k in range(len(real))]
+        assert list(ranks[i]) == [sorted(scores, reverse=True).index(score) + 1 for score in scores]
+
+
+class StubDetector:
+    '''
+    Detector simulado: un rostro que ocupa la imagen salvo en las imágenes casi negras (sin rostro).
+    '''
+
+    def __init__(self):
+        self.calls = 0
+
+    def setInputSize(self, size):
+        self.size = size
+
+    def detect(self, img):
+        self.calls += 1
+        if img.mean() < 10:
+            return 1, None
+        width, height = self.size
+        return 1, np.array([[0, 0, width, height] + [0] * 10 + [0.99]], dtype=np.float32)
+
+
+class StubRecognizer:
+    '''
+    Reconocedor simulado: el vector de características es una versión reducida de los píxeles del rostro.
+    '''
+
+    def alignCrop(self, img, face):
+        return cv.resize(img, (112, 112))
+
+    def feature(self, crop):
+        return cv.resize(crop, (8, 16)).astype(np.float32).reshape(1, -1)[:, :128]
+
+
+def stub_models(*model_config):
+    return StubDetector(), StubRecognizer()
+
+
+def write_images(folder, count):
+    '''
+    Escribe imágenes PNG de ruido con semilla fija; la tercera es negra (sin rostro).
+
+    :return: rutas de las imágenes
+    '''
+    rng = np.random.default_rng(3)
+    paths = []
+    for index in range(count):
+        img = rng.integers(0, 256, size=(96, 80, 3), dtype=np.uint8)
+        if index == 2:
+            img[:] = 0
+        path = os.path.join(str(folder), f"persona{index}_retrato_00001_.png")
+        cv.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def assert_same_face_data(first, second):
+    assert list(first) == list(second)
+    for (loaded, feature, face), (other_loaded, other_feature, other_face) in zip(first.values(), second.values()):
+        assert loaded == other_loaded
+        assert (feature is None) == (other_feature is None)
+        if feature is not None:
+            np.testing.assert_array_equal(feature, other_feature)
+            np.testing.assert_array_equal(face, other_face)
+
+
+@pytest.mark.skipif(face_comparison.multiprocessing.get_start_method() != "fork", reason="los modelos simulados solo llegan a los procesos del pool con fork")
+def test_embed_images_is_independent_of_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_comparison, "create_models", stub_models)
+    paths = write_images(tmp_path, 9)
+    model_config = ("", "", 0.9, 0.3, 5000, 64)
+
+    serial_cache, parallel_cache = {}, {}
+    serial = face_comparison.embed_images(paths, serial_cache, *stub_models(), 64, workers=1, model_config=model_config)
+    parallel = face_comparison.embed_images(paths, parallel_cache, *stub_models(), 64, workers=2, model_config=model_config)
+
+    # Mismo orden de filas y mismos resultados, incluida la imagen sin rostro
+    assert list(serial) == paths
+    assert serial[paths[2]] == (True, None, None)
+    assert_same_face_data(serial, parallel)
+    assert list(serial_cache) == list(parallel_cache)
+
+
+def test_feature_cache_is_reused_on_the_next_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_comparison, "create_models", stub_models)
+    paths = write_images(tmp_path, 5)
+    cache_path = str(tmp_path / "features.npz")
+
+    detector, recognizer = stub_models()
+    cache = face_comparison.load_feature_cache(cache_path)
+    first = face_comparison.embed_images(paths, cache, detector, recognizer, 64)
+    face_comparison.save_feature_cache(cache_path, cache)
+    assert detector.calls == len(paths)
+
+    # Segunda ejecución: todo sale del almacén, sin volver a detectar
+    detector, recognizer = stub_models()
+    cache = face_comparison.load_feature_cache(cache_path)
+    second = face_comparison.embed_images(paths, cache, detector, recognizer, 64)
+    assert detector.calls == 0
+    assert_same_face_data(first, second)
+
+    # Solo se recalcula la imagen cuyo contenido cambia
+    cv.imwrite(paths[0], np.full((96, 80, 3), 200, dtype=np.uint8))
+    third = face_comparison.embed_images(paths, cache, detector, recognizer, 64)
+    assert detector.calls == 1
+    assert not np.array_equal(third[paths[0]][1], first[paths[0]][1])
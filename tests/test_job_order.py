@@ -0,0 +1,94 @@
+import pytest
+
+from job_order import ORDERS, expected_cache_hits, node_signatures, order_jobs
+
+''' DECLARACIONES'''
+IMAGES = ["ada.png", "alan.png", "grace.png"]
+# Pruebas intercaladas: las de cfg comparten el recorte entre sí, las de scale_factor solo LoadImage
+TESTS = [{"cfg": 4}, {"scale_factor": 3}, {"cfg": 8}, {"scale_factor": 5}, {"cfg": 12}]
+
+
+def make_prompt(image, cfg=7, scale_factor=2, seed=11):
+    '''
+    :return: prompt LoadImage -> AutoCropFaces -> KSamplerAdvanced -> SaveImage
+    '''
+    return {
+        "1": {"class_type": "LoadImage", "inputs": {"image": image}},
+        "2": {"class_type": "AutoCropFaces", "inputs": {"image": ["1", 0], "scale_factor": scale_factor}},
+        "3": {"class_type": "KSamplerAdvanced", "inputs": {"latent_image": ["2", 0], "cfg": cfg, "noise_seed": seed}},
+        "4": {"class_type": "SaveImage", "inputs": {"images": ["3", 0], "filename_prefix": "ComfyUI"}},
+    }
+
+
+def make_jobs():
+    '''
+    :return: trabajos en el orden por pruebas (todas las imágenes de una prueba antes de la siguiente)
+    '''
+    return [{"test": index, "image_name": image, "pipeline": make_prompt(image, **params)}
+            for index, params in enumerate(TESTS) for image in IMAGES]
+
+
+def hits(jobs):
+    return expected_cache_hits([node_signatures(job["pipeline"]) for job in jobs])
+
+
+''' ACCIONES '''
+@pytest.mark.parametrize("order", ORDERS)
+def test_orders_are_permutations_of_the_test_order(order):
+    jobs = make_jobs()
+    ordered = order_jobs(jobs, order)
+    # Ningún trabajo se pierde ni se repite
+    assert len(ordered) == len(jobs)
+    assert sorted(map(id, ordered)) == sorted(map(id, jobs))
+
+
+@pytest.mark.parametrize("order", ["image", "greedy"])
+def test_image_orders_keep_the_images_together(order):
+    ordered = order_jobs(make_jobs(), order)
+    assert [job["image_name"] for job in ordered] == [image for image in IMAGES for _ in TESTS]
+
+
+def test_image_order_keeps_the_test_order_within_each_image():
+    ordered = order_jobs(make_jobs(), "image")
+    assert [job["test"] for job in ordered] == list(range(len(TESTS))) * len(IMAGES)
+
+
+def test_greedy_order_groups_tests_that_share_nodes():
+    ordered = order_jobs(make_jobs(), "greedy")
+    # Dentro de cada imagen, las tres pruebas de cfg (que comparten el recorte) quedan seguidas
+    assert [job["test"] for job in ordered[:len(TESTS)]] == [0, 2, 4, 1, 3]
+
+
+def test_expected_cache_hits_counts_nodes_shared_with_the_previous_prompt():
+    same_crop = [make_prompt("ada.png", cfg=4), make_prompt("ada.png", cfg=8)]
+    other_crop = [make_prompt("ada.png", cfg=4), make_prompt("ada.png", scale_factor=3)]
+    other_image = [make_prompt("ada.png"), make_prompt("alan.png")]
+
+    assert expected_cache_hits([node_signatures(p) for p in same_crop]) == (2, 8)
+    assert expected_cache_hits([node_signatures(p) for p in other_crop]) == (1, 8)
+    assert expected_cache_hits([node_signatures(p) for p in other_image]) == (0, 8)
+    # Un prompt repetido se reutiliza por completo
+    assert expected_cache_hits([node_signatures(same_crop[0])] * 3) == (8, 12)
+
+
+def test_orders_increase_the_expected_cache_hits():
+    jobs = make_jobs()
+    test_hits, total = hits(order_jobs(jobs, "test"))
+    image_hits, _ = hits(order_jobs(jobs, "image"))
+    greedy_hits, _ = hits(order_jobs(jobs, "greedy"))
+    assert total == 4 * len(jobs)
+    assert test_hits < image_hits < greedy_hits
+
+
+def test_node_signatures_follow_upstream_changes_and_normalise_numbers():
+    base = dict(node_signatures(make_prompt("ada.png")))
+    crop = dict(node_signatures(make_prompt("ada.png", scale_factor=3)))
+    assert base["1"] == crop["1"]
+    assert all(base[node_id] != crop[node_id] for node_id in ("2", "3", "4"))
+    # 2 y 2.0 son el mismo valor para ComfyUI
+    assert node_signatures(make_prompt("ada.png", scale_factor=2.0)) == node_signatures(make_prompt("ada.png"))
+
+
+def test_unknown_order_is_rejected():
+    with pytest.raises(ValueError):
+        order_jobs(make_jobs(), "random")
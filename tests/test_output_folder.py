@@ -0,0 +1,45 @@
+import json
+import os
+
+import face_comparison
+import run_comfyui_ablation_study as runner
+from sweep import sweep_tests
+
+''' DECLARACIONES'''
+# Barrido del ejemplo de sweep.py, con un valor que contiene "/"
+SWEEP = {
+    "name": "embeds",
+    "design": "grid",
+    "parameters": {
+        "KSamplerAdvanced.cfg": [4, 7.5],
+        "IPAdapterAdvanced.embeds_scaling": {"values": ["V only", "K+V", "K+V w/ C penalty"]},
+    },
+}
+
+
+''' ACCIONES '''
+def test_safe_value_name_removes_path_separators():
+    assert runner.safe_value_name("K+V w/ C penalty") == "K+V-w--C-penalty"
+    assert runner.safe_value_name("a\\b") == "a-b"
+    assert runner.safe_value_name(2.5) == "2_5"
+
+
+def test_sweep_folders_round_trip_through_parse_test_path(tmp_path):
+    path = tmp_path / "sweep.json"
+    path.write_text(json.dumps(SWEEP), encoding="utf-8")
+
+    labels = set()
+    for test in sweep_tests(str(path)):
+        folder = runner.get_output_folder(*test)
+        # Una sola carpeta por configuración, directamente bajo outputs_refacer/sweep/<nombre>
+        assert folder.parent == runner.Path(runner.OUTPUT_IMAGES_FOLDER) / "sweep" / "embeds"
+        test_type, nodes, parameters, values = face_comparison.parse_test_path(os.path.normpath(str(folder)))
+        assert (test_type, nodes, parameters) == ("sweep", "KSamplerAdvanced|IPAdapterAdvanced", "cfg|embeds_scaling")
+        labels.add(values)
+
+    assert labels == {f"{cfg}|{scaling}" for cfg in ("4", "7_5") for scaling in ("V-only", "K+V", "K+V-w--C-penalty")}
+
+
+def test_parameter_folder_with_slash_is_a_single_level():
+    folder = runner.get_output_folder("parameters", "IPAdapterAdvanced", {"embeds_scaling": "K+V w/ C penalty"})
+    assert face_comparison.parse_test_path(os.path.normpath(str(folder))) == ("parameters", "IPAdapterAdvanced", "embeds_scaling", "K+V-w--C-penalty")
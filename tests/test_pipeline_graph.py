@@ -0,0 +1,84 @@
+import copy
+
+import run_comfyui_ablation_study as runner
+from pipeline_graph import Pipeline
+from run_manifest import pipeline_hash
+
+''' DECLARACIONES'''
+# Grafo reducido con la estructura de Refacer: modelo -> LoRA -> TGate -> IPAdapter -> sampler -> SaveImage,
+# con la cadena de carga del IPAdapter (modelo, CLIP Vision e imagen preparada) que solo alimenta al IPAdapter
+NODES = {
+    "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sdxl.safetensors"}},
+    "2": {"class_type": "LoraLoaderModelOnly", "inputs": {"model": ["1", 0], "strength_model": 1.0}},
+    "3": {"class_type": "TGateApplySimple", "inputs": {"model": ["2", 0], "start_at": 0.5}},
+    "4": {"class_type": "IPAdapterModelLoader", "inputs": {"ipadapter_file": "ip-adapter.safetensors"}},
+    "5": {"class_type": "CLIPVisionLoader", "inputs": {"clip_name": "clip_vision.safetensors"}},
+    "6": {"class_type": "LoadImage", "inputs": {"image": "retrato.png"}},
+    "7": {"class_type": "PrepImageForClipVision", "inputs": {"image": ["6", 0]}},
+    "8": {"class_type": "IPAdapterAdvanced", "inputs": {"model": ["3", 0], "ipadapter": ["4", 0], "image": ["7", 0], "clip_vision": ["5", 0], "weight": 1.0}},
+    "9": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["1", 1], "text": "photo"}},
+    "10": {"class_type": "EmptyLatentImage", "inputs": {"width": 1024, "height": 1024, "batch_size": 1}},
+    "11": {"class_type": "KSamplerAdvanced", "inputs": {"model": ["8", 0], "positive": ["9", 0], "negative": ["9", 0], "latent_image": ["10", 0], "cfg": 7}},
+    "12": {"class_type": "VAEDecode", "inputs": {"samples": ["11", 0], "vae": ["1", 2]}},
+    "13": {"class_type": "SaveImage", "inputs": {"images": ["12", 0], "filename_prefix": "ComfyUI"}},
+}
+LOAD_IMAGE_NODE_ID = "6"
+SAVE_IMAGE_NODE_ID = "13"
+
+
+def ablation_test(test_type, node_name):
+    return next(test for test in runner.ABLATION_TESTS if test[:2] == (test_type, node_name))
+
+
+def links(prompt):
+    '''
+    :return: lista de tuplas (nodo, input, nodo origen) de las conexiones del prompt
+    '''
+    return [(node_id, name, value[0]) for node_id, node in prompt.items() for name, value in node["inputs"].items()
+            if isinstance(value, list) and len(value) == 2]
+
+
+''' ACCIONES '''
+def test_prune_removes_the_bypassed_ipadapter_chain():
+    base = Pipeline(copy.deepcopy(NODES))
+    variant = runner.bypass_nodes(base.variant(), "IPAdapterAdvanced", "TGateApplySimple", ["KSamplerAdvanced"])
+
+    removed = variant.prune([SAVE_IMAGE_NODE_ID])
+    prompt = variant.to_prompt()
+
+    assert sorted(removed, key=int) == ["4", "5", "6", "7", "8"]
+    assert prompt["11"]["inputs"]["model"] == ["3", 0]
+    # Todas las conexiones que quedan apuntan a nodos del prompt
+    assert all(source in prompt for _, _, source in links(prompt))
+
+
+def test_prune_does_not_mutate_the_base_pipeline():
+    nodes = copy.deepcopy(NODES)
+    base = Pipeline(nodes)
+    variant = runner.bypass_nodes(base.variant(), "IPAdapterAdvanced", "TGateApplySimple", ["KSamplerAdvanced"])
+    variant.prune([SAVE_IMAGE_NODE_ID])
+
+    # Copy-on-write: el pipeline base y las demás variantes conservan todos los nodos y conexiones
+    assert nodes == NODES
+    assert base.nodes["11"]["inputs"]["model"] == ["8", 0]
+    assert base.ids_by_class("IPAdapterAdvanced") == ["8"]
+    assert base.variant().to_prompt() == NODES
+    # Los nodos sin cambios se comparten con el pipeline base
+    assert variant.to_prompt()["12"] is nodes["12"]
+
+
+def test_prune_keeps_a_fully_connected_pipeline():
+    variant = Pipeline(copy.deepcopy(NODES)).variant()
+    assert variant.prune([SAVE_IMAGE_NODE_ID]) == []
+    assert variant.to_prompt() == NODES
+
+
+def test_bypass_prompt_from_build_pipeline_has_no_dead_nodes():
+    base = Pipeline(copy.deepcopy(NODES))
+    prompt = runner.build_pipeline(base, ablation_test("bypass", "IPAdapterAdvanced"), "retrato.png", LOAD_IMAGE_NODE_ID, SAVE_IMAGE_NODE_ID)
+    unmodified = runner.build_pipeline(base, ("parameters", "KSamplerAdvanced", {"cfg": 7}), "retrato.png", LOAD_IMAGE_NODE_ID, SAVE_IMAGE_NODE_ID)
+
+    assert not {"IPAdapterAdvanced", "IPAdapterModelLoader", "CLIPVisionLoader", "PrepImageForClipVision"} & {node["class_type"] for node in prompt.values()}
+    assert all(source in prompt for _, _, source in links(prompt))
+    assert set(unmodified) == set(NODES)
+    assert pipeline_hash(prompt) != pipeline_hash(unmodified)
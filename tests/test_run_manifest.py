@@ -0,0 +1,48 @@
+from run_manifest import RunManifest, canonical_value, job_key, pipeline_hash
+
+''' DECLARACIONES'''
+def sampler(seed, cfg=7):
+    return {"3": {"class_type": "KSamplerAdvanced", "inputs": {"noise_seed": seed, "cfg": cfg, "model": ["4", 0]}}}
+
+
+''' ACCIONES '''
+def test_integral_floats_hash_like_ints():
+    assert canonical_value(4.0) == 4 and isinstance(canonical_value(4.0), int)
+    assert pipeline_hash(sampler(11, cfg=4)) == pipeline_hash(sampler(11, cfg=4.0))
+    assert pipeline_hash(sampler(11, cfg=4.5)) != pipeline_hash(sampler(11, cfg=4))
+
+
+def test_large_integer_seeds_keep_distinct_hashes():
+    seed = 2 ** 53
+    # Como float, seed y seed + 1 son el mismo número
+    assert float(seed) == float(seed + 1)
+    assert canonical_value(seed + 1) == seed + 1
+    assert pipeline_hash(sampler(seed)) != pipeline_hash(sampler(seed + 1))
+    assert pipeline_hash(sampler(2 ** 64 - 1)) != pipeline_hash(sampler(2 ** 64 - 2))
+
+
+def test_booleans_and_links_are_kept():
+    assert canonical_value(True) is True
+    assert canonical_value({"model": ["4", 0], "values": [1.0, 2.5]}) == {"model": ["4", 0], "values": [1, 2.5]}
+
+
+def test_manifest_resume_keeps_the_last_state(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    key = job_key(pipeline_hash(sampler(11)), "outputs_refacer/parameters/KSamplerAdvanced/noise_seed/11")
+    with RunManifest(path) as manifest:
+        manifest.record(key, "submitted", prompt_id="a")
+        manifest.record(key, "done", outputs=[])
+    with open(path, "a", encoding="utf-8") as f:
+        # Última línea incompleta de una ejecución interrumpida
+        f.write('{"key": "')
+
+    with RunManifest(path, resume=True) as manifest:
+        assert manifest.jobs[key]["state"] == "done"
+        assert manifest.jobs[key]["prompt_id"] == "a"
+        assert manifest.is_done(key)
+        assert manifest.in_flight() == []
+        manifest.record(key, "failed")
+
+    # El evento escrito tras la línea incompleta se conserva
+    with RunManifest(path, resume=True) as manifest:
+        assert manifest.jobs[key]["state"] == "failed"
@@ -0,0 +1,226 @@
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+import fake_comfyui_server
+import run_comfyui_ablation_study as runner
+from comfyui_client import ComfyUIClient, ComfyUIPool
+from run_manifest import RunManifest, job_key, pipeline_hash
+
+''' DECLARACIONES'''
+# Pipeline mínimo en formato API: LoadImage -> KSamplerAdvanced -> SaveImage
+BASE_PIPELINE = {
+    "1": {"class_type": "LoadImage", "inputs": {"image": "/inputs/persona.png"}},
+    "2": {"class_type": "KSamplerAdvanced", "inputs": {"cfg": 7, "noise_seed": 0, "latent_image": ["1", 0]}},
+    "3": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["2", 0]}},
+}
+SAVE_IMAGE_NODE_ID = "3"
+POLL_INTERVAL = 0.02
+
+
+def make_jobs(output_root, values, images=("persona.png",)):
+    '''
+    Trabajos de una prueba paramétrica de cfg, con la carpeta de cada valor dentro de la salida del servidor.
+
+    :param output_root: carpeta de salida del servidor simulado
+    :param values: valores de cfg
+    :param images: nombres de las imágenes de entrada
+    :return: lista de trabajos con su pipeline en "pipeline"
+    '''
+    jobs = []
+    for value in values:
+        folder = Path(output_root) / "outputs_refacer" / "parameters" / "KSamplerAdvanced" / "cfg" / str(value)
+        folder.mkdir(parents=True, exist_ok=True)
+        for image_name in images:
+            pipeline = json.loads(json.dumps(BASE_PIPELINE))
+            pipeline["1"]["inputs"]["image"] = f"/inputs/{image_name}"
+            pipeline["2"]["inputs"]["cfg"] = value
+            jobs.append({"test": ("parameters", "KSamplerAdvanced", {"cfg": value}), "image_name": image_name, "output_folder": folder, "pipeline": pipeline})
+    return jobs
+
+
+def run(client, jobs, manifest, **kwargs):
+    '''
+    Ejecuta los trabajos con execute_jobs y devuelve las rutas entregadas a on_done.
+    '''
+    delivered = []
+    runner.execute_jobs(client, jobs, build=None, manifest=manifest, save_image_node_id=SAVE_IMAGE_NODE_ID, queue_depth=4,
+                        on_done=lambda job, outputs: delivered.append((job["output_folder"], list(outputs))), poll_interval=POLL_INTERVAL, **kwargs)
+    return delivered
+
+
+def states(manifest):
+    return sorted(event["state"] for event in manifest.jobs.values())
+
+
+def kill_after(httpd, fake, prompts):
+    '''
+    Apaga un servidor simulado después de aceptar un número de prompts: deja de aceptar conexiones y las
+    conexiones abiertas se cortan en la siguiente petición.
+
+    :param httpd: servidor HTTP
+    :param fake: servidor ComfyUI simulado
+    :param prompts: prompts aceptados antes de apagarse
+    '''
+    accepted = []
+    queue_prompt = fake.queue_prompt
+
+    def dead(*args, **kwargs):
+        raise ConnectionResetError("servidor apagado")
+
+    def kill():
+        httpd.shutdown()
+        httpd.server_close()
+        for name in ("queue_prompt", "queue_status", "get_history", "read_output", "delete", "interrupt"):
+            setattr(fake, name, dead)
+
+    def counting_queue_prompt(prompt, prompt_id=None):
+        response = queue_prompt(prompt, prompt_id)
+        accepted.append(prompt)
+        if len(accepted) == prompts:
+            threading.Thread(target=kill, daemon=True).start()
+        return response
+
+    fake.queue_prompt = counting_queue_prompt
+
+
+@pytest.fixture
+def server(tmp_path):
+    httpd, fake = fake_comfyui_server.serve(str(tmp_path / "output"), port=0, delay=0.01)
+    yield httpd, fake
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    httpd, _ = server
+    with ComfyUIClient(f"127.0.0.1:{httpd.server_port}", output_dir=str(tmp_path / "output")) as client:
+        yield client
+
+
+''' ACCIONES '''
+def test_execute_jobs_saves_each_image_in_its_test_folder(server, client, tmp_path):
+    _, fake = server
+    jobs = make_jobs(tmp_path / "output", [1, 2, 3])
+    with RunManifest(str(tmp_path / "manifest.jsonl")) as manifest:
+        delivered = run(client, jobs, manifest)
+
+    assert fake.executed == 3
+    assert states(manifest) == ["done"] * 3
+    assert len(delivered) == 3
+    for job in jobs:
+        images = sorted(job["output_folder"].glob("*.png"))
+        assert [image.name for image in images] == ["ComfyUI_00001_.png"]
+        assert manifest.jobs[job["key"]]["outputs"] == [str(images[0])]
+
+
+def test_execute_jobs_downloads_from_remote_server(server, tmp_path):
+    httpd, fake = server
+    jobs = make_jobs(tmp_path / "remote_tests", [1, 2])
+    with ComfyUIClient(f"127.0.0.1:{httpd.server_port}") as client, RunManifest(str(tmp_path / "manifest.jsonl")) as manifest:
+        run(client, jobs, manifest)
+
+    assert fake.executed == 2
+    for job in jobs:
+        # Descargada con /view: la carpeta de la prueba no está en la salida del servidor
+        assert (job["output_folder"] / "ComfyUI_00001_.png").read_bytes() == fake_comfyui_server.placeholder_png()
+        assert not list(job["output_folder"].glob("*.tmp"))
+
+
+def test_resume_skips_completed_jobs(server, client, tmp_path):
+    _, fake = server
+    path = str(tmp_path / "manifest.jsonl")
+    with RunManifest(path) as manifest:
+        run(client, make_jobs(tmp_path / "output", [1, 2]), manifest)
+    assert fake.executed == 2
+
+    with RunManifest(path, resume=True) as manifest:
+        delivered = run(client, make_jobs(tmp_path / "output", [1, 2, 3]), manifest)
+
+    # Solo se genera el trabajo nuevo; los terminados se entregan a on_done sin volver a ejecutarse
+    assert fake.executed == 3
+    assert len(delivered) == 3
+    assert states(manifest) == ["done"] * 3
+
+
+def test_resume_reruns_jobs_whose_images_were_deleted(server, client, tmp_path):
+    _, fake = server
+    path = str(tmp_path / "manifest.jsonl")
+    with RunManifest(path) as manifest:
+        jobs = make_jobs(tmp_path / "output", [1, 2])
+        run(client, jobs, manifest)
+    (jobs[0]["output_folder"] / "ComfyUI_00001_.png").unlink()
+
+    with RunManifest(path, resume=True) as manifest:
+        run(client, make_jobs(tmp_path / "output", [1, 2]), manifest)
+
+    assert fake.executed == 3
+    assert (jobs[0]["output_folder"] / "ComfyUI_00002_.png").exists()
+
+
+def test_resume_recovers_prompts_submitted_before_the_interruption(server, client, tmp_path):
+    _, fake = server
+    fake.delay = 0.2
+    path = str(tmp_path / "manifest.jsonl")
+    # Ejecución interrumpida: dos prompts enviados (uno terminará antes de reanudar y otro seguirá en cola),
+    # uno registrado con un id que el servidor no conoce y otro sin enviar
+    with RunManifest(path) as manifest:
+        for index, job in enumerate(make_jobs(tmp_path / "output", [1, 2, 3])):
+            job["cache_key"] = pipeline_hash(job["pipeline"])
+            job["key"] = job_key(job["cache_key"], job["output_folder"])
+            runner.route_output(job, SAVE_IMAGE_NODE_ID, client.output_dir)
+            prompt_id = client.queue_prompt(job["pipeline"])["prompt_id"] if index < 2 else "desconocido"
+            manifest.record(job["key"], "submitted", prompt_id=prompt_id, image=job["image_name"], output_folder=str(job["output_folder"]))
+
+    with RunManifest(path, resume=True) as manifest:
+        jobs = make_jobs(tmp_path / "output", [1, 2, 3, 4])
+        delivered = run(client, jobs, manifest)
+
+    # Los dos prompts que el servidor conocía no se vuelven a generar
+    assert fake.executed == 4
+    assert len(delivered) == 4
+    assert states(manifest) == ["done"] * 4
+    for job in jobs:
+        assert [image.name for image in job["output_folder"].glob("*.png")] == ["ComfyUI_00001_.png"]
+
+
+def test_batched_jobs_share_a_prompt_and_keep_their_folders(server, client, tmp_path):
+    _, fake = server
+    jobs = make_jobs(tmp_path / "output", [1, 2, 3, 4])
+    with RunManifest(str(tmp_path / "manifest.jsonl")) as manifest:
+        run(client, jobs, manifest, batch_size=2)
+
+    assert fake.executed == 2
+    assert states(manifest) == ["done"] * 4
+    assert len({event["prompt_id"] for event in manifest.jobs.values()}) == 2
+    for job in jobs:
+        assert [image.name for image in job["output_folder"].glob("*.png")] == ["ComfyUI_00001_.png"]
+
+
+def test_pool_fails_over_when_a_server_dies(tmp_path):
+    # El primer servidor es lento: sus prompts siguen en cola cuando se apaga y se reenvían a los demás
+    servers = [fake_comfyui_server.serve(str(tmp_path / f"server{index}"), port=0, delay=5.0 if index == 0 else 0.01) for index in range(3)]
+    kill_after(*servers[0], prompts=2)
+    jobs = make_jobs(tmp_path / "tests", range(12))
+    try:
+        with ComfyUIPool([f"127.0.0.1:{httpd.server_port}" for httpd, _ in servers], retries=1, backoff=0.01, timeout=5) as pool, \
+                RunManifest(str(tmp_path / "manifest.jsonl")) as manifest:
+            delivered = run(pool, jobs, manifest)
+            prompts = dict(pool.prompts)
+    finally:
+        for httpd, _ in servers[1:]:
+            httpd.shutdown()
+            httpd.server_close()
+
+    # Todos los trabajos terminan una sola vez, con una única imagen en su carpeta
+    assert sorted(str(folder) for folder, _ in delivered) == sorted(str(job["output_folder"]) for job in jobs)
+    assert states(manifest) == ["done"] * len(jobs)
+    assert servers[0][1].executed == 0
+    assert sum(fake.executed for _, fake in servers[1:]) == len(jobs)
+    for job in jobs:
+        assert [image.name for image in job["output_folder"].glob("*.png")] == ["ComfyUI_00001_.png"]
+    # Los prompts terminados no quedan en el conjunto
+    assert prompts == {}